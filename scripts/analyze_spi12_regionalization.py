@@ -38,12 +38,13 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import xarray as xr
-from joblib import Parallel, delayed
-from scipy.stats import gamma as gamma_dist, norm, pearsonr
+from scipy.stats import pearsonr
 from sklearn.cluster import KMeans
 from sklearn.decomposition import PCA
 
 from region_config import REGIONS, Region, region_table, resolve_region
+from spi_blocks import spi_family_shared
+from spi_engine import rolling_sum, spi_by_calendar_month
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
@@ -217,65 +218,14 @@ def load_grid_mask(mask_file: Path, pr: xr.DataArray, mask_var: str) -> xr.DataA
         mask_ds.close()
 
 
-def rolling_sum_1d(series: np.ndarray, window: int) -> np.ndarray:
-    out = np.full(len(series), np.nan, dtype=np.float64)
-    for t in range(window - 1, len(series)):
-        block = series[t - window + 1 : t + 1]
-        if np.any(np.isnan(block)):
-            continue
-        out[t] = np.sum(block)
-    return out
-
-
-def precip_to_spi(series: np.ndarray, baseline_mask: np.ndarray) -> np.ndarray:
-    """
-    Match make_spi_labels.py SPI convention for one calendar-month subset:
-    fit gamma to nonzero baseline values, include p_zero, and normal-quantile transform.
-    """
-    base = series[baseline_mask]
-    base = base[~np.isnan(base)]
-    spi = np.full(len(series), np.nan, dtype=np.float32)
-
-    if len(base) < 10:
-        return spi
-
-    p_zero = np.mean(base == 0)
-    nonzero = base[base > 0]
-    if len(nonzero) < 5:
-        return spi
-
-    fit_alpha, _, fit_beta = gamma_dist.fit(nonzero, floc=0)
-
-    for i, val in enumerate(series):
-        if np.isnan(val):
-            continue
-        if val == 0:
-            cdf_val = p_zero
-        else:
-            cdf_val = p_zero + (1.0 - p_zero) * gamma_dist.cdf(val, fit_alpha, scale=fit_beta)
-        cdf_val = np.clip(cdf_val, 1e-6, 1.0 - 1e-6)
-        spi[i] = norm.ppf(cdf_val)
-
-    return spi
-
-
-def compute_spi12_for_pixel(
-    series: np.ndarray,
+def compute_spi12_block(
+    pr_block: np.ndarray,
     months_arr: np.ndarray,
     baseline_mask: np.ndarray,
 ) -> np.ndarray:
-    rolled = rolling_sum_1d(series.astype(np.float64), SPI_WINDOW)
-    spi12 = np.full(len(series), np.nan, dtype=np.float32)
-
-    for month in range(1, 13):
-        month_idx = np.where(months_arr == month)[0]
-        base_idx = np.where(baseline_mask & (months_arr == month))[0]
-        mask_for_month = np.zeros(len(series), dtype=bool)
-        mask_for_month[base_idx] = True
-        base_within_month = mask_for_month[month_idx]
-        spi12[month_idx] = precip_to_spi(rolled[month_idx], base_within_month)
-
-    return spi12
+    """SPI-12 for a (time, pixel) block using whole-array gamma fits."""
+    rolled = rolling_sum(pr_block, SPI_WINDOW)
+    return spi_by_calendar_month(rolled, months_arr, baseline_mask)
 
 
 def compute_spi12_grid(
@@ -297,7 +247,7 @@ def compute_spi12_grid(
 
     ntimes, nlat, nlon = pr_vals.shape
     n_pixels = nlat * nlon
-    flat = pr_vals.reshape(ntimes, n_pixels).T
+    flat = pr_vals.reshape(ntimes, n_pixels)
 
     print(
         f"Computing diagnostic SPI-12 for {n_pixels:,} pixels, {ntimes} months, "
@@ -305,18 +255,11 @@ def compute_spi12_grid(
     )
 
     if n_jobs > 1:
-        results = Parallel(n_jobs=n_jobs, verbose=10, batch_size=64)(
-            delayed(compute_spi12_for_pixel)(flat[i], months_arr, baseline_mask)
-            for i in range(n_pixels)
-        )
+        spi_flat = spi_family_shared(flat, months_arr, baseline_mask, (SPI_WINDOW,), n_jobs)[0]
     else:
-        results = []
-        for i in range(n_pixels):
-            if i and i % 1000 == 0:
-                print(f"  SPI-12 pixels done: {i:,}/{n_pixels:,}")
-            results.append(compute_spi12_for_pixel(flat[i], months_arr, baseline_mask))
+        spi_flat = compute_spi12_block(flat, months_arr, baseline_mask)
 
-    spi_vals = np.asarray(results, dtype=np.float32).T.reshape(ntimes, nlat, nlon)
+    spi_vals = spi_flat.astype(np.float32).reshape(ntimes, nlat, nlon)
     spi12 = xr.DataArray(
         spi_vals,
         coords={"time": pr["time"], "latitude": pr["latitude"], "longitude": pr["longitude"]},
@@ -37,7 +37,8 @@ Inputs
 """
 from pathlib import Path
 import numpy as np
-import xarray as xr
+
+from cube_store import open_cube
 
 BASE_DIR = Path(__file__).resolve().parents[1]
 PROC     = BASE_DIR / "data" / "processed"
@@ -52,8 +53,8 @@ TARGET_ALIGNMENT_VERSION = "t_plus_1_single_shift_v2"
 
 # --------------------------------------------------------------------------
 print("Loading data ...")
-pr_ds  = xr.open_dataset(PR_FILE).load()
-spi_ds = xr.open_dataset(SPI_FILE).load()
+pr_ds  = open_cube(PR_FILE, variables=["pr"])
+spi_ds = open_cube(SPI_FILE, variables=["spi1", "spi3", "spi6", "drought_label_spi1"])
 
 pr    = pr_ds["pr"].astype("float32")                # (time, lat, lon)
 spi1  = spi_ds["spi1"].astype("float32")
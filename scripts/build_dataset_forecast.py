@@ -23,13 +23,14 @@ Features:
   nino34_lag1, nino34_lag2          — optional ENSO Niño3.4 index at t, t-1
   pdo_lag1, pdo_lag2                — optional PDO index at t, t-1
   year                              — calendar year of the TARGET month
+  pixel_id, month_index             — integer grid/month keys (grid_registry.py), not features
 
 Input:
   data/processed/chirps_v3_monthly_cvalley_1991_2026.nc
   data/processed/chirps_v3_monthly_cvalley_spi_1991_2026.nc
 
 Output:
-  data/processed/dataset_forecast.parquet
+  data/processed/dataset_forecast.parquet      (one row group per target year)
   data/processed/dataset_forecast_sample.csv   (first 10 k rows)
 
 Optional input (for exogenous features):
@@ -43,7 +44,15 @@ from argparse import ArgumentParser
 from pathlib import Path
 import numpy as np
 import pandas as pd
-import xarray as xr
+
+from cube_store import open_cube
+from grid_registry import grid_registry
+from tabular_builder import (
+    FEATURE_LAGS,
+    iter_target_year_blocks,
+    month_start,
+    write_blocks,
+)
 
 PROCESSED   = Path("data/processed")
 PR_FILE     = PROCESSED / "chirps_v3_monthly_cvalley_1991_2026.nc"
@@ -74,11 +83,8 @@ if args.no_climate_indices:
 
 # ---------- load ----------
 print("Loading datasets...")
-pr_ds  = xr.open_dataset(PR_FILE).load()
-spi_ds = xr.open_dataset(SPI_FILE).load()
-
-lat_name = "latitude" if "latitude" in pr_ds.coords else "lat"
-lon_name = "longitude" if "longitude" in pr_ds.coords else "lon"
+pr_ds  = open_cube(PR_FILE, variables=["pr"])
+spi_ds = open_cube(SPI_FILE, variables=["spi1", "spi3", "spi6", "drought_label_spi1"])
 
 pr    = pr_ds["pr"]                     # (time, lat, lon)
 spi1  = spi_ds["spi1"]
@@ -92,46 +98,30 @@ spi3  = spi3.sel(time=pr.time)
 spi6  = spi6.sel(time=pr.time)
 label = label.sel(time=pr.time)
 
-# ---------- TARGET: shift label back by 1 so that target[t] = label[t+1] ----------
-# xarray shift(time=-1) moves data backward by 1 step: target_at_t = label_at_{t+1}
+# pixel_id in the table indexes this grid; fail early if it was renumbered.
+grid_registry(PR_FILE)
+
+times = month_start(pr.time.values)
+cubes = {
+    "pr": pr.values,
+    "spi1": spi1.values,
+    "spi3": spi3.values,
+    "spi6": spi6.values,
+    "label": label.values,
+}
+
+# ---------- TARGET: label one month ahead, target[t] = label[t+1] ----------
 # Using drought_label_spi1[t+1]: SPI-1 depends only on pr[t+1], so features at t
 # contain zero accumulation-window information about the target.
-target = label.shift(time=-1)   # shift=-1: target[t] = label[t+1]
-target.name = "target_label"
+TARGETS = {"target_label": ("label", 1)}
 
 # ---------- FEATURES (all lagged, no future information) ----------
 # "lag1" = current month value, "lag2" = previous month, etc.
-spi1_lag1 = spi1.copy(); spi1_lag1.name = "spi1_lag1"
-spi1_lag2 = spi1.shift(time=1);  spi1_lag2.name = "spi1_lag2"
-spi1_lag3 = spi1.shift(time=2);  spi1_lag3.name = "spi1_lag3"
-spi3_lag1 = spi3.copy(); spi3_lag1.name = "spi3_lag1"
-spi6_lag1 = spi6.copy(); spi6_lag1.name = "spi6_lag1"
-pr_lag1   = pr.copy();   pr_lag1.name = "pr_lag1"
-pr_lag2   = pr.shift(time=1);  pr_lag2.name = "pr_lag2"
-pr_lag3   = pr.shift(time=2);  pr_lag3.name = "pr_lag3"
-
-# ---------- stack spatial dims → flat DataFrame ----------
-ds_stacked = xr.Dataset({
-    "spi1_lag1": spi1_lag1,
-    "spi1_lag2": spi1_lag2,
-    "spi1_lag3": spi1_lag3,
-    "spi3_lag1": spi3_lag1,
-    "spi6_lag1": spi6_lag1,
-    "pr_lag1":   pr_lag1,
-    "pr_lag2":   pr_lag2,
-    "pr_lag3":   pr_lag3,
-    "target_label": target,
-}).stack(pixel=(lat_name, lon_name))
-
-ds_flat = ds_stacked.reset_index("pixel")
-df = ds_flat.to_dataframe()
-if "time" not in df.columns:
-    df = df.reset_index()
-
-df["time"] = pd.to_datetime(df["time"]).dt.to_period("M").dt.to_timestamp()
+# FEATURE_LAGS maps each column to (cube, lag): spi1_lag2 = spi1[t-1], pr_lag3 = pr[t-2], ...
+feat_cols = list(FEATURE_LAGS)
 
 # ---------- optional exogenous climate indices (ENSO / PDO) ----------
-exog_cols = []
+exog = {}
 if args.climate_features == "none":
     print("Skipping optional ENSO/PDO features.")
 elif CLIMATE_FILE.exists():
@@ -160,67 +150,43 @@ elif CLIMATE_FILE.exists():
         list(MISSING_SENTINELS), np.nan
     )
 
-    all_times = pd.DatetimeIndex(sorted(df["time"].unique()))
-    cdf = cdf.reindex(all_times).sort_index()
+    cdf = cdf.reindex(pd.DatetimeIndex(times)).sort_index()
     cdf[selected_climate_cols] = cdf[selected_climate_cols].interpolate(
         method="time", limit_area="inside"
     )
 
-    if "nino34" in selected_climate_cols:
-        cdf["nino34_lag1"] = cdf["nino34"]
-        cdf["nino34_lag2"] = cdf["nino34"].shift(1)
-        exog_cols.extend(["nino34_lag1", "nino34_lag2"])
-    if "pdo" in selected_climate_cols:
-        cdf["pdo_lag1"] = cdf["pdo"]
-        cdf["pdo_lag2"] = cdf["pdo"].shift(1)
-        exog_cols.extend(["pdo_lag1", "pdo_lag2"])
-    cdf = cdf.drop(columns=selected_climate_cols)
-
-    map_df = cdf.reset_index().rename(columns={"index": "time"})
-    df = df.merge(map_df[["time"] + exog_cols], on="time", how="left")
-    print(f"Added optional exogenous features: {exog_cols}")
-    missing_exog_rows = int(df[exog_cols].isna().any(axis=1).sum())
-    if missing_exog_rows:
-        print(
-            f"Rows with missing optional exogenous features before dropna: "
-            f"{missing_exog_rows:,}"
-        )
+    for col in selected_climate_cols:
+        exog[f"{col}_lag1"] = cdf[col].to_numpy()
+        exog[f"{col}_lag2"] = cdf[col].shift(1).to_numpy()
+    print(f"Added optional exogenous features: {list(exog)}")
 else:
     print(f"Climate file not found, proceeding without exogenous features: {CLIMATE_FILE}")
+exog_cols = list(exog)
+
+# ---------- gather valid pixel-months straight from the cubes ----------
+# Rows with a NaN target (last time step, or masked) or any NaN feature are
+# never materialised. Blocks are built and written one target year at a time,
+# so readers can prune train/val/test splits by row-group statistics; see
+# tabular_builder.py. The label cube decodes as float (NaN fill), and every
+# kept target is finite, so it is stored as int8.
+blocks = (
+    {**columns, "target_label": columns["target_label"].astype(np.int8)}
+    for columns in iter_target_year_blocks(
+        times, pr.latitude.values, pr.longitude.values, cubes, FEATURE_LAGS, TARGETS, lead=1, exog=exog
+    )
+)
 
-# ---------- drop rows where target is NaN (last time step after shift, or masked) ----------
-feat_cols = ["spi1_lag1", "spi1_lag2", "spi1_lag3",
-             "spi3_lag1", "spi6_lag1",
-             "pr_lag1", "pr_lag2", "pr_lag3"]
-df = df.dropna(subset=["target_label"] + feat_cols + exog_cols).copy()
-
-# ---------- time features of the TARGET month ----------
-target_time = pd.to_datetime(df["time"]) + pd.DateOffset(months=1)
-df["month"] = target_time.dt.month
-df["year"]  = target_time.dt.year
-df["month_sin"] = np.sin(2 * np.pi * df["month"] / 12.0)
-df["month_cos"] = np.cos(2 * np.pi * df["month"] / 12.0)
-
-# rename coords
-df = df.rename(columns={lat_name: "latitude", lon_name: "longitude"})
-
-# cast target
-df["target_label"] = df["target_label"].astype(np.int8)
-
-# reorder
+# column order
 cols = (
-    ["time", "year", "month", "month_sin", "month_cos", "latitude", "longitude"]
+    ["time", "year", "month", "month_sin", "month_cos", "latitude", "longitude", "pixel_id", "month_index"]
     + feat_cols
     + exog_cols
     + ["target_label"]
 )
-df = df[cols]
 
 # ---------- save ----------
-OUT_PARQUET.parent.mkdir(parents=True, exist_ok=True)
-df.to_parquet(OUT_PARQUET, index=False)
-df.head(10_000).to_csv(OUT_SAMPLE, index=False)
+summary = write_blocks(OUT_PARQUET, blocks, cols, sample_file=OUT_SAMPLE)
 
-print("Wrote:", OUT_PARQUET, f"(rows={len(df):,}, cols={df.shape[1]})")
+print("Wrote:", OUT_PARQUET, f"(rows={summary.rows:,}, cols={len(cols)}, row groups={summary.row_groups})")
 print("Wrote:", OUT_SAMPLE)
-print("Class distribution:\n", df["target_label"].value_counts().sort_index())
+print("Class distribution:\n", summary.class_counts)
@@ -1,12 +1,32 @@
 #!/usr/bin/env python
-"""Build leakage-safe seasonal datasets for SPI-k targets at configurable lead times."""
+"""Build leakage-safe seasonal datasets for SPI-k targets at configurable lead times.
+
+SPI-3/6 targets come from the SPI label file. Any other window (e.g. SPI-9,
+SPI-12, SPI-24) is read from the SPI family cube written by make_spi_family.py
+when it exists, so no accumulation is recomputed here.
+"""
+from __future__ import annotations
+
 from argparse import ArgumentParser
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 import xarray as xr
 
+from cube_store import open_cube
+from spi_engine import family_windows
+from tabular_builder import (
+    FEATURE_LAGS,
+    build_lagged_columns,
+    class_counts,
+    columns_to_table,
+    month_start,
+    target_time_columns,
+    write_columns,
+)
+
 PROCESSED = Path("data/processed")
 PR_FILE = PROCESSED / "chirps_v3_monthly_cvalley_1991_2026.nc"
 SPI_FILE = PROCESSED / "chirps_v3_monthly_cvalley_spi_1991_2026.nc"
@@ -14,6 +34,24 @@ CLIMATE_FILE = PROCESSED / "climate_indices_monthly.csv"
 MISSING_SENTINELS = (-9.9, -99.99, -999.0)
 
 
+def spi_family_path(spi_file: Path) -> Path:
+    """SPI family cube written by make_spi_family.py next to an SPI label file."""
+    return spi_file.with_name(spi_file.name.replace("_spi_", "_spi_family_", 1))
+
+
+SPI_FAMILY_FILE = spi_family_path(SPI_FILE)
+
+
+def target_spi_map(spi_ds: xr.Dataset, family_file: Path | None) -> dict[int, xr.DataArray]:
+    """SPI-3/6 from the label file plus every other window in the family cube, if present."""
+    spi_map = {3: spi_ds["spi3"], 6: spi_ds["spi6"]}
+    if family_file is not None and family_file.exists():
+        family = open_cube(family_file, variables=["spi"])
+        for window, da in family_windows(family).items():
+            spi_map.setdefault(window, da)
+    return spi_map
+
+
 def parse_args():
     parser = ArgumentParser(description=__doc__)
     parser.add_argument(
@@ -28,7 +66,13 @@ def parse_args():
         nargs="+",
         type=int,
         default=[3, 6],
-        help="Target SPI windows (e.g., 3 6).",
+        help="Target SPI windows (e.g., 3 6); windows other than 3/6 need --spi-family-file.",
+    )
+    parser.add_argument(
+        "--spi-family-file",
+        type=Path,
+        default=SPI_FAMILY_FILE,
+        help="SPI family cube from make_spi_family.py (used when it exists).",
     )
     parser.add_argument(
         "--climate-features",
@@ -87,69 +131,55 @@ def _climate_lags(all_times: pd.DatetimeIndex, climate_features: str) -> pd.Data
     return cdf[out_cols].reset_index().rename(columns={"index": "time"})
 
 
-def _build_one(pr, spi1, spi3, spi6, spi_target, lead: int, spi_idx: int, lat_name: str, lon_name: str, climate_features: str) -> pd.DataFrame:
-    target_value = spi_target.shift(time=-lead)
-    target_label = xr.where(
-        target_value <= -1.0,
-        -1,
-        xr.where(target_value >= 1.0, 1, 0),
-    ).where(target_value.notnull())
-    target_label.name = f"target_label_spi{spi_idx}"
-    target_value.name = f"target_spi{spi_idx}"
-
-    ds = xr.Dataset(
-        {
-            "spi1_lag1": spi1,
-            "spi1_lag2": spi1.shift(time=1),
-            "spi1_lag3": spi1.shift(time=2),
-            "spi3_lag1": spi3,
-            "spi6_lag1": spi6,
-            "pr_lag1": pr,
-            "pr_lag2": pr.shift(time=1),
-            "pr_lag3": pr.shift(time=2),
-            target_value.name: target_value,
-            target_label.name: target_label,
-        }
-    ).stack(pixel=(lat_name, lon_name))
-
-    df = ds.reset_index("pixel").to_dataframe()
-    if "time" not in df.columns:
-        df = df.reset_index()
-    df["time"] = pd.to_datetime(df["time"]).dt.to_period("M").dt.to_timestamp()
-    df = df.rename(columns={lat_name: "latitude", lon_name: "longitude"})
-
-    all_times = pd.DatetimeIndex(sorted(df["time"].unique()))
-    climate_df = _climate_lags(all_times, climate_features)
+def _build_table(pr, spi1, spi3, spi6, spi_target, lead: int, spi_idx: int, lat_name: str, lon_name: str, climate_features: str) -> pa.Table:
+    value_col = f"target_spi{spi_idx}"
+    label_col = f"target_label_spi{spi_idx}"
+    times = month_start(pr.time.values)
+    climate_df = _climate_lags(pd.DatetimeIndex(times), climate_features)
     exog_cols = [c for c in climate_df.columns if c != "time"]
-    if exog_cols:
-        df = df.merge(climate_df, on="time", how="left")
-
-    feat_cols = [
-        "spi1_lag1", "spi1_lag2", "spi1_lag3",
-        "spi3_lag1", "spi6_lag1",
-        "pr_lag1", "pr_lag2", "pr_lag3",
-    ]
-    df = df.dropna(subset=feat_cols + exog_cols + [target_label.name, target_value.name]).copy()
-
-    target_time = pd.to_datetime(df["time"]) + pd.DateOffset(months=lead)
-    df["target_time"] = target_time.dt.to_period("M").dt.to_timestamp()
-    df["month"] = df["target_time"].dt.month
-    df["year"] = df["target_time"].dt.year
-    df["month_sin"] = np.sin(2 * np.pi * df["month"] / 12.0)
-    df["month_cos"] = np.cos(2 * np.pi * df["month"] / 12.0)
-    df[target_label.name] = df[target_label.name].astype(np.int8)
-    df["lead"] = lead
+
+    cubes = {
+        "pr": pr.values,
+        "spi1": spi1.values,
+        "spi3": spi3.values,
+        "spi6": spi6.values,
+        "target": spi_target.values,
+    }
+    # Persistence baselines need SPI-k at the issue month; SPI-3/6 already have
+    # it as a feature, other family windows carry it as a non-feature column.
+    features = dict(FEATURE_LAGS)
+    persistence_col = f"spi{spi_idx}_lag1"
+    features.setdefault(persistence_col, ("target", 0))
+    columns = build_lagged_columns(
+        times,
+        pr[lat_name].values,
+        pr[lon_name].values,
+        cubes,
+        features,
+        {value_col: ("target", lead)},
+        exog={col: climate_df[col].to_numpy() for col in exog_cols},
+    )
+    target_value = columns[value_col]
+    columns[label_col] = np.where(target_value <= -1.0, -1, np.where(target_value >= 1.0, 1, 0)).astype(np.int8)
+    columns.update(target_time_columns(columns["time"], lead))
+    columns["lead"] = np.full(len(target_value), lead, dtype=np.int64)
 
     cols = (
         [
             "time", "target_time", "lead", "year", "month", "month_sin", "month_cos",
-            "latitude", "longitude",
+            "latitude", "longitude", "pixel_id", "month_index",
         ]
-        + feat_cols
+        + list(features)
         + exog_cols
-        + [target_value.name, target_label.name]
+        + [value_col, label_col]
     )
-    return df[cols]
+    return columns_to_table(columns, cols)
+
+
+def _build_one(pr, spi1, spi3, spi6, spi_target, lead: int, spi_idx: int, lat_name: str, lon_name: str, climate_features: str) -> pd.DataFrame:
+    return _build_table(
+        pr, spi1, spi3, spi6, spi_target, lead, spi_idx, lat_name, lon_name, climate_features
+    ).to_pandas()
 
 
 def main():
@@ -158,8 +188,8 @@ def main():
     print(f"  SPI indices: {args.spi_indices}")
     print(f"  Lead times: {args.leads}")
 
-    pr_ds = xr.open_dataset(PR_FILE).load()
-    spi_ds = xr.open_dataset(SPI_FILE).load()
+    pr_ds = open_cube(PR_FILE, variables=["pr"])
+    spi_ds = open_cube(SPI_FILE, variables=["spi1", "spi3", "spi6"])
 
     lat_name = "latitude" if "latitude" in pr_ds.coords else "lat"
     lon_name = "longitude" if "longitude" in pr_ds.coords else "lon"
@@ -169,11 +199,11 @@ def main():
     spi3 = spi_ds["spi3"].sel(time=pr.time)
     spi6 = spi_ds["spi6"].sel(time=pr.time)
 
-    spi_map = {3: spi3, 6: spi6}
+    spi_map = target_spi_map(spi_ds, args.spi_family_file)
     built = []
     for spi_idx in args.spi_indices:
         if spi_idx not in spi_map:
-            print(f"Skipping unsupported SPI index: {spi_idx}")
+            print(f"Skipping SPI-{spi_idx}: not in {SPI_FILE.name} or {args.spi_family_file}")
             continue
         for lead in args.leads:
             if (not args.allow_overlap) and lead < spi_idx:
@@ -181,12 +211,12 @@ def main():
                 continue
 
             print(f"\n--- Building SPI-{spi_idx} lead-{lead} ---")
-            df = _build_one(
+            table = _build_table(
                 pr=pr,
                 spi1=spi1,
                 spi3=spi3,
                 spi6=spi6,
-                spi_target=spi_map[spi_idx],
+                spi_target=spi_map[spi_idx].sel(time=pr.time),
                 lead=lead,
                 spi_idx=spi_idx,
                 lat_name=lat_name,
@@ -196,14 +226,13 @@ def main():
 
             out_file = PROCESSED / f"dataset_seasonal_spi{spi_idx}_lead{lead}.parquet"
             out_sample = PROCESSED / f"dataset_seasonal_spi{spi_idx}_lead{lead}.sample.csv"
-            df.to_parquet(out_file, index=False)
-            df.head(10000).to_csv(out_sample, index=False)
+            write_columns(out_file, table, sample_file=out_sample)
 
             label_col = f"target_label_spi{spi_idx}"
-            print(f"Wrote: {out_file} (rows={len(df):,}, cols={df.shape[1]})")
+            print(f"Wrote: {out_file} (rows={table.num_rows:,}, cols={table.num_columns})")
             print("Class distribution:")
-            print(df[label_col].value_counts().sort_index())
-            built.append((spi_idx, lead, len(df)))
+            print(class_counts(table.column(label_col).to_numpy(), name=label_col))
+            built.append((spi_idx, lead, table.num_rows))
 
     print("\nDone.")
     for spi_idx, lead, nrows in built:
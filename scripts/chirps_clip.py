@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+"""
+Shared CHIRPS v3 monthly clipping helpers.
+
+Used by clip_to_cvalley_monthly.py and run_multiregion_xgb_experiment.py.
+
+Run directly, this is the single-pass multi-region clip command: each raw
+yearly file is opened once, every requested region bbox is sliced from it,
+and all regional outputs are written at the end. Yearly files are processed
+in a process pool sized to the available cores.
+
+  python scripts/chirps_clip.py --regions all
+  python scripts/chirps_clip.py --regions murray_darling horn_of_africa --grid-stride 4 --force
+
+Incremental mode (clip_chirps_incremental) keeps a manifest of the raw yearly
+files behind each clipped output. On rerun only new or changed raw files are
+opened; months already in the output are overwritten from the changed source
+and newer months are appended along time in place. Outputs without a manifest
+fall back to their time axis: only yearly files that can contain months after
+the last clipped month are reopened.
+A new raw year changes the output's end-year file name; the previous year's
+output is then carried forward to the new name and extended, not re-clipped.
+"""
+from __future__ import annotations
+
+from argparse import ArgumentParser, Namespace
+from dataclasses import replace
+from pathlib import Path
+import os
+import re
+import shutil
+import sys
+
+import pandas as pd
+import xarray as xr
+from joblib import Parallel, delayed
+
+from incremental_io import (
+    changed_sources,
+    existing_times,
+    file_fingerprint,
+    load_manifest,
+    manifest_path,
+    save_manifest,
+    write_time_steps,
+)
+from region_config import REGIONS, Region, region_table, resolve_region
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+RAW_CHIRPS = PROJECT_ROOT / "data" / "raw" / "chirps_v3" / "monthly"
+PROCESSED = PROJECT_ROOT / "data" / "processed"
+REGION_DATA_ROOT = PROCESSED / "regions"
+DEFAULT_START_YEAR = 1991
+CHIRPS_PATTERN = re.compile(r"chirps-v3\.0\.(\d{4})\.monthly\.nc$")
+PR_ENCODING = {"pr": dict(zlib=True, complevel=4)}
+
+
+def chirps_file_year(path: Path) -> int | None:
+    match = CHIRPS_PATTERN.search(path.name)
+    return int(match.group(1)) if match else None
+
+
+def available_chirps_files(start_year: int, end_year: int | None, raw_dir: Path = RAW_CHIRPS) -> list[Path]:
+    selected = []
+    for path in sorted(raw_dir.glob("chirps-v3.0.*.monthly.nc")):
+        year = chirps_file_year(path)
+        if year is None or year < start_year:
+            continue
+        if end_year is not None and year > end_year:
+            continue
+        selected.append(path)
+    if not selected:
+        raise FileNotFoundError(f"No CHIRPS monthly files found in {raw_dir}")
+    return selected
+
+
+def latest_chirps_year(start_year: int, raw_dir: Path = RAW_CHIRPS) -> int:
+    files = available_chirps_files(start_year, None, raw_dir)
+    return max(year for year in map(chirps_file_year, files) if year is not None)
+
+
+def stride_region(region: Region, grid_stride: int) -> Region:
+    """Smoke-test variant of a region that keeps every Nth CHIRPS cell."""
+    if grid_stride <= 1:
+        return region
+    return replace(
+        region,
+        slug=f"{region.slug}_stride{grid_stride}",
+        name=f"{region.name} (grid-stride {grid_stride} smoke)",
+        rationale=(
+            region.rationale
+            + f" Smoke-test run using every {grid_stride}th CHIRPS grid cell; "
+            "do not treat as a full-region scientific result."
+        ),
+    )
+
+
+def clipped_pr_file(region: Region, start_year: int, end_year: int, use_canonical: bool) -> Path:
+    if region.slug == "cvalley" and use_canonical:
+        return PROCESSED / f"chirps_v3_monthly_cvalley_{start_year}_{end_year}.nc"
+    return REGION_DATA_ROOT / region.slug / f"chirps_v3_monthly_{region.slug}_{start_year}_{end_year}.nc"
+
+
+def previous_clipped_file(out_file: Path) -> Path | None:
+    """Latest clipped file for the same region and start year with an earlier end year, if any."""
+    prefix, _, end_year = out_file.stem.rpartition("_")
+    candidates = []
+    for path in out_file.parent.glob(f"{prefix}_*.nc"):
+        year = path.stem.rpartition("_")[2]
+        if year.isdigit() and int(year) < int(end_year):
+            candidates.append((int(year), path))
+    return max(candidates)[1] if candidates else None
+
+
+def select_lat_lon(ds: xr.Dataset, region: Region, grid_stride: int = 1) -> xr.Dataset:
+    lat_name = "latitude" if "latitude" in ds.coords else "lat"
+    lon_name = "longitude" if "longitude" in ds.coords else "lon"
+
+    lat_min, lat_max = sorted((region.lat_min, region.lat_max))
+    if float(ds[lat_name][0]) > float(ds[lat_name][-1]):
+        ds = ds.sel({lat_name: slice(lat_max, lat_min)})
+    else:
+        ds = ds.sel({lat_name: slice(lat_min, lat_max)})
+
+    lon_min, lon_max = sorted((region.lon_min, region.lon_max))
+    ds = ds.sel({lon_name: slice(lon_min, lon_max)})
+    if grid_stride > 1:
+        ds = ds.isel({lat_name: slice(None, None, grid_stride), lon_name: slice(None, None, grid_stride)})
+    return ds
+
+
+def standardize_precip(part: xr.Dataset) -> xr.Dataset:
+    """Keep the precipitation variable as 'pr' on latitude/longitude coordinates."""
+    var = next(
+        (v for v in part.data_vars if v.lower().startswith(("precip", "pr"))),
+        list(part.data_vars)[0],
+    )
+    part = part[[var]].rename({var: "pr"})
+    if "lat" in part.coords:
+        part = part.rename({"lat": "latitude"})
+    if "lon" in part.coords:
+        part = part.rename({"lon": "longitude"})
+    return part
+
+
+def _clip_open(raw: xr.Dataset, region: Region, grid_stride: int) -> xr.Dataset:
+    part = select_lat_lon(raw, region, grid_stride=grid_stride)
+    if part.sizes.get("latitude", part.sizes.get("lat", 0)) == 0 or part.sizes.get(
+        "longitude", part.sizes.get("lon", 0)
+    ) == 0:
+        raise ValueError(f"Region selection produced an empty grid for {region.slug}")
+    return standardize_precip(part).load()
+
+
+def clip_file(path: Path, region: Region, grid_stride: int = 1) -> xr.Dataset:
+    with xr.open_dataset(path) as raw:
+        return _clip_open(raw, region, grid_stride)
+
+
+def clip_file_multi(path: Path, targets: list[tuple[Region, int]]) -> list[xr.Dataset]:
+    """Open one raw yearly file once and slice every (region, grid_stride) target from it."""
+    with xr.open_dataset(path) as raw:
+        return [_clip_open(raw, region, grid_stride) for region, grid_stride in targets]
+
+
+def concat_months(parts: list[xr.Dataset]) -> xr.Dataset:
+    """Concatenate clipped parts along time, dropping repeated months."""
+    ds = xr.concat(parts, dim="time").sortby("time")
+    time_index = pd.Index(ds["time"].values)
+    return ds.isel(time=~time_index.duplicated())
+
+
+def write_clipped(ds: xr.Dataset, out_file: Path, files: list[Path]) -> None:
+    """Write a full clipped product with an unlimited time axis and its source manifest."""
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    ds.to_netcdf(out_file, encoding=PR_ENCODING, unlimited_dims=["time"])
+    save_manifest(out_file, {path.name: file_fingerprint(path) for path in files})
+
+
+def clip_chirps_incremental(
+    region: Region,
+    out_file: Path,
+    files: list[Path],
+    grid_stride: int = 1,
+) -> None:
+    """
+    Clip only raw files that are new or changed since out_file was last written.
+
+    Clipped files are named by end year, so the first run after a new raw year
+    lands on a new path. The previous year's output (and its manifest) is then
+    copied forward and only the new yearly files are appended to it.
+    """
+    previous = None if out_file.exists() else previous_clipped_file(out_file)
+    if previous is not None:
+        print(f"Carrying forward {previous.name} to {out_file.name}")
+        shutil.copy2(previous, out_file)
+        if manifest_path(previous).exists():
+            shutil.copy2(manifest_path(previous), manifest_path(out_file))
+    if not out_file.exists():
+        print(f"No existing clipped file at {out_file}; clipping all {len(files)} yearly files")
+        ds = concat_months([clip_file(path, region, grid_stride) for path in files])
+        write_clipped(ds, out_file, files)
+        print(f"Wrote clipped CHIRPS: {out_file}")
+        return
+
+    manifest = load_manifest(out_file)
+    if manifest:
+        todo, manifest = changed_sources(files, manifest)
+    else:
+        # Outputs written before manifests existed: trust the time axis and only
+        # reopen yearly files that can hold months after its last month.
+        last_month = existing_times(out_file).max()
+        todo = [path for path in files if (chirps_file_year(path) or 0) >= last_month.year]
+        manifest = {path.name: file_fingerprint(path) for path in files if path not in todo}
+        print(f"No source manifest for {out_file.name}; last clipped month is {last_month:%Y-%m}")
+    if not todo:
+        save_manifest(out_file, manifest)
+        print(f"Clipped CHIRPS is up to date with {len(files)} source files: {out_file}")
+        return
+
+    print(f"Incremental clip for {region.name}: {len(todo)}/{len(files)} source files new or changed")
+    parts = []
+    for path in todo:
+        print(f"  clipping {path.name}")
+        parts.append(clip_file(path, region, grid_stride))
+    update = concat_months(parts)
+    n_overwrite, n_append = write_time_steps(out_file, update, PR_ENCODING)
+    for path in todo:
+        manifest[path.name] = file_fingerprint(path)
+    save_manifest(out_file, manifest)
+    print(
+        f"Updated {out_file}: {n_append} month(s) appended, "
+        f"{n_overwrite} existing month(s) refreshed from changed sources"
+    )
+
+
+def clip_chirps_multiregion(
+    targets: list[tuple[Region, Path, int]],
+    files: list[Path],
+    n_jobs: int = -1,
+) -> None:
+    """
+    Clip several regions in one pass over the raw archive.
+
+    targets holds (region, out_file, grid_stride); n_jobs <= 0 uses all cores.
+    """
+    if not targets:
+        return
+    workers = (os.cpu_count() or 1) if n_jobs <= 0 else n_jobs
+    workers = min(workers, len(files))
+    print(
+        f"Single-pass clip of {len(files)} yearly files for {len(targets)} regions "
+        f"({', '.join(region.slug for region, _, _ in targets)}) with {workers} workers"
+    )
+    jobs = [(region, grid_stride) for region, _, grid_stride in targets]
+    per_file = Parallel(n_jobs=workers, verbose=5)(
+        delayed(clip_file_multi)(path, jobs) for path in files
+    )
+    for idx, (region, out_file, _) in enumerate(targets):
+        ds = concat_months([parts[idx] for parts in per_file])
+        write_clipped(ds, out_file, files)
+        print(f"Wrote clipped CHIRPS for {region.slug}: {out_file} dims={dict(ds.sizes)}")
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--regions",
+        nargs="+",
+        default=["all"],
+        help="Region slugs or aliases to clip, or 'all' for every configured region.",
+    )
+    parser.add_argument("--list-regions", action="store_true", help="List configured regions and exit.")
+    parser.add_argument("--start-year", type=int, default=DEFAULT_START_YEAR)
+    parser.add_argument(
+        "--end-year",
+        type=int,
+        default=None,
+        help="Last CHIRPS year to use. Defaults to the latest local raw CHIRPS year.",
+    )
+    parser.add_argument(
+        "--grid-stride",
+        type=int,
+        default=1,
+        help="Keep every Nth latitude/longitude after clipping (smoke tests only).",
+    )
+    parser.add_argument("--n-jobs", type=int, default=-1, help="Worker processes; <= 0 uses all cores.")
+    parser.add_argument("--force", action="store_true", help="Re-clip regions whose output already exists.")
+    parser.add_argument(
+        "--no-canonical-cvalley",
+        action="store_true",
+        help="For cvalley, write under data/processed/regions/ instead of the canonical file.",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    if hasattr(sys.stdout, "reconfigure"):
+        sys.stdout.reconfigure(line_buffering=True)
+    args = parse_args()
+    if args.list_regions:
+        print(region_table())
+        return
+    if args.grid_stride < 1:
+        raise ValueError("--grid-stride must be >= 1")
+
+    regions = list(REGIONS.values()) if args.regions == ["all"] else [resolve_region(r) for r in args.regions]
+    end_year = args.end_year or latest_chirps_year(args.start_year)
+    files = available_chirps_files(args.start_year, end_year)
+
+    targets = []
+    for base_region in regions:
+        region = stride_region(base_region, args.grid_stride)
+        use_canonical = base_region.slug == "cvalley" and args.grid_stride == 1 and not args.no_canonical_cvalley
+        out_file = clipped_pr_file(region, args.start_year, end_year, use_canonical)
+        if out_file.exists() and not args.force:
+            print(f"Using existing clipped CHIRPS file: {out_file}")
+            continue
+        targets.append((region, out_file, args.grid_stride))
+
+    clip_chirps_multiregion(targets, files, n_jobs=args.n_jobs)
+
+
+if __name__ == "__main__":
+    main()
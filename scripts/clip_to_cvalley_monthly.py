@@ -1,8 +1,23 @@
 #!/usr/bin/env python
+"""
+Clip global CHIRPS v3 monthly files to the Central Valley bbox.
+
+  python scripts/clip_to_cvalley_monthly.py                # full rebuild
+  python scripts/clip_to_cvalley_monthly.py --incremental  # only new/changed yearly files
+
+The incremental mode reads the existing output's source manifest (or its time
+axis when no manifest exists yet), clips only new or changed raw files, and
+appends newer months along time in place.
+"""
+from argparse import ArgumentParser
 from pathlib import Path
 import xarray as xr
 from dask.diagnostics import ProgressBar
 
+from chirps_clip import clip_chirps_incremental
+from incremental_io import file_fingerprint, save_manifest
+from region_config import REGIONS
+
 IN_DIR = Path("data/raw/chirps_v3/monthly")
 OUT_DIR = Path("data/processed"); OUT_DIR.mkdir(parents=True, exist_ok=True)
 OUT_FILE = OUT_DIR / "chirps_v3_monthly_cvalley_1991_2026.nc"
@@ -11,10 +26,22 @@ OUT_FILE = OUT_DIR / "chirps_v3_monthly_cvalley_1991_2026.nc"
 lat_min, lat_max = 35.4, 40.6
 lon_min, lon_max = -122.5, -119.0
 
+parser = ArgumentParser(description=__doc__)
+parser.add_argument(
+    "--incremental",
+    action="store_true",
+    help="Clip only raw yearly files that are new or changed since the last run.",
+)
+args = parser.parse_args()
+
 files = sorted(IN_DIR.glob("chirps-v3.0.*.monthly.nc"))
 if not files:
     raise SystemExit("No input files found in data/raw/chirps_v3/monthly")
 
+if args.incremental:
+    clip_chirps_incremental(REGIONS["cvalley"], OUT_FILE, files)
+    raise SystemExit(0)
+
 # add time chunks so progress updates smoothly
 ds = xr.open_mfdataset(files, combine="by_coords", chunks={"time": 12})
 
@@ -36,11 +63,12 @@ ds = ds.sel({lon_name: slice(c, d)})
 var = next((v for v in ds.data_vars if v.lower().startswith(("precip","pr"))), list(ds.data_vars)[0])
 ds = ds[[var]].rename({var: "pr"})
 
-# compress and compute with a progress bar
+# compress and compute with a progress bar; unlimited time allows --incremental appends
 encoding = {"pr": dict(zlib=True, complevel=4)}
-delayed = ds.to_netcdf(OUT_FILE, encoding=encoding, compute=False)
+delayed = ds.to_netcdf(OUT_FILE, encoding=encoding, unlimited_dims=["time"], compute=False)
 with ProgressBar():
     delayed.compute()
+save_manifest(OUT_FILE, {path.name: file_fingerprint(path) for path in files})
 
 print("Wrote:", OUT_FILE)
 print("Dims:", {k: int(v) for k, v in ds.sizes.items()})
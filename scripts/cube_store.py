@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""
+Optional chunked Zarr stores for the processed precipitation and SPI cubes.
+
+The NetCDF products stay canonical. This module can mirror them into Zarr
+stores with one of two chunk layouts:
+
+  time   — time-major: 12-month chunks over the full grid. Suits builders that
+           read every pixel for a time window (forecast tables, ConvLSTM).
+  pixel  — pixel-major: the full time axis in spatial tiles. Suits per-pixel
+           work (SPI fitting, pixel time series, spatial subsets of big regions).
+
+open_cube() is the shared loader. It reads only the requested variables,
+time window and latitude/longitude box, and uses a Zarr mirror when one
+exists next to the NetCDF file (preferred layout first). Otherwise it reads
+lazily from the NetCDF file.
+
+  python scripts/cube_store.py                     # both layouts for Central Valley pr + SPI
+  python scripts/cube_store.py --layouts time --files data/processed/regions/horn_of_africa/*.nc
+
+Zarr is optional: without the zarr package every loader falls back to NetCDF.
+"""
+from __future__ import annotations
+
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+import importlib.util
+import shutil
+
+import xarray as xr
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+PROCESSED = PROJECT_ROOT / "data" / "processed"
+DEFAULT_FILES = [
+    PROCESSED / "chirps_v3_monthly_cvalley_1991_2026.nc",
+    PROCESSED / "chirps_v3_monthly_cvalley_spi_1991_2026.nc",
+]
+LAYOUTS = {
+    "time": {"time": 12, "latitude": -1, "longitude": -1},
+    "pixel": {"time": -1, "latitude": 32, "longitude": 32},
+}
+HAS_ZARR = importlib.util.find_spec("zarr") is not None
+
+
+def zarr_path(nc_file: Path, layout: str) -> Path:
+    return nc_file.with_name(f"{nc_file.stem}.{layout}.zarr")
+
+
+def _normalize_coords(ds: xr.Dataset) -> xr.Dataset:
+    rename = {}
+    if "lat" in ds.coords:
+        rename["lat"] = "latitude"
+    if "lon" in ds.coords:
+        rename["lon"] = "longitude"
+    return ds.rename(rename) if rename else ds
+
+
+def _coord_slice(coord: xr.DataArray, bounds: tuple[float, float]) -> slice:
+    lo, hi = sorted(bounds)
+    if coord.size > 1 and float(coord[0]) > float(coord[-1]):
+        return slice(hi, lo)
+    return slice(lo, hi)
+
+
+def export_zarr(nc_file: Path, layout: str, overwrite: bool = False) -> Path:
+    """Mirror a NetCDF cube into a chunked Zarr store with the given layout."""
+    if not HAS_ZARR:
+        raise RuntimeError("The zarr package is not installed; cannot build Zarr stores.")
+    out = zarr_path(nc_file, layout)
+    if out.exists():
+        if not overwrite:
+            print(f"Using existing Zarr store: {out}")
+            return out
+        shutil.rmtree(out)
+    # Copy one slab of whole chunks at a time, so only a slab is ever in memory.
+    dim = min((size, dim) for dim, size in LAYOUTS[layout].items() if size != -1)[1]
+    step = LAYOUTS[layout][dim]
+    with xr.open_dataset(nc_file) as ds:
+        ds = _normalize_coords(ds)
+        encoding = {}
+        for name, var in ds.data_vars.items():
+            chunks = tuple(
+                var.sizes[d] if LAYOUTS[layout].get(d, -1) == -1 else min(LAYOUTS[layout][d], var.sizes[d])
+                for d in var.dims
+            )
+            encoding[name] = {"chunks": chunks}
+        for start in range(0, ds.sizes[dim], step):
+            slab = ds.isel({dim: slice(start, start + step)}).load()
+            for var in slab.data_vars.values():
+                var.encoding = {}
+            if start == 0:
+                slab.to_zarr(out, mode="w", encoding=encoding, consolidated=False)
+            else:
+                slab.to_zarr(out, append_dim=dim, consolidated=False)
+    print(f"Wrote {layout}-major Zarr store: {out}")
+    return out
+
+
+def open_cube(
+    nc_file: Path,
+    variables: list[str] | None = None,
+    time: slice | None = None,
+    lat_bounds: tuple[float, float] | None = None,
+    lon_bounds: tuple[float, float] | None = None,
+    layout: str = "time",
+    load: bool = True,
+) -> xr.Dataset:
+    """
+    Open only the needed part of a processed cube.
+
+    Parameters
+    ----------
+    nc_file    : canonical NetCDF path; a Zarr mirror next to it is used when present
+    variables  : data variables to keep (default: all)
+    time       : optional label slice on time, e.g. slice("2017-01", "2026-12")
+    lat_bounds : optional (min, max) latitude window
+    lon_bounds : optional (min, max) longitude window
+    layout     : preferred Zarr layout ("time" or "pixel"); the other is tried next
+    load       : load the subset into memory (default) or return it lazily
+    """
+    ds = None
+    if HAS_ZARR:
+        for candidate in [layout] + [name for name in LAYOUTS if name != layout]:
+            store = zarr_path(nc_file, candidate)
+            # A mirror older than its NetCDF source (e.g. after --append) is stale.
+            if store.exists() and (not nc_file.exists() or store.stat().st_mtime >= nc_file.stat().st_mtime):
+                ds = xr.open_dataset(store, engine="zarr", consolidated=False, chunks=None)
+                break
+    if ds is None:
+        ds = _normalize_coords(xr.open_dataset(nc_file))
+
+    if variables is not None:
+        ds = ds[list(variables)]
+    if time is not None:
+        ds = ds.sel(time=time)
+    if lat_bounds is not None:
+        ds = ds.sel(latitude=_coord_slice(ds["latitude"], lat_bounds))
+    if lon_bounds is not None:
+        ds = ds.sel(longitude=_coord_slice(ds["longitude"], lon_bounds))
+    return ds.load() if load else ds
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=Path, nargs="+", default=DEFAULT_FILES)
+    parser.add_argument("--layouts", nargs="+", choices=sorted(LAYOUTS), default=sorted(LAYOUTS))
+    parser.add_argument("--overwrite", action="store_true", help="Rebuild existing Zarr stores.")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    for nc_file in args.files:
+        if not nc_file.exists():
+            print(f"Skipping missing file: {nc_file}")
+            continue
+        for layout in args.layouts:
+            export_zarr(nc_file, layout, overwrite=args.overwrite)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+Shared split-aware loader for the forecast Parquet tables.
+
+Model scripts used to read the whole dataset_forecast.parquet and then filter
+by year. load_split() reads only the requested split's row groups (pyarrow
+filters on the target-month `year` column) and only the requested columns.
+Feature columns come back as float32 and the target as int8.
+
+Decoded columns are cached per (file, split) for the life of the process, so
+repeated calls with different feature lists only decode columns not seen yet.
+Returned frames share the cached buffers; pandas copy-on-write copies a column
+the first time a caller modifies it in place, so the cache is never altered.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from feature_config import get_feature_columns
+from region_config import Region, resolve_region
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+PROCESSED = PROJECT_ROOT / "data" / "processed"
+REGION_DATA_ROOT = PROCESSED / "regions"
+TARGET = "target_label"
+
+# Inclusive target-year bounds; None means open-ended.
+SPLITS: dict[str, tuple[int | None, int | None]] = {
+    "train": (None, 2016),
+    "val": (2017, 2020),
+    "test": (2021, None),
+    "all": (None, None),
+}
+
+_CACHE: dict[tuple, dict[str, pd.Series]] = {}
+
+
+def dataset_path(region: str | Region | None = None) -> Path:
+    """Forecast table for a region; None or 'cvalley' is the canonical dataset."""
+    if region is None:
+        return PROCESSED / "dataset_forecast.parquet"
+    if isinstance(region, str):
+        region = resolve_region(region)
+    if region.slug == "cvalley":
+        return PROCESSED / "dataset_forecast.parquet"
+    return REGION_DATA_ROOT / region.slug / f"dataset_forecast_{region.slug}.parquet"
+
+
+def dataset_columns(path: Path) -> list[str]:
+    """Column names from the Parquet footer, without reading any data."""
+    return pq.read_schema(path).names
+
+
+def split_filters(split: str) -> list[tuple[str, str, int]] | None:
+    if split not in SPLITS:
+        raise KeyError(f"Unknown split '{split}'. Valid splits: {', '.join(SPLITS)}")
+    start, end = SPLITS[split]
+    filters = []
+    if start is not None:
+        filters.append(("year", ">=", start))
+    if end is not None:
+        filters.append(("year", "<=", end))
+    return filters or None
+
+
+def _cache_key(path: Path, split: str) -> tuple:
+    stat = path.stat()
+    return (str(path.resolve()), stat.st_mtime_ns, stat.st_size, split)
+
+
+def _decode(values: np.ndarray, col: str, features: set[str], target: str) -> pd.Series:
+    if col in features:
+        values = values.astype(np.float32, copy=False)
+    elif col == target:
+        values = values.astype(np.int8, copy=False)
+    return pd.Series(values, name=col, copy=False)
+
+
+def load_split(
+    split: str,
+    features: Sequence[str] | None = None,
+    region: str | Region | None = None,
+    columns: Sequence[str] = (),
+    target: str = TARGET,
+    path: Path | None = None,
+) -> pd.DataFrame:
+    """
+    Load one chronological split of a forecast table.
+
+    Parameters
+    ----------
+    split    : 'train' (<= 2016), 'val' (2017-2020), 'test' (>= 2021) or 'all'
+    features : model feature columns; default get_feature_columns() of the file
+    region   : region slug or Region; ignored when `path` is given
+    columns  : extra columns to keep with their stored dtype (time, latitude, ...)
+    target   : label column, returned as int8
+    path     : explicit Parquet file, overriding the region lookup
+    """
+    path = Path(path) if path is not None else dataset_path(region)
+    if features is None:
+        features = get_feature_columns(dataset_columns(path))
+    wanted = list(dict.fromkeys([*columns, *features, target]))
+
+    key = _cache_key(path, split)
+    for stale in [k for k in _CACHE if k[0] == key[0] and k[3] == split and k != key]:
+        del _CACHE[stale]
+    cached = _CACHE.setdefault(key, {})
+    missing = [col for col in wanted if col not in cached]
+    if missing:
+        table = pq.read_table(path, columns=missing, filters=split_filters(split))
+        feature_set = set(features)
+        for col in missing:
+            values = table.column(col).to_numpy()
+            cached[col] = _decode(values, col, feature_set, target)
+
+    frame = {col: cached[col] for col in wanted}
+    for col in features:
+        frame[col] = frame[col].astype(np.float32)
+    return pd.DataFrame(frame, copy=False)
+
+
+def load_splits(
+    features: Sequence[str] | None = None,
+    region: str | Region | None = None,
+    columns: Sequence[str] = (),
+    target: str = TARGET,
+    path: Path | None = None,
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Return the (train, val, test) splits with the same projection."""
+    return tuple(
+        load_split(split, features, region, columns=columns, target=target, path=path)
+        for split in ("train", "val", "test")
+    )
+
+
+def clear_cache() -> None:
+    _CACHE.clear()
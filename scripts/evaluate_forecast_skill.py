@@ -46,6 +46,7 @@ Inputs:
   outputs/xgb_spatial_test_probs.npz    (optional; adds XGBoost-Spatial row)
   outputs/convlstm_test_probs.npz       (optional; adds ConvLSTM row)
   data/processed/convlstm_meta.npz      (lat/lon/test_feature_times for ConvLSTM)
+  outputs/edl_uncertainty_monthly.csv   (optional; adds EDL to the paired matrix)
 
 Outputs:
   outputs/forecast_skill_scores.txt
@@ -57,6 +58,8 @@ Outputs:
   outputs/calib_study_results.csv         (calibration study, new)
   outputs/calib_study_reliability_diagram.png  (calibration study, new)
   outputs/calib_study_decomposition_barplot.png (calibration study, new)
+  outputs/paired_significance_matrix.csv  (all-pairs ΔBSS CI + p-value)
+  outputs/paired_significance_matrix.png
 """
 from pathlib import Path
 import numpy as np
@@ -66,12 +69,25 @@ import matplotlib.gridspec as gridspec
 import xgboost as xgb
 import joblib
 from sklearn.calibration import calibration_curve
-from sklearn.isotonic import IsotonicRegression
-from sklearn.linear_model import LogisticRegression as _LogisticReg  # Platt scaling
 from sklearn.metrics import roc_auc_score, confusion_matrix, ConfusionMatrixDisplay
+from bootstrap_engine import (
+    bootstrap_ci,
+    brier_batch,
+    bss_batch,
+    hss_batch,
+    paired_pvalues,
+    paired_skill_matrix,
+    resample_indices,
+)
+from calibration import IsotonicCalibrator, PlattCalibrator, fit_calibrator
+from dataset_loader import dataset_columns, load_split
 from feature_config import get_feature_columns
+from grid_registry import GridRegistry, gather, grid_registry, month_index, row_keys
+from monthly_groups import MonthlyGroups, target_month
+from spatial_features import NBR_MEAN_FEATURES, add_features, ensure_feature_cube
 
 DATA          = Path("data/processed/dataset_forecast.parquet")
+PR_FILE       = Path("data/processed/chirps_v3_monthly_cvalley_1991_2026.nc")
 PROBS_NPZ     = Path("outputs/forecast_xgb_test_probs.npz")
 MODEL_PATH    = Path("outputs/forecast_xgb_model.json")
 LOGREG_MODEL  = Path("outputs/forecast_logreg_model.pkl")
@@ -151,18 +167,19 @@ def _saved_probability_rows_match(
 
 # ── load dataset ──────────────────────────────────────────────────────────────
 print("Loading dataset...")
-df = pd.read_parquet(DATA)
-df["year"] = df["year"].astype(int)
-FEATURES = get_feature_columns(df.columns)
+FEATURES = get_feature_columns(dataset_columns(DATA))
 
-train = df[df["year"] <= 2016].copy()
-val   = df[(df["year"] >= 2017) & (df["year"] <= 2020)].copy()
-test  = df[df["year"] >= 2021].copy()
+# Train only feeds the monthly climatology baseline, so it needs two columns.
+train = load_split("train", [], path=DATA, columns=["time"])
+# Integer grid keys (grid_registry.py) replace coordinate joins when present.
+ROW_KEYS = [c for c in ("pixel_id", "month_index") if c in dataset_columns(DATA)]
+val   = load_split("val", FEATURES, path=DATA, columns=["time", "latitude", "longitude", *ROW_KEYS])
+test  = load_split("test", FEATURES, path=DATA, columns=["time", "latitude", "longitude", *ROW_KEYS])
 
 # target month (the month being predicted)
-test["month_dt"] = (
-    pd.to_datetime(test["time"]) + pd.DateOffset(months=1)
-).dt.to_period("M").dt.to_timestamp()
+test["month_dt"] = target_month(test["time"])
+# Row order by target month and segment offsets, shared by every monthly aggregation below.
+TEST_GROUPS = MonthlyGroups.from_frame(test, "month_dt")
 
 # ── load or compute XGBoost probabilities ────────────────────────────────────
 use_saved_xgb_probs = False
@@ -211,8 +228,7 @@ dval        = xgb.DMatrix(val[FEATURES], feature_names=FEATURES)
 val_probs   = _predict_booster(model_xgb, dval)         # (n_val, 3)
 
 # ── isotonic calibration on validation set (dry class) ───────────────────────
-iso_cal = IsotonicRegression(out_of_bounds="clip")
-iso_cal.fit(val_probs[:, 0], (val_y_enc == LABEL_MAP[-1]).astype(int))
+iso_cal = fit_calibrator("isotonic", val_probs[:, 0], (val_y_enc == LABEL_MAP[-1]).astype(int))
 
 test["xgb_prob_dry_cal"] = iso_cal.predict(test["xgb_prob_dry"].values)
 
@@ -362,75 +378,27 @@ if CONVLSTM_NPZ.exists() and CONVLSTM_META.exists():
         cl_pred_enc = cl_proba.argmax(axis=1)
         _inv_enc    = {0: -1, 1: 0, 2: 1}
 
-        def nearest_grid_indices(grid_vals: np.ndarray, query_vals: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
-            """Return nearest original-grid indices and absolute diffs for each query."""
-            sort_idx = np.argsort(grid_vals)
-            grid_sorted = grid_vals[sort_idx]
-            pos = np.searchsorted(grid_sorted, query_vals)
-            pos = np.clip(pos, 1, len(grid_sorted) - 1)
-            left = grid_sorted[pos - 1]
-            right = grid_sorted[pos]
-            use_right = np.abs(query_vals - right) < np.abs(query_vals - left)
-            nearest_pos = np.where(use_right, pos, pos - 1)
-            nearest_orig_idx = sort_idx[nearest_pos]
-            nearest_diff = np.abs(query_vals - grid_vals[nearest_orig_idx])
-            return nearest_orig_idx, nearest_diff
-
-        def coord_tolerance(grid_vals: np.ndarray) -> float:
-            uniq = np.unique(np.sort(grid_vals))
-            if len(uniq) <= 1:
-                return 1e-6
-            steps = np.diff(uniq)
-            steps = steps[steps > 0]
-            if len(steps) == 0:
-                return 1e-6
-            return float(steps.min() / 2.0 + 1e-9)
-
-        # Align by nearest time + nearest lat/lon gridpoint (with tolerance)
-        test["time"] = pd.to_datetime(test["time"])
-        cl_time_index = pd.DatetimeIndex(cl_times)
-        test_time_index = pd.DatetimeIndex(test["time"])
-        t_idx_exact = cl_time_index.get_indexer(test_time_index)
-        t_idx_nearest = cl_time_index.get_indexer(
-            test_time_index, method="nearest", tolerance=pd.Timedelta(days=31)
-        )
-        n_time_fallback = int(((t_idx_exact == -1) & (t_idx_nearest != -1)).sum())
-        if n_time_fallback > 0:
-            print(
-                f"  NOTE: {n_time_fallback} rows had no exact ConvLSTM time match; "
-                "used nearest available time within 31 days."
-            )
-        t_idx = pd.Series(t_idx_nearest, index=test.index)
-
-        for _col in ["convlstm_prob_dry", "convlstm_prob_normal", "convlstm_prob_wet"]:
-            test[_col] = np.nan
+        # The ConvLSTM grid is the CHIRPS grid, so each row's pixel_id and
+        # month_index address the probability cube by position.
+        # A stored pixel_id refers to the table's grid registry; if the
+        # ConvLSTM grid differs, look the coordinates up on its own grid.
+        cl_grid = GridRegistry(np.asarray(cl_lat), np.asarray(cl_lon))
+        same_grid = PR_FILE.exists() and cl_grid.same_grid(grid_registry(PR_FILE))
+        key_frame = test if same_grid else test.drop(columns="pixel_id", errors="ignore")
+        pixel_id, months = row_keys(key_frame, cl_grid)
+        cl_months = month_index(cl_times)
+
+        probs = [
+            gather(cl_proba[:, k], cl_months, pixel_id, months)
+            for k in range(cl_proba.shape[1])
+        ]
+        test["convlstm_prob_dry"] = probs[0]
+        test["convlstm_prob_normal"] = probs[1]
+        test["convlstm_prob_wet"] = probs[2]
+        pred_enc = gather(cl_pred_enc, cl_months, pixel_id, months)
+        matched = np.isfinite(pred_enc)
         test["convlstm_pred"] = np.nan
-
-        has_time = t_idx.notna().values
-        if has_time.any():
-            lat_q = test.loc[has_time, "latitude"].to_numpy()
-            lon_q = test.loc[has_time, "longitude"].to_numpy()
-
-            lat_idx, lat_diff = nearest_grid_indices(cl_lat, lat_q)
-            lon_idx, lon_diff = nearest_grid_indices(cl_lon, lon_q)
-
-            lat_tol = coord_tolerance(cl_lat)
-            lon_tol = coord_tolerance(cl_lon)
-            within_tol = (lat_diff <= lat_tol) & (lon_diff <= lon_tol)
-
-            matched_rows = test.index[has_time][within_tol]
-            if len(matched_rows) > 0:
-                time_idx_arr = t_idx.loc[matched_rows].astype(int).to_numpy()
-                lat_idx_arr = lat_idx[within_tol]
-                lon_idx_arr = lon_idx[within_tol]
-
-                matched_probs = cl_proba[time_idx_arr, :, lat_idx_arr, lon_idx_arr]
-                matched_pred_enc = cl_pred_enc[time_idx_arr, lat_idx_arr, lon_idx_arr]
-
-                test.loc[matched_rows, "convlstm_prob_dry"] = matched_probs[:, 0]
-                test.loc[matched_rows, "convlstm_prob_normal"] = matched_probs[:, 1]
-                test.loc[matched_rows, "convlstm_prob_wet"] = matched_probs[:, 2]
-                test.loc[matched_rows, "convlstm_pred"] = np.vectorize(_inv_enc.get)(matched_pred_enc)
+        test.loc[matched, "convlstm_pred"] = np.vectorize(_inv_enc.get)(pred_enc[matched].astype(int))
 
         n_missing = int(test["convlstm_prob_dry"].isna().sum())
         if n_missing > 0:
@@ -539,39 +507,43 @@ test["thr_pred"] = np.array([CLASSES[i] for i in thr_argmax], dtype=int)
 # ── monthly aggregation ───────────────────────────────────────────────────────
 print(f"Aggregating to monthly level...")
 
-monthly = test.groupby("month_dt").agg(
-    y_true_mode     = (TARGET, lambda s: int(s.mode()[0])),
-    y_true_dry_frac = (TARGET, lambda s: (s == -1).mean()),
-    xgb_dry_frac    = ("xgb_prob_dry",    "mean"),
-    xgb_norm_frac   = ("xgb_prob_normal", "mean"),
-    xgb_wet_frac    = ("xgb_prob_wet",    "mean"),
-    xgb_dry_cal_frac= ("xgb_prob_dry_cal","mean"),
-    clim_dry_frac   = (f"clim_prob_{-1}", "mean"),
-    clim_norm_frac  = (f"clim_prob_{0}",  "mean"),
-    clim_wet_frac   = (f"clim_prob_{1}",  "mean"),
-    persist_dry_frac= (f"persist_prob_{-1}","mean"),
-    persist_norm_frac=(f"persist_prob_{0}", "mean"),
-    persist_wet_frac= (f"persist_prob_{1}", "mean"),
-    thr_dry_frac    = (f"thr_prob_{-1}", "mean"),
-    thr_norm_frac   = (f"thr_prob_{0}",  "mean"),
-    thr_wet_frac    = (f"thr_prob_{1}",  "mean"),
-    xgb_pred_mode   = ("xgb_pred",    lambda s: int(s.mode()[0])),
-    clim_pred_mode  = ("clim_pred",   lambda s: int(s.mode()[0])),
-    persist_pred_mode=("persist_pred",lambda s: int(s.mode()[0])),
-    thr_pred_mode   = ("thr_pred",    lambda s: int(s.mode()[0])),
-    **({f"lr_dry_frac":  (f"lr_prob_{-1}", "mean"),
-        f"lr_pred_mode": ("lr_pred", lambda s: int(s.mode()[0]))}
-       if HAS_LOGREG else {}),
-    **({f"rf_dry_frac":  (f"rf_prob_{-1}", "mean"),
-        f"rf_pred_mode": ("rf_pred", lambda s: int(s.mode()[0]))}
-       if HAS_RF else {}),
-    **({"xgb_spatial_dry_frac":  ("xgb_spatial_prob_dry", "mean"),
-        "xgb_spatial_pred_mode": ("xgb_spatial_pred", lambda s: int(s.mode()[0]))}
-       if HAS_XGB_SPATIAL else {}),
-    **({"convlstm_dry_frac":  ("convlstm_prob_dry", "mean"),
-        "convlstm_pred_mode": ("convlstm_pred", lambda s: int(s.mode()[0]))}
-       if HAS_CONVLSTM else {}),
-).reset_index()
+_monthly_means = {
+    "xgb_dry_frac":      "xgb_prob_dry",
+    "xgb_norm_frac":     "xgb_prob_normal",
+    "xgb_wet_frac":      "xgb_prob_wet",
+    "xgb_dry_cal_frac":  "xgb_prob_dry_cal",
+    "clim_dry_frac":     f"clim_prob_{-1}",
+    "clim_norm_frac":    f"clim_prob_{0}",
+    "clim_wet_frac":     f"clim_prob_{1}",
+    "persist_dry_frac":  f"persist_prob_{-1}",
+    "persist_norm_frac": f"persist_prob_{0}",
+    "persist_wet_frac":  f"persist_prob_{1}",
+    "thr_dry_frac":      f"thr_prob_{-1}",
+    "thr_norm_frac":     f"thr_prob_{0}",
+    "thr_wet_frac":      f"thr_prob_{1}",
+    **({"lr_dry_frac": f"lr_prob_{-1}"} if HAS_LOGREG else {}),
+    **({"rf_dry_frac": f"rf_prob_{-1}"} if HAS_RF else {}),
+    **({"xgb_spatial_dry_frac": "xgb_spatial_prob_dry"} if HAS_XGB_SPATIAL else {}),
+    **({"convlstm_dry_frac": "convlstm_prob_dry"} if HAS_CONVLSTM else {}),
+}
+_monthly_modes = {
+    "y_true_mode":       TARGET,
+    "xgb_pred_mode":     "xgb_pred",
+    "clim_pred_mode":    "clim_pred",
+    "persist_pred_mode": "persist_pred",
+    "thr_pred_mode":     "thr_pred",
+    **({"lr_pred_mode": "lr_pred"} if HAS_LOGREG else {}),
+    **({"rf_pred_mode": "rf_pred"} if HAS_RF else {}),
+    **({"xgb_spatial_pred_mode": "xgb_spatial_pred"} if HAS_XGB_SPATIAL else {}),
+    **({"convlstm_pred_mode": "convlstm_pred"} if HAS_CONVLSTM else {}),
+}
+# All probability columns go through one reduceat; modes are per-month class counts.
+monthly = TEST_GROUPS.aggregate(test, _monthly_means, time_col="month_dt")
+monthly["y_true_dry_frac"] = TEST_GROUPS.means((test[TARGET] == -1).to_numpy(dtype=float))
+for _col, _src in _monthly_modes.items():
+    _modes = TEST_GROUPS.modes(test[_src].to_numpy())
+    # Months whose labels are all missing stay NaN rather than being cast to a class.
+    monthly[_col] = _modes if np.isnan(_modes).any() else _modes.astype(int)
 
 # Monthly dry-event target for probabilistic scoring:
 # use observed monthly dry fraction directly (0..1) to avoid arbitrary majority threshold.
@@ -652,95 +624,71 @@ if HAS_CONVLSTM:
         auc_cl = np.nan
 
 # ── Bootstrap uncertainty intervals (monthly block bootstrap) ──────────────────
-def _bootstrap_ci(values: np.ndarray, alpha: float = 0.05) -> tuple[float, float]:
-    """Return two-sided percentile confidence interval for bootstrap samples."""
-    lo = float(np.nanpercentile(values, 100 * (alpha / 2)))
-    hi = float(np.nanpercentile(values, 100 * (1 - alpha / 2)))
-    return lo, hi
+# All resamples are drawn at once as an (n_boot, n_months) index matrix and each
+# metric is reduced along it; see bootstrap_engine.py. "iid" reproduces the
+# original per-iteration draws; "moving" / "stationary" resample month blocks.
+BOOTSTRAP_METHOD       = "iid"
+BOOTSTRAP_BLOCK_LENGTH = 3
 
-def bootstrap_metric(metric_fn, n_months: int, n_boot: int = 2000, seed: int = 42) -> tuple[float, float]:
-    """Bootstrap a monthly metric and return its percentile CI.
+def bootstrap_metric(stat_fn, n_months: int, n_boot: int = 2000, seed: int = 42) -> tuple[float, float]:
+    """Bootstrap a batched monthly metric and return its percentile CI.
 
-    metric_fn must accept a 1-D integer index array (resampled month indices)
-    and return a scalar metric value computed on that resample.
+    stat_fn must accept an (n_boot, n_months) integer index matrix (one
+    resample of month indices per row) and return an (n_boot,) array.
 
     Returns
     -------
     tuple[float, float]
         (lower_bound, upper_bound) percentile confidence interval.
     """
-    rng = np.random.default_rng(seed)
-    vals = np.empty(n_boot, dtype=float)
-    for i in range(n_boot):
-        idx = rng.integers(0, n_months, size=n_months)
-        vals[i] = metric_fn(idx)
-    return _bootstrap_ci(vals)
+    return bootstrap_ci(
+        stat_fn, n_months, n_boot=n_boot, seed=seed,
+        method=BOOTSTRAP_METHOD, block_length=BOOTSTRAP_BLOCK_LENGTH,
+    )
+
+def bss_ci_vs_clim(prob: np.ndarray, seed: int) -> tuple[float, float]:
+    """Monthly BSS CI of a dry-fraction forecast against climatology."""
+    clim = monthly["clim_dry_frac"].values
+    return bootstrap_metric(
+        lambda idx: bss_batch(obs_dry_frac, prob, clim, idx),
+        n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=seed,
+    )
+
+def hss_ci(pred_mode: np.ndarray, seed: int) -> tuple[float, float]:
+    """Monthly HSS CI of a modal-class forecast."""
+    return bootstrap_metric(
+        lambda idx: hss_batch(y_true_monthly, pred_mode, CLASSES, idx),
+        n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=seed,
+    )
 
 def fmt_ci(ci: tuple[float, float]) -> str:
     """Format confidence interval tuple as a compact [lo, hi] string."""
     return f"[{ci[0]:.4f}, {ci[1]:.4f}]"
 
-bss_ci_pers = bootstrap_metric(lambda i: bss(
-    brier_score(obs_dry_frac[i], monthly["persist_dry_frac"].values[i]),
-    brier_score(obs_dry_frac[i], monthly["clim_dry_frac"].values[i])
-), n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=101)
-bss_ci_thr = bootstrap_metric(lambda i: bss(
-    brier_score(obs_dry_frac[i], monthly["thr_dry_frac"].values[i]),
-    brier_score(obs_dry_frac[i], monthly["clim_dry_frac"].values[i])
-), n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=102)
-bss_ci_xgb = bootstrap_metric(lambda i: bss(
-    brier_score(obs_dry_frac[i], monthly["xgb_dry_frac"].values[i]),
-    brier_score(obs_dry_frac[i], monthly["clim_dry_frac"].values[i])
-), n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=103)
-hss_ci_clim = bootstrap_metric(lambda i: heidke_skill_score(
-    y_true_monthly[i], monthly["clim_pred_mode"].values[i], CLASSES
-), n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=111)
-hss_ci_pers = bootstrap_metric(lambda i: heidke_skill_score(
-    y_true_monthly[i], monthly["persist_pred_mode"].values[i], CLASSES
-), n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=112)
-hss_ci_thr = bootstrap_metric(lambda i: heidke_skill_score(
-    y_true_monthly[i], monthly["thr_pred_mode"].values[i], CLASSES
-), n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=113)
-hss_ci_xgb = bootstrap_metric(lambda i: heidke_skill_score(
-    y_true_monthly[i], monthly["xgb_pred_mode"].values[i], CLASSES
-), n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=114)
+bss_ci_pers = bss_ci_vs_clim(monthly["persist_dry_frac"].values, seed=101)
+bss_ci_thr  = bss_ci_vs_clim(monthly["thr_dry_frac"].values, seed=102)
+bss_ci_xgb  = bss_ci_vs_clim(monthly["xgb_dry_frac"].values, seed=103)
+hss_ci_clim = hss_ci(monthly["clim_pred_mode"].values, seed=111)
+hss_ci_pers = hss_ci(monthly["persist_pred_mode"].values, seed=112)
+hss_ci_thr  = hss_ci(monthly["thr_pred_mode"].values, seed=113)
+hss_ci_xgb  = hss_ci(monthly["xgb_pred_mode"].values, seed=114)
 
 # Bootstrap CIs for optional models (computed only when the model was loaded)
 if HAS_XGB_SPATIAL:
-    bss_ci_sp = bootstrap_metric(lambda i: bss(
-        brier_score(obs_dry_frac[i], monthly["xgb_spatial_dry_frac"].values[i]),
-        brier_score(obs_dry_frac[i], monthly["clim_dry_frac"].values[i])
-    ), n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=104)
-    hss_ci_sp = bootstrap_metric(lambda i: heidke_skill_score(
-        y_true_monthly[i], monthly["xgb_spatial_pred_mode"].values[i], CLASSES
-    ), n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=115)
+    bss_ci_sp = bss_ci_vs_clim(monthly["xgb_spatial_dry_frac"].values, seed=104)
+    hss_ci_sp = hss_ci(monthly["xgb_spatial_pred_mode"].values, seed=115)
 
 if HAS_LOGREG:
-    bss_ci_lr = bootstrap_metric(lambda i: bss(
-        brier_score(obs_dry_frac[i], monthly["lr_dry_frac"].values[i]),
-        brier_score(obs_dry_frac[i], monthly["clim_dry_frac"].values[i])
-    ), n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=105)
-    hss_ci_lr = bootstrap_metric(lambda i: heidke_skill_score(
-        y_true_monthly[i], monthly["lr_pred_mode"].values[i], CLASSES
-    ), n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=116)
+    bss_ci_lr = bss_ci_vs_clim(monthly["lr_dry_frac"].values, seed=105)
+    hss_ci_lr = hss_ci(monthly["lr_pred_mode"].values, seed=116)
 
 if HAS_RF:
-    bss_ci_rf = bootstrap_metric(lambda i: bss(
-        brier_score(obs_dry_frac[i], monthly["rf_dry_frac"].values[i]),
-        brier_score(obs_dry_frac[i], monthly["clim_dry_frac"].values[i])
-    ), n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=106)
-    hss_ci_rf = bootstrap_metric(lambda i: heidke_skill_score(
-        y_true_monthly[i], monthly["rf_pred_mode"].values[i], CLASSES
-    ), n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=117)
+    bss_ci_rf = bss_ci_vs_clim(monthly["rf_dry_frac"].values, seed=106)
+    hss_ci_rf = hss_ci(monthly["rf_pred_mode"].values, seed=117)
 
 if HAS_CONVLSTM:
-    bss_ci_cl = bootstrap_metric(lambda i: bss(
-        brier_score(obs_dry_frac[i], monthly["convlstm_dry_frac"].values[i]),
-        brier_score(obs_dry_frac[i], monthly["clim_dry_frac"].values[i])
-    ), n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=107)
-    hss_ci_cl = bootstrap_metric(lambda i: heidke_skill_score(
-        y_true_monthly[i], monthly["convlstm_pred_mode"].values[i], CLASSES
-    ), n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=118)
+    bss_ci_cl = bss_ci_vs_clim(monthly["convlstm_dry_frac"].values, seed=107)
+    hss_ci_cl = hss_ci(monthly["convlstm_pred_mode"].values, seed=118)
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # CALIBRATION STUDY — XGBoost and XGBoost-Spatial                (NEW SECTION)
@@ -796,26 +744,22 @@ def bs_decomp(obs: np.ndarray, prob: np.ndarray, n_bins: int = 10) -> dict:
 
 # ── Calibration method helpers ─────────────────────────────────────────────────
 
-def _fit_platt(vp: np.ndarray, vo: np.ndarray) -> _LogisticReg:
-    """Platt scaling: fit logistic regression on raw validation scores (pixel level)."""
-    lr = _LogisticReg(C=1.0, solver="lbfgs", max_iter=1000)
-    lr.fit(vp.reshape(-1, 1), vo)
-    return lr
+def _fit_platt(vp: np.ndarray, vo: np.ndarray) -> PlattCalibrator:
+    """Platt scaling on raw validation scores (pixel level), fitted on binned statistics."""
+    return fit_calibrator("platt", vp, vo)
 
 
-def _apply_platt(m: _LogisticReg, p: np.ndarray) -> np.ndarray:
+def _apply_platt(m: PlattCalibrator, p: np.ndarray) -> np.ndarray:
     """Apply fitted Platt model to new raw probabilities."""
-    return m.predict_proba(p.reshape(-1, 1))[:, 1]
+    return m.predict(p)
 
 
-def _fit_isotonic_cal(vp: np.ndarray, vo: np.ndarray) -> IsotonicRegression:
-    """Fit isotonic regression calibration on raw validation scores (pixel level)."""
-    iso = IsotonicRegression(out_of_bounds="clip")
-    iso.fit(vp, vo)
-    return iso
+def _fit_isotonic_cal(vp: np.ndarray, vo: np.ndarray) -> IsotonicCalibrator:
+    """Isotonic calibration on raw validation scores (pixel level), fitted on binned statistics."""
+    return fit_calibrator("isotonic", vp, vo)
 
 
-def _apply_isotonic_cal(m: IsotonicRegression, p: np.ndarray) -> np.ndarray:
+def _apply_isotonic_cal(m: IsotonicCalibrator, p: np.ndarray) -> np.ndarray:
     """Apply fitted isotonic model to new raw probabilities."""
     return m.predict(p)
 
@@ -829,27 +773,19 @@ def paired_boot_pvalue(sq_a: np.ndarray, sq_b: np.ndarray,
     sq_a and sq_b are per-month squared forecast errors for two competing models.
     Uses the same bootstrap sample (same month indices) for both models at each draw.
     """
-    rng      = np.random.default_rng(seed)
-    obs_diff = float(sq_a.mean() - sq_b.mean())
-    diffs    = np.empty(n_boot, dtype=float)
-    for i in range(n_boot):
-        idx      = rng.integers(0, len(sq_a), len(sq_a))
-        diffs[i] = float(sq_a[idx].mean() - sq_b[idx].mean())
-    diffs_c = diffs - diffs.mean()  # center under null hypothesis
-    return float(np.mean(np.abs(diffs_c) >= np.abs(obs_diff)))
+    idx = resample_indices(len(sq_a), n_boot, seed, BOOTSTRAP_METHOD, BOOTSTRAP_BLOCK_LENGTH)
+    return float(paired_pvalues(np.vstack([sq_a, sq_b]), idx)[0, 1])
 
 
 # ── Validation monthly aggregation ────────────────────────────────────────────
 # Target month for each validation pixel (feature month + 1), matching test split.
-_val_mo_keys = (
-    pd.to_datetime(val["time"]) + pd.DateOffset(months=1)
-).dt.to_period("M").dt.to_timestamp()
+_val_mo_keys = target_month(val["time"])
+_val_groups  = MonthlyGroups.from_times(_val_mo_keys)
 
 # Binary dry indicator and monthly dry-area fraction for the validation set.
 _val_obs_bin = (val[TARGET] == -1).astype(int).values
-_val_obs_mo  = (
-    pd.Series((val[TARGET] == -1).astype(float).values, index=_val_mo_keys)
-    .groupby(level=0).mean()
+_val_obs_mo  = pd.Series(
+    _val_groups.means((val[TARGET] == -1).to_numpy(dtype=float)), index=_val_groups.months
 )  # monthly dry-area fraction, validation set
 
 # ── Optional: build XGB-Spatial validation probabilities ──────────────────────
@@ -857,8 +793,8 @@ _val_obs_mo  = (
 # training (train_forecast_xgb_spatial.py).
 _XGB_SP_MDL_PATH = Path("outputs/xgb_spatial_model.json")
 _SPI_NC_PATH     = Path("data/processed/chirps_v3_monthly_cvalley_spi_1991_2026.nc")
-_PR_NC_PATH      = Path("data/processed/chirps_v3_monthly_cvalley_1991_2026.nc")
-_SPATIAL_FEAT    = ["spi1_nbr_mean", "spi3_nbr_mean", "spi6_nbr_mean", "pr_nbr_mean"]
+_PR_NC_PATH      = PR_FILE
+_SPATIAL_FEAT    = list(NBR_MEAN_FEATURES)
 _FEAT_WITH_SP    = FEATURES + _SPATIAL_FEAT  # full feature list including spatial
 
 _sp_val_dry = None  # (n_val_pixels,) dry-class prob — filled below when possible
@@ -897,51 +833,8 @@ if HAS_XGB_SPATIAL and XGB_SPATIAL_VAL_NPZ.exists():
 if (_sp_val_dry is None and HAS_XGB_SPATIAL and _XGB_SP_MDL_PATH.exists()
         and _SPI_NC_PATH.exists() and _PR_NC_PATH.exists()):
     try:
-        import xarray as xr
         print("  Calibration study: computing XGB-Spatial validation probabilities ...")
-        _pr_ds  = xr.open_dataset(_PR_NC_PATH).load()
-        _spi_ds = xr.open_dataset(_SPI_NC_PATH).load()
-        _pra    = _pr_ds["pr"].astype("float32")
-        _ts     = _pra.time.values
-        _s1     = _spi_ds["spi1"].sel(time=_ts).astype("float32")
-        _s3     = _spi_ds["spi3"].sel(time=_ts).astype("float32")
-        _s6     = _spi_ds["spi6"].sel(time=_ts).astype("float32")
-        if "latitude" in _pra.coords:
-            _lat_coord = "latitude"
-        elif "lat" in _pra.coords:
-            _lat_coord = "lat"
-        else:
-            raise ValueError("No latitude coordinate found (expected 'latitude' or 'lat').")
-
-        if "longitude" in _pra.coords:
-            _lon_coord = "longitude"
-        elif "lon" in _pra.coords:
-            _lon_coord = "lon"
-        else:
-            raise ValueError("No longitude coordinate found (expected 'longitude' or 'lon').")
-
-        def _compute_nbr_mean(da, nm):
-            """3×3 neighbourhood rolling mean (mirrors train_forecast_xgb_spatial.py)."""
-            return da.rolling(
-                {_lat_coord: 3, _lon_coord: 3}, min_periods=1, center=True
-            ).mean().rename(nm)
-
-        _nds = xr.Dataset({
-            "spi1_nbr_mean": _compute_nbr_mean(_s1, "spi1_nbr_mean"),
-            "spi3_nbr_mean": _compute_nbr_mean(_s3, "spi3_nbr_mean"),
-            "spi6_nbr_mean": _compute_nbr_mean(_s6, "spi6_nbr_mean"),
-            "pr_nbr_mean":   _compute_nbr_mean(_pra, "pr_nbr_mean"),
-        }).stack(pixel=(_lat_coord, _lon_coord))
-        _ndf = _nds.reset_index("pixel").to_dataframe()
-        if "time" not in _ndf.columns:
-            _ndf = _ndf.reset_index()
-        _ndf = _ndf.rename(columns={_lat_coord: "latitude", _lon_coord: "longitude"})
-        _ndf["time"] = pd.to_datetime(_ndf["time"])
-
-        _vsp = val.merge(
-            _ndf[["time", "latitude", "longitude"] + _SPATIAL_FEAT],
-            on=["time", "latitude", "longitude"], how="left",
-        )
+        _vsp = add_features(val, ensure_feature_cube(_PR_NC_PATH, _SPI_NC_PATH), _SPATIAL_FEAT)
         _vsp[_SPATIAL_FEAT] = _vsp[_SPATIAL_FEAT].fillna(0.0)
 
         _spm  = xgb.Booster()
@@ -990,7 +883,7 @@ for _mlbl, _vdp, _tdp in _calib_targets:
             _vdp_c = _apply_isotonic_cal(_fitted["isotonic"], _vdp)
 
         # --- aggregate to validation months and score ---
-        _vmo  = pd.Series(_vdp_c, index=_val_mo_keys).groupby(level=0).mean()
+        _vmo  = pd.Series(_val_groups.means(_vdp_c), index=_val_groups.months)
         _cidx = _vmo.index.intersection(_val_obs_mo.index)
         if len(_cidx) == 0:
             continue
@@ -1012,11 +905,7 @@ for _mlbl, _vdp, _tdp in _calib_targets:
         _tdp_c = _apply_isotonic_cal(_fitted["isotonic"], _tdp)
 
     # --- aggregate to test months (aligned to the monthly DataFrame index) ---
-    _tmo = (
-        pd.Series(_tdp_c, index=_test_mo_keys)
-        .groupby(level=0).mean()
-        .reindex(monthly["month_dt"]).values
-    )
+    _tmo = TEST_GROUPS.means(_tdp_c)
     _best_test_mo[_mlbl] = _tmo
 
     # --- test-set metrics ---
@@ -1047,16 +936,11 @@ for _ci, _crow in enumerate(calib_study_rows):
 
     # bootstrap CI for BS (use default-arg capture to avoid closure over loop var)
     _bs_ci = bootstrap_metric(
-        lambda idx, _m=_mo: float(np.mean((obs_dry_frac[idx] - _m[idx]) ** 2)),
+        lambda idx, _m=_mo: brier_batch(obs_dry_frac, _m, idx),
         n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=200 + _ci,
     )
     # bootstrap CI for BSS (relative to climatology)
-    _bss_ci = bootstrap_metric(
-        lambda idx, _m=_mo: bss(
-            float(np.mean((obs_dry_frac[idx] - _m[idx]) ** 2)),
-            float(np.mean((obs_dry_frac[idx] - monthly["clim_dry_frac"].values[idx]) ** 2)),
-        ), n_months, n_boot=N_BOOTSTRAP_ITERATIONS, seed=210 + _ci,
-    )
+    _bss_ci = bss_ci_vs_clim(_mo, seed=210 + _ci)
     # paired test: this model vs climatology
     _p_clim = paired_boot_pvalue(_sq, _clim_sq, n_boot=N_BOOTSTRAP_ITERATIONS, seed=220 + _ci)
     calib_study_rows[_ci]["test_BS_95CI"]  = fmt_ci(_bs_ci)
@@ -1090,6 +974,84 @@ for _mlbl, _mo in _best_test_mo.items():
         monthly["xgb_spatial_calibrated_dry_frac"] = _mo
 
 
+# ── All-pairs significance matrix ─────────────────────────────────────────────
+# Every monthly dry-fraction forecast is compared with every other on one shared
+# set of bootstrap draws: ΔBSS (row − column, vs climatology) with 95 % CI and
+# the paired Brier-score p-value.
+EDL_MONTHLY = Path("outputs/edl_uncertainty_monthly.csv")
+
+_pair_models = {
+    "Climatology": monthly["clim_dry_frac"].values,
+    "Persistence": monthly["persist_dry_frac"].values,
+    "SPI-threshold": monthly["thr_dry_frac"].values,
+    "XGB": monthly["xgb_dry_frac"].values,
+}
+for _flag, _plbl, _pcol in (
+    (HAS_LOGREG, "LogReg", "lr_dry_frac"),
+    (HAS_RF, "RF", "rf_dry_frac"),
+    (HAS_XGB_SPATIAL, "XGB-Spatial", "xgb_spatial_dry_frac"),
+    (HAS_CONVLSTM, "ConvLSTM", "convlstm_dry_frac"),
+):
+    if _flag:
+        _pair_models[_plbl] = monthly[_pcol].values
+for _mlbl, _mo in _best_test_mo.items():
+    _pair_models[f"{_mlbl} (cal)"] = _mo
+if EDL_MONTHLY.exists():
+    _edl = pd.read_csv(EDL_MONTHLY, parse_dates=["target_time"]).set_index("target_time")
+    _edl_mo = _edl["edl_selected_prob_dry"].reindex(pd.DatetimeIndex(monthly["month_dt"])).values
+    if np.isfinite(_edl_mo).all():
+        _pair_models["EDL"] = _edl_mo
+    else:
+        print(f"  NOTE: {EDL_MONTHLY} does not cover every test month; EDL left out of the pair matrix.")
+
+_pairs = paired_skill_matrix(
+    obs_dry_frac, _pair_models, monthly["clim_dry_frac"].values,
+    n_boot=N_BOOTSTRAP_ITERATIONS, seed=240,
+    method=BOOTSTRAP_METHOD, block_length=BOOTSTRAP_BLOCK_LENGTH,
+)
+_pair_names = list(_pairs["models"])
+_pair_rows = [
+    {
+        "model": _a,
+        "vs_model": _b,
+        "BSS_model": round(float(_pairs["bss"][_i]), 5),
+        "BSS_vs_model": round(float(_pairs["bss"][_j]), 5),
+        "delta_BSS": round(float(_pairs["delta_bss"][_i, _j]), 5),
+        "delta_BSS_95CI": fmt_ci((_pairs["delta_bss_lo"][_i, _j], _pairs["delta_bss_hi"][_i, _j])),
+        "p_value": round(float(_pairs["p_value"][_i, _j]), 4),
+    }
+    for _i, _a in enumerate(_pair_names)
+    for _j, _b in enumerate(_pair_names)
+    if _i != _j
+]
+pair_csv_path = OUT_DIR / "paired_significance_matrix.csv"
+pd.DataFrame(_pair_rows).to_csv(pair_csv_path, index=False)
+print(f"  Wrote: {pair_csv_path}")
+
+_fig_pm, _ax_pm = plt.subplots(figsize=(1.0 * len(_pair_names) + 2.5, 0.8 * len(_pair_names) + 1.5))
+_dmax = float(np.nanmax(np.abs(_pairs["delta_bss"]))) or 1.0
+_im_pm = _ax_pm.imshow(_pairs["delta_bss"], cmap="RdBu", vmin=-_dmax, vmax=_dmax)
+for _i in range(len(_pair_names)):
+    for _j in range(len(_pair_names)):
+        if _i == _j:
+            continue
+        _pv = _pairs["p_value"][_i, _j]
+        _ax_pm.text(_j, _i, f"{_pairs['delta_bss'][_i, _j]:+.3f}\np={_pv:.2f}",
+                    ha="center", va="center", fontsize=7,
+                    fontweight="bold" if _pv < 0.05 else "normal")
+_ax_pm.set_xticks(range(len(_pair_names)))
+_ax_pm.set_xticklabels(_pair_names, rotation=35, ha="right")
+_ax_pm.set_yticks(range(len(_pair_names)))
+_ax_pm.set_yticklabels(_pair_names)
+_ax_pm.set_title("Paired bootstrap: ΔBSS (row − column) and p-value\n(bold: p < 0.05)")
+_fig_pm.colorbar(_im_pm, ax=_ax_pm, label="ΔBSS vs climatology")
+_fig_pm.tight_layout()
+pair_png_path = OUT_DIR / "paired_significance_matrix.png"
+_fig_pm.savefig(pair_png_path, dpi=150, bbox_inches="tight")
+plt.close(_fig_pm)
+print(f"  Wrote: {pair_png_path}")
+
+
 # ── Figure 1: Reliability diagram for calibrated XGB models (monthly level) ───
 def _rel_curve(obs_arr: np.ndarray, pred_arr: np.ndarray,
                n_bins: int = 5) -> tuple:
@@ -1293,12 +1255,7 @@ if _CI_FILE.exists():
     )
     print("  ENSO phase assigned from climate_indices_monthly.csv.")
 elif "nino34_lag1" in test.columns:
-    monthly_nino = (
-        test.groupby("month_dt")["nino34_lag1"]
-        .mean()
-        .reindex(monthly["month_dt"])
-        .values
-    )
+    monthly_nino = TEST_GROUPS.means(test["nino34_lag1"].to_numpy(dtype=float))
     monthly["nino34_lag1_mean"] = monthly_nino
     monthly["enso_phase"] = np.where(
         monthly["nino34_lag1_mean"] >= 0.5, "ElNino",
@@ -1347,12 +1304,8 @@ def _season_specific_xgb_calibration() -> pd.DataFrame:
 
         vdp = val_probs[:, 0][vmask]
         vobs = _val_obs_bin[vmask]
-        val_mo_keys_s = _val_mo_keys[vmask]
-        val_obs_mo_s = (
-            pd.Series(vobs.astype(float), index=val_mo_keys_s)
-            .groupby(level=0)
-            .mean()
-        )
+        val_groups_s = MonthlyGroups.from_times(_val_mo_keys[vmask])
+        val_obs_mo_s = pd.Series(val_groups_s.means(vobs.astype(float)), index=val_groups_s.months)
 
         fitted: dict = {}
         candidates: list[tuple[str, float]] = []
@@ -1367,7 +1320,7 @@ def _season_specific_xgb_calibration() -> pd.DataFrame:
                 else:
                     fitted[method] = _fit_isotonic_cal(vdp, vobs)
                     vdp_c = _apply_isotonic_cal(fitted[method], vdp)
-                vmo = pd.Series(vdp_c, index=val_mo_keys_s).groupby(level=0).mean()
+                vmo = pd.Series(val_groups_s.means(vdp_c), index=val_groups_s.months)
                 common_idx = vmo.index.intersection(val_obs_mo_s.index)
                 if len(common_idx) == 0:
                     continue
@@ -1395,8 +1348,8 @@ def _season_specific_xgb_calibration() -> pd.DataFrame:
         else:
             tdp_c = _apply_isotonic_cal(fitted[best_method], tdp)
 
-        test_mo_keys_s = _test_mo_keys[tmask]
-        tmo = pd.Series(tdp_c, index=test_mo_keys_s).groupby(level=0).mean()
+        test_groups_s = MonthlyGroups.from_times(_test_mo_keys[tmask])
+        tmo = pd.Series(test_groups_s.means(tdp_c), index=test_groups_s.months)
         season_months = pd.DatetimeIndex(
             monthly.loc[monthly["season"] == season, "month_dt"]
         )
@@ -1446,10 +1399,7 @@ def _stratified_bss(dfm: pd.DataFrame, group_col: str) -> pd.DataFrame:
         if not np.isfinite(score):
             return score, "[nan, nan]"
         ci = bootstrap_metric(
-            lambda idx: bss(
-                brier_score(obs[idx], pred[idx]),
-                brier_score(obs[idx], ref[idx]),
-            ),
+            lambda idx: bss_batch(obs, pred, ref, idx),
             len(obs),
             n_boot=N_BOOTSTRAP_ITERATIONS,
             seed=seed,
@@ -20,6 +20,7 @@ import numpy as np
 import pandas as pd
 import xgboost as xgb
 import matplotlib.pyplot as plt
+from dataset_loader import dataset_columns, load_split
 from feature_config import get_feature_columns
 
 DATA    = Path("data/processed/dataset_forecast.parquet")
@@ -30,10 +31,8 @@ TARGET = "target_label"
 
 # ---- load ----
 print("Loading data and model...")
-df = pd.read_parquet(DATA)
-df["year"] = df["year"].astype(int)
-FEATURES = get_feature_columns(df.columns)
-test = df[df["year"] >= 2021].copy()
+FEATURES = get_feature_columns(dataset_columns(DATA))
+test = load_split("test", FEATURES, path=DATA, columns=["time"])
 
 model = xgb.Booster()
 model.load_model(MODEL.as_posix())
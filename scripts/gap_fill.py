@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+Nearest-valid gap fill for gridded cubes with a fixed land/sea gap pattern.
+
+ERA5-Land gaps (sea and lake cells) were filled by sorting the cube and running
+xarray interpolate_na(method="nearest") along longitude and then latitude,
+over every time step and for every variable. The gaps are in the same place
+in every month, so the answer to "which valid cell is nearest?" is fixed too.
+
+This module computes that answer once per gap pattern with a Euclidean
+distance transform (scipy.ndimage.distance_transform_edt). The result is an
+index map: for every cell, the flat index of its nearest valid cell, and the
+cell itself where it is valid. Distances use the cell spacing in km-proportional
+units (Δlat, Δlon · cos(mean lat)), so "nearest" is nearest on the ground and
+not along one axis first. Filling a whole cube is then one fancy-indexing
+gather, values[:, index].
+
+Index maps are cached as <source stem>_nearest_fill_<key>.npz next to the
+source file, keyed by the gap mask and the grid. A time step whose gaps differ
+from the common pattern (for example a month that is entirely missing) gets
+its own map, or stays NaN when it has no valid cell at all.
+
+  python scripts/gap_fill.py --benchmark
+"""
+from __future__ import annotations
+
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+import hashlib
+import time
+
+import numpy as np
+import xarray as xr
+from scipy import ndimage
+
+
+_INDEX: dict[str, np.ndarray] = {}
+
+
+def grid_sampling(latitude: np.ndarray, longitude: np.ndarray) -> tuple[float, float]:
+    """Cell spacing along (latitude, longitude), with longitude shrunk by cos(latitude)."""
+    dlat = float(np.abs(np.diff(latitude)).mean()) if len(latitude) > 1 else 1.0
+    dlon = float(np.abs(np.diff(longitude)).mean()) if len(longitude) > 1 else 1.0
+    return dlat, dlon * float(np.cos(np.deg2rad(np.mean(latitude))))
+
+
+def nearest_valid_index(valid: np.ndarray, sampling: tuple[float, float] | None = None) -> np.ndarray:
+    """int32 flat index of the nearest valid cell of a 2-D mask (identity on valid cells)."""
+    if not valid.any():
+        raise ValueError("Gap mask has no valid cell to fill from.")
+    _, (lat_idx, lon_idx) = ndimage.distance_transform_edt(~valid, sampling=sampling, return_indices=True)
+    return (lat_idx * valid.shape[1] + lon_idx).astype(np.int32).ravel()
+
+
+def _mask_key(valid: np.ndarray, latitude: np.ndarray, longitude: np.ndarray) -> str:
+    digest = hashlib.sha256()
+    digest.update(np.asarray(valid.shape, dtype=np.int64).tobytes())
+    digest.update(np.packbits(valid).tobytes())
+    for arr in (latitude, longitude):
+        digest.update(np.round(np.asarray(arr, dtype=np.float64), 6).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def fill_index(
+    valid: np.ndarray,
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+    cache_file: Path | None = None,
+) -> np.ndarray:
+    """Cached nearest_valid_index for a gap mask on a (latitude, longitude) grid."""
+    key = _mask_key(valid, latitude, longitude)
+    memo_key = f"{cache_file}:{key}"
+    if memo_key in _INDEX:
+        return _INDEX[memo_key]
+    path = None
+    if cache_file is not None:
+        cache_file = Path(cache_file)
+        path = cache_file.with_name(f"{cache_file.stem}_nearest_fill_{key}.npz")
+    if path is not None and path.exists():
+        with np.load(path) as payload:
+            index = payload["index"]
+    else:
+        index = nearest_valid_index(valid, grid_sampling(latitude, longitude))
+        if path is not None:
+            tmp = path.with_name(path.stem + ".tmp.npz")
+            np.savez(tmp, index=index)
+            tmp.replace(path)
+            print(f"Saved nearest-fill index ({int((~valid).sum()):,} gap cells) -> {path}")
+    _INDEX[memo_key] = index
+    return index
+
+
+def fill_nearest_array(
+    values: np.ndarray,
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+    cache_file: Path | None = None,
+) -> np.ndarray:
+    """Fill NaNs of a (..., latitude, longitude) array from the nearest valid cell."""
+    values = np.asarray(values)
+    lead = values.shape[:-2]
+    n_lat, n_lon = values.shape[-2:]
+    flat = values.reshape(-1, n_lat * n_lon)
+    gaps = np.isnan(flat)
+    if not gaps.any():
+        return values
+    out = flat.copy()
+    patterns, inverse = np.unique(np.packbits(gaps, axis=1), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    for pattern_id in range(len(patterns)):
+        rows = np.flatnonzero(inverse == pattern_id)
+        valid = ~gaps[rows[0]].reshape(n_lat, n_lon)
+        if valid.all() or not valid.any():
+            continue
+        index = fill_index(valid, latitude, longitude, cache_file)
+        out[rows] = flat[rows][:, index]
+    return out.reshape(lead + (n_lat, n_lon))
+
+
+def fill_nearest(da: xr.DataArray, cache_file: Path | None = None) -> xr.DataArray:
+    """da with gaps filled from the nearest valid cell; grid order is left as is."""
+    lat_name = "latitude" if "latitude" in da.dims else "lat"
+    lon_name = "longitude" if "longitude" in da.dims else "lon"
+    other = [dim for dim in da.dims if dim not in (lat_name, lon_name)]
+    da = da.transpose(*other, lat_name, lon_name)
+    filled = fill_nearest_array(da.values, da[lat_name].values, da[lon_name].values, cache_file)
+    return da.copy(data=filled)
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Time the cached index fill against two interpolate_na passes on a synthetic ERA5-Land cube.",
+    )
+    parser.add_argument("--n-time", type=int, default=432)
+    parser.add_argument("--n-vars", type=int, default=2, help="Variables filled per run in the benchmark.")
+    return parser.parse_args()
+
+
+def benchmark(n_time: int, n_vars: int) -> None:
+    rng = np.random.default_rng(0)
+    lat = np.round(np.arange(41.0, 34.9, -0.1), 4)
+    lon = np.round(np.arange(-123.0, -118.1, 0.1), 4)
+    lon2d, lat2d = np.meshgrid(lon, lat)
+    sea = (lon2d < -122.4 + 0.35 * (lat2d - 35.0) / 6.0) | ((lat2d - 38.1) ** 2 + (lon2d + 122.2) ** 2 < 0.04)
+    variables = []
+    for _ in range(n_vars):
+        values = rng.normal(size=(n_time, len(lat), len(lon))).astype(np.float32)
+        values[:, sea] = np.nan
+        variables.append(xr.DataArray(
+            values,
+            dims=("time", "latitude", "longitude"),
+            coords={"time": np.arange(n_time), "latitude": lat, "longitude": lon},
+        ))
+
+    start = time.perf_counter()
+    for da in variables:
+        legacy = (
+            da.sortby("latitude").sortby("longitude")
+            .interpolate_na("longitude", method="nearest", fill_value="extrapolate")
+            .interpolate_na("latitude", method="nearest", fill_value="extrapolate")
+        ).sel(latitude=da["latitude"], longitude=da["longitude"])
+    legacy_s = time.perf_counter() - start
+
+    _INDEX.clear()
+    start = time.perf_counter()
+    for da in variables:
+        filled = fill_nearest(da)
+    new_s = time.perf_counter() - start
+
+    valid = ~sea
+    untouched = np.array_equal(filled.values[:, valid], variables[-1].values[:, valid])
+    same_source = float((filled.values[:, sea] == legacy.values[:, sea]).mean())
+    print(f"Cube: {n_vars} variables x {n_time} months x {len(lat)} x {len(lon)}, {int(sea.sum())} gap cells")
+    print(f"interpolate_na (lon, then lat):  {legacy_s:.3f} s")
+    print(f"distance-transform index fill:   {new_s:.3f} s  ({legacy_s / max(new_s, 1e-9):.1f}x)")
+    print(f"Remaining NaN: legacy {int(np.isnan(legacy.values).sum())}, new {int(np.isnan(filled.values).sum())}")
+    print(f"Valid cells unchanged: {untouched}; gap cells with the same value as legacy: {same_source:.1%}")
+
+
+def main() -> None:
+    args = parse_args()
+    if args.benchmark:
+        benchmark(args.n_time, args.n_vars)
+    else:
+        print("Nothing to do; pass --benchmark, or import fill_nearest().")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""
+Per-region grid registry: integer pixel and month keys for grid-derived tables.
+
+Feature tables used to be joined with DataFrame.merge on float latitude,
+longitude and time. On multi-million-row frames that hash join is slow, and
+it silently misses rows when a coordinate is rounded differently on one side.
+The registry fixes a region's CHIRPS grid once, so two integer keys are
+enough:
+
+  pixel_id     int32  row-major index into the (latitude, longitude) grid,
+                      lat_index * n_lon + lon_index
+  month_index  int16  months since 1991-01 (EPOCH)
+
+Forecast tables carry both columns (tabular_builder.py). A grid-derived
+feature is then a positional gather, cube[month position, pixel_id], with no
+merge at all; see gather().
+
+The registry is stored as <pr stem>_grid.json next to the region's
+precipitation cube. A later cube on a different grid raises an error instead of
+silently renumbering pixels.
+
+  python scripts/grid_registry.py data/processed/chirps_v3_monthly_cvalley_1991_2026.nc
+"""
+from __future__ import annotations
+
+from argparse import ArgumentParser, Namespace
+from dataclasses import dataclass
+from pathlib import Path
+import json
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+EPOCH = np.datetime64("1991-01", "M")
+
+_REGISTRIES: dict[str, "GridRegistry"] = {}
+
+
+def month_index(times) -> np.ndarray:
+    """int16 months since EPOCH for datetimes (any day within the month)."""
+    months = pd.DatetimeIndex(np.asarray(times).ravel()).values.astype("datetime64[M]")
+    return (months - EPOCH).astype(np.int16)
+
+
+def month_times(index: np.ndarray) -> np.ndarray:
+    """Month-start datetime64[ns] for month_index values."""
+    return (EPOCH + np.asarray(index, dtype=np.int64)).astype("datetime64[ns]")
+
+
+def month_positions(axis_index: np.ndarray, index: np.ndarray) -> np.ndarray:
+    """Position of each month_index value on a cube's month axis; -1 where absent."""
+    axis_index = np.asarray(axis_index, dtype=np.int64)
+    index = np.asarray(index, dtype=np.int64)
+    if axis_index.size == 0:
+        return np.full(index.shape, -1, dtype=np.int64)
+    lo = min(int(axis_index.min()), int(index.min(initial=axis_index.min())))
+    hi = max(int(axis_index.max()), int(index.max(initial=axis_index.max())))
+    lookup = np.full(hi - lo + 1, -1, dtype=np.int64)
+    lookup[axis_index - lo] = np.arange(axis_index.size)
+    return lookup[index - lo]
+
+
+def _nearest(grid: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Index of the nearest grid value within half a cell; -1 otherwise."""
+    order = np.argsort(grid)
+    ordered = grid[order]
+    pos = np.clip(np.searchsorted(ordered, query), 1, max(len(ordered) - 1, 1))
+    left, right = ordered[pos - 1], ordered[np.minimum(pos, len(ordered) - 1)]
+    pos = np.where(np.abs(query - right) < np.abs(query - left), pos, pos - 1)
+    idx = order[np.minimum(pos, len(ordered) - 1)]
+    steps = np.diff(ordered)
+    half_cell = float(steps[steps > 0].min()) / 2 if (steps > 0).any() else 1e-6
+    return np.where(np.abs(query - grid[idx]) <= half_cell + 1e-9, idx, -1)
+
+
+@dataclass(frozen=True, eq=False)
+class GridRegistry:
+    """A region's canonical (latitude, longitude) grid and its pixel numbering."""
+
+    latitude: np.ndarray
+    longitude: np.ndarray
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.latitude), len(self.longitude)
+
+    @property
+    def n_pixels(self) -> int:
+        return len(self.latitude) * len(self.longitude)
+
+    def same_grid(self, other: "GridRegistry") -> bool:
+        return (
+            self.shape == other.shape
+            and np.allclose(self.latitude, other.latitude, rtol=0, atol=1e-6)
+            and np.allclose(self.longitude, other.longitude, rtol=0, atol=1e-6)
+        )
+
+    def pixel_id(self, latitude, longitude) -> np.ndarray:
+        """int32 pixel ids for coordinates on the grid; -1 for points off the grid."""
+        lat_idx = _nearest(np.asarray(self.latitude, dtype=np.float64), np.asarray(latitude, dtype=np.float64))
+        lon_idx = _nearest(np.asarray(self.longitude, dtype=np.float64), np.asarray(longitude, dtype=np.float64))
+        ids = lat_idx * len(self.longitude) + lon_idx
+        return np.where((lat_idx < 0) | (lon_idx < 0), -1, ids).astype(np.int32)
+
+    def coords(self, pixel_id: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Latitude and longitude of pixel ids."""
+        lat_idx, lon_idx = np.divmod(np.asarray(pixel_id, dtype=np.int64), len(self.longitude))
+        return np.asarray(self.latitude)[lat_idx], np.asarray(self.longitude)[lon_idx]
+
+    @classmethod
+    def from_data(cls, data: xr.Dataset | xr.DataArray) -> "GridRegistry":
+        lat_name = "latitude" if "latitude" in data.coords else "lat"
+        lon_name = "longitude" if "longitude" in data.coords else "lon"
+        return cls(np.asarray(data[lat_name].values), np.asarray(data[lon_name].values))
+
+    def save(self, path: Path) -> None:
+        payload = {
+            "epoch": str(EPOCH),
+            "latitude": np.asarray(self.latitude, dtype=np.float64).tolist(),
+            "longitude": np.asarray(self.longitude, dtype=np.float64).tolist(),
+        }
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(payload))
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "GridRegistry":
+        payload = json.loads(Path(path).read_text())
+        return cls(np.asarray(payload["latitude"]), np.asarray(payload["longitude"]))
+
+
+def registry_path(pr_file: Path) -> Path:
+    pr_file = Path(pr_file)
+    return pr_file.with_name(f"{pr_file.stem}_grid.json")
+
+
+def grid_registry(pr_file: Path) -> GridRegistry:
+    """
+    The registry of the region whose precipitation cube is pr_file.
+
+    Created from the cube's coordinates on first use. Raises ValueError when
+    the cube's grid no longer matches the stored registry, since every stored
+    pixel_id would then point at a different cell.
+    """
+    pr_file = Path(pr_file)
+    key = str(pr_file.resolve())
+    if key in _REGISTRIES:
+        return _REGISTRIES[key]
+    with xr.open_dataset(pr_file) as ds:
+        current = GridRegistry.from_data(ds)
+    path = registry_path(pr_file)
+    if path.exists():
+        stored = GridRegistry.load(path)
+        if not stored.same_grid(current):
+            raise ValueError(
+                f"{pr_file} is no longer on the grid registered in {path}. "
+                "Delete the registry and rebuild the tables that carry pixel_id."
+            )
+        current = stored
+    else:
+        current.save(path)
+        print(f"Registered grid {current.shape[0]} x {current.shape[1]} -> {path}")
+    _REGISTRIES[key] = current
+    return current
+
+
+def row_keys(frame: pd.DataFrame, registry: GridRegistry) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (pixel_id, month_index) of each row, from the stored columns when present.
+
+    Tables written before the keys existed fall back to a nearest-cell lookup
+    of their latitude/longitude, which is still a vectorised search, not a join.
+    """
+    if "pixel_id" in frame.columns:
+        pixel_id = frame["pixel_id"].to_numpy(dtype=np.int32)
+    else:
+        pixel_id = registry.pixel_id(frame["latitude"].to_numpy(), frame["longitude"].to_numpy())
+    if "month_index" in frame.columns:
+        months = frame["month_index"].to_numpy(dtype=np.int16)
+    else:
+        months = month_index(frame["time"].to_numpy())
+    return pixel_id, months
+
+
+def gather(
+    cube: np.ndarray,
+    cube_months: np.ndarray,
+    pixel_id: np.ndarray,
+    months: np.ndarray,
+    fill: float = np.nan,
+) -> np.ndarray:
+    """
+    Values of a (time, latitude, longitude) cube at each row's (month, pixel).
+
+    cube_months is the month_index of the cube's time axis. Rows whose month
+    is not on the axis, or whose pixel_id is -1, get `fill`.
+    """
+    flat = np.asarray(cube).reshape(cube.shape[0], -1)
+    t_pos = month_positions(cube_months, months)
+    pixel_id = np.asarray(pixel_id, dtype=np.int64)
+    ok = (t_pos >= 0) & (pixel_id >= 0)
+    dtype = np.result_type(flat.dtype, np.float32) if np.isnan(fill) else flat.dtype
+    out = np.full(len(pixel_id), fill, dtype=dtype)
+    out[ok] = flat[t_pos[ok], pixel_id[ok]]
+    return out
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("pr_files", type=Path, nargs="+", help="Regional precipitation cubes to register.")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    for pr_file in args.pr_files:
+        registry = grid_registry(pr_file)
+        print(f"{pr_file}: {registry.shape[0]} x {registry.shape[1]} = {registry.n_pixels:,} pixels")
+
+
+if __name__ == "__main__":
+    main()
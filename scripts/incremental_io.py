@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Helpers for incremental updates of processed monthly NetCDF products.
+
+Two pieces are shared by the clipping and SPI scripts:
+  - a JSON manifest stored next to an output file that records the size,
+    mtime and SHA-256 of every source file used to build it, so reruns can
+    tell which raw files are new or changed;
+  - write_time_steps(), which overwrites months already present in an output
+    file and appends newer months along an unlimited time dimension in place.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+import hashlib
+import json
+
+import netCDF4
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+def sha256_file(path: Path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path: Path) -> dict[str, object]:
+    stat = path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256_file(path)}
+
+
+def manifest_path(out_file: Path) -> Path:
+    return out_file.with_name(out_file.name + ".manifest.json")
+
+
+def load_manifest(out_file: Path) -> dict[str, dict[str, object]]:
+    path = manifest_path(out_file)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text()).get("sources", {})
+
+
+def save_manifest(out_file: Path, sources: dict[str, dict[str, object]]) -> None:
+    payload = {"output": out_file.name, "sources": dict(sorted(sources.items()))}
+    manifest_path(out_file).write_text(json.dumps(payload, indent=2))
+
+
+def changed_sources(
+    files: list[Path],
+    manifest: dict[str, dict[str, object]],
+) -> tuple[list[Path], dict[str, dict[str, object]]]:
+    """
+    Return source files whose content differs from the manifest, plus the refreshed manifest.
+
+    Size and mtime are checked first; the checksum is only computed when they
+    differ, so a touched-but-identical file is not reprocessed.
+    """
+    updated = dict(manifest)
+    todo = []
+    for path in files:
+        entry = manifest.get(path.name)
+        stat = path.stat()
+        if entry and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+            continue
+        fingerprint = file_fingerprint(path)
+        if entry and entry.get("sha256") == fingerprint["sha256"]:
+            updated[path.name] = fingerprint
+            continue
+        todo.append(path)
+    return todo, updated
+
+
+def existing_times(out_file: Path) -> pd.DatetimeIndex:
+    with xr.open_dataset(out_file) as ds:
+        return pd.DatetimeIndex(ds["time"].values)
+
+
+def _rewrite_with_unlimited_time(
+    out_file: Path,
+    new_ds: xr.Dataset,
+    encoding: dict[str, dict[str, object]],
+) -> None:
+    with xr.open_dataset(out_file) as old:
+        old = old.load()
+    overlap = old["time"].isin(new_ds["time"].values)
+    combined = xr.concat([old.isel(time=~overlap.values), new_ds], dim="time").sortby("time")
+    tmp_file = out_file.with_suffix(".tmp.nc")
+    combined.to_netcdf(tmp_file, encoding=encoding, unlimited_dims=["time"])
+    tmp_file.replace(out_file)
+
+
+def write_time_steps(
+    out_file: Path,
+    new_ds: xr.Dataset,
+    encoding: dict[str, dict[str, object]],
+) -> tuple[int, int]:
+    """
+    Merge new monthly slices into an existing NetCDF file along time.
+
+    Months already present are overwritten in place; later months are
+    appended. Files with a fixed-size time dimension, or updates that would
+    insert months before the current end, are rewritten once with an
+    unlimited time dimension. Returns (n_overwritten, n_appended).
+    """
+    new_ds = new_ds.sortby("time")
+    new_times = pd.DatetimeIndex(new_ds["time"].values)
+    if new_times.has_duplicates:
+        raise ValueError(f"Duplicate months in update for {out_file}")
+
+    with xr.open_dataset(out_file) as old:
+        old_times = pd.DatetimeIndex(old["time"].values)
+        for dim in new_ds.dims:
+            if dim != "time" and not np.array_equal(old[dim].values, new_ds[dim].values):
+                raise ValueError(f"Update grid for '{dim}' does not match {out_file}")
+
+    positions = old_times.get_indexer(new_times)
+    present = positions >= 0
+    n_overwrite = int(present.sum())
+    n_append = int((~present).sum())
+    in_order = n_append == 0 or new_times[~present].min() > old_times.max()
+
+    with netCDF4.Dataset(out_file, "a") as nc:
+        unlimited = nc.dimensions["time"].isunlimited()
+        if in_order and (unlimited or n_append == 0):
+            if n_overwrite:
+                idx = positions[present]
+                for name in new_ds.data_vars:
+                    nc.variables[name][idx] = new_ds[name].values[present]
+            if n_append:
+                n_old = len(nc.dimensions["time"])
+                time_var = nc.variables["time"]
+                stamps = new_times[~present].to_pydatetime()
+                time_var[n_old:n_old + n_append] = netCDF4.date2num(
+                    stamps, time_var.units, getattr(time_var, "calendar", "standard")
+                )
+                for name in new_ds.data_vars:
+                    nc.variables[name][n_old:n_old + n_append] = new_ds[name].values[~present]
+            return n_overwrite, n_append
+
+    print(f"Rewriting {out_file.name} once with an unlimited time dimension.")
+    _rewrite_with_unlimited_time(out_file, new_ds, encoding)
+    return n_overwrite, n_append
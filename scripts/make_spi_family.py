@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+Compute an SPI family cube for a list of accumulation windows in one pass.
+
+Each SPI script used to roll its own window: make_spi_labels.py for SPI-1/3/6,
+the multi-region runner for SPI-3/6 per pixel block and the regionalization
+analysis for SPI-12, each looping np.nansum over time. This script builds
+every requested accumulation from one NaN-aware cumulative sum over the
+(time, latitude, longitude) cube, fits the gamma parameters for all windows
+and pixels of a calendar month together, and writes a single cube:
+
+  spi(window, time, latitude, longitude)
+
+Seasonal and long-lead experiments read any window from it (see
+spi_engine.family_windows) instead of recomputing accumulations.
+
+Input:
+  data/processed/chirps_v3_monthly_cvalley_1991_2026.nc
+
+Output:
+  data/processed/chirps_v3_monthly_cvalley_spi_family_1991_2026.nc
+  data/processed/chirps_v3_monthly_cvalley_spi_family_params_1991_2020.nc
+    Fitted (alpha, beta, p_zero) per window × calendar month × pixel
+
+Usage:
+  python scripts/make_spi_family.py --windows 1 2 3 6 9 12 24
+  python scripts/make_spi_family.py --benchmark
+"""
+from __future__ import annotations
+
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+import time
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from spi_engine import rolling_sums, save_param_store, spi_by_calendar_month, spi_family
+
+IN_FILE = Path("data/processed/chirps_v3_monthly_cvalley_1991_2026.nc")
+OUT_DIR = Path("data/processed")
+OUT_FILE = OUT_DIR / "chirps_v3_monthly_cvalley_spi_family_1991_2026.nc"
+PARAMS_FILE = OUT_DIR / "chirps_v3_monthly_cvalley_spi_family_params_1991_2020.nc"
+
+BASELINE_START_YEAR = 1991
+BASELINE_END_YEAR = 2020
+DEFAULT_WINDOWS = (1, 2, 3, 6, 9, 12, 24)
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--in-file", type=Path, default=IN_FILE)
+    parser.add_argument("--out-file", type=Path, default=OUT_FILE)
+    parser.add_argument("--params-file", type=Path, default=PARAMS_FILE)
+    parser.add_argument(
+        "--windows",
+        nargs="+",
+        type=int,
+        default=list(DEFAULT_WINDOWS),
+        help="Accumulation windows in months (default: 1 2 3 6 9 12 24).",
+    )
+    parser.add_argument("--baseline-start-year", type=int, default=BASELINE_START_YEAR)
+    parser.add_argument("--baseline-end-year", type=int, default=BASELINE_END_YEAR)
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Time the per-window nansum loop against the cumulative-sum family on synthetic data.",
+    )
+    return parser.parse_args()
+
+
+def family_dataset(
+    pr: xr.DataArray,
+    spi: np.ndarray,
+    windows: list[int],
+    attrs: dict[str, object],
+) -> xr.Dataset:
+    da = xr.DataArray(
+        spi,
+        coords={
+            "window": np.asarray(windows, dtype=np.int16),
+            "time": pr.time,
+            "latitude": pr.latitude,
+            "longitude": pr.longitude,
+        },
+        dims=("window", "time", "latitude", "longitude"),
+        name="spi",
+        attrs={"long_name": "Standardized Precipitation Index", "units": "dimensionless"},
+    )
+    ds = da.to_dataset()
+    ds["window"].attrs = {"long_name": "Accumulation window", "units": "months"}
+    ds.attrs.update(attrs)
+    return ds
+
+
+def run(args: Namespace) -> None:
+    windows = sorted(set(args.windows))
+    print("Loading", args.in_file)
+    with xr.open_dataset(args.in_file) as ds:
+        pr = ds["pr"].load()  # (time, latitude, longitude)
+    time_pd = pd.DatetimeIndex(pr.time.values)
+    baseline_mask = (time_pd.year >= args.baseline_start_year) & (time_pd.year <= args.baseline_end_year)
+    months_arr = time_pd.month.to_numpy()
+
+    print(f"Computing SPI for windows {windows}...")
+    spi, params_by_window = spi_family(pr.values, months_arr, baseline_mask, windows)
+
+    attrs = {
+        "baseline_years": f"{args.baseline_start_year}-{args.baseline_end_year}",
+        "source_file": str(args.in_file),
+        "method": "zero-inflated gamma, location 0, MLE per pixel x calendar month",
+    }
+    save_param_store(
+        args.params_file,
+        params_by_window,
+        {"latitude": pr.latitude.values, "longitude": pr.longitude.values},
+        attrs=attrs,
+    )
+    print("Saved SPI fit parameters to", args.params_file)
+
+    out_ds = family_dataset(pr, spi, windows, attrs)
+    chunks = (1,) + spi.shape[1:]
+    args.out_file.parent.mkdir(parents=True, exist_ok=True)
+    out_ds.to_netcdf(args.out_file, encoding={"spi": {"zlib": True, "complevel": 4, "chunksizes": chunks}})
+    print("Wrote:", args.out_file)
+    for i, window in enumerate(windows):
+        vals = spi[i]
+        if np.isfinite(vals).any():
+            print(f"  SPI-{window:<2d} range: [{np.nanmin(vals):.2f}, {np.nanmax(vals):.2f}], "
+                  f"valid={np.isfinite(vals).mean():.1%}")
+
+
+def _legacy_rolling_sum(arr: np.ndarray, window: int) -> np.ndarray:
+    """Per-step np.nansum loop the SPI scripts used before, kept for --benchmark."""
+    arr = np.asarray(arr, dtype=np.float64)
+    out = np.full_like(arr, np.nan, dtype=np.float64)
+    for t in range(window - 1, arr.shape[0]):
+        block = arr[t - window + 1 : t + 1]
+        out[t] = np.nansum(block, axis=0)
+        out[t][np.any(np.isnan(block), axis=0)] = np.nan
+    return out
+
+
+def benchmark(windows: list[int], n_years: int = 36, shape: tuple[int, int] = (60, 80), seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    n_time = 12 * n_years
+    values = rng.gamma(1.0, 50.0, size=(n_time,) + shape)
+    values[rng.uniform(size=values.shape) < 0.3] = 0.0
+    values[rng.uniform(size=values.shape) < 0.01] = np.nan
+    months = np.tile(np.arange(1, 13), n_years)
+    years = np.repeat(np.arange(1991, 1991 + n_years), 12)
+    baseline_mask = (years >= BASELINE_START_YEAR) & (years <= BASELINE_END_YEAR)
+
+    start = time.perf_counter()
+    legacy_rolled = [values if w == 1 else _legacy_rolling_sum(values, w) for w in windows]
+    legacy_roll_s = time.perf_counter() - start
+    legacy = [spi_by_calendar_month(rolled, months, baseline_mask) for rolled in legacy_rolled]
+    legacy_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rolling_sums(values, windows)
+    roll_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    family, _ = spi_family(values, months, baseline_mask, windows)
+    family_s = time.perf_counter() - start
+
+    max_diff = max(
+        float(np.nanmax(np.abs(family[i] - legacy[i]))) if np.isfinite(legacy[i]).any() else 0.0
+        for i in range(len(windows))
+    )
+    nan_match = all(np.array_equal(np.isnan(family[i]), np.isnan(legacy[i])) for i in range(len(windows)))
+    print(f"Synthetic cube {values.shape}, windows {windows}")
+    print(f"  accumulations   : nansum loop {legacy_roll_s:6.2f} s, cumulative sum {roll_s:6.2f} s "
+          f"({legacy_roll_s / roll_s:.1f}x)")
+    print(f"  accumulate+fit  : per-window {legacy_s:6.2f} s, SPI family     {family_s:6.2f} s "
+          f"({legacy_s / family_s:.1f}x)")
+    print(f"  max |diff| = {max_diff:.2e}, NaN pattern identical: {nan_match}")
+
+
+def main() -> None:
+    args = parse_args()
+    if args.benchmark:
+        benchmark(sorted(set(args.windows)))
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+Pixel -> month aggregation from precomputed segment offsets.
+
+Monthly scores reduce a pixel-level frame to one row per target month:
+observed dry fraction, each model's mean dry probability, and the references.
+Every experiment did this with frame.groupby("target_time").agg(...). That
+call was repeated for each calibration method, model and scenario, so the
+same 400k+ rows were hashed and grouped many times. target_month() also went
+through pd.DateOffset row by row.
+
+MonthlyGroups sorts a frame's rows by target month once and keeps the sort
+order and the segment start offsets. Every monthly mean after that is a
+single np.add.reduceat over a 2-D (rows x columns) block: all probability
+columns and the observation go through in one pass. As with groupby().mean(),
+NaNs are skipped per column. Output months are sorted, matching groupby.
+
+  groups = MonthlyGroups.from_frame(test)
+  monthly = groups.aggregate(test, {"y_true_dry_frac": "is_dry", "xgb_prob_dry": "xgb_prob_dry"})
+  val_bs = monthly_brier_scores(MonthlyGroups.from_frame(val), val, {"raw": "xgb_raw_prob_dry"})
+
+  python scripts/monthly_groups.py --benchmark
+"""
+from __future__ import annotations
+
+from argparse import ArgumentParser, Namespace
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def target_month(series: pd.Series, lead_months: int = 1) -> pd.Series:
+    """Month start lead_months after each time, in the input's datetime unit.
+
+    Month arithmetic runs on the distinct times only and is broadcast back by
+    code, since a pixel table repeats each month for every pixel.
+    """
+    times = pd.to_datetime(series).to_numpy()
+    codes, distinct = pd.factorize(times)
+    distinct = np.asarray(distinct, dtype=times.dtype)
+    shifted = (distinct.astype("datetime64[M]") + np.timedelta64(lead_months, "M")).astype(times.dtype)
+    out = shifted[codes]
+    out[codes < 0] = np.datetime64("NaT")
+    return pd.Series(out, index=series.index, name=series.name)
+
+
+def _column_block(frame: pd.DataFrame, columns: Sequence[str]) -> np.ndarray:
+    """(rows, columns) float64 array laid out column-major."""
+    return np.stack([frame[col].to_numpy(dtype=np.float64) for col in columns]).T
+
+
+@dataclass(frozen=True, eq=False)
+class MonthlyGroups:
+    """Rows of one frame grouped by month: sort order plus segment offsets."""
+
+    months: np.ndarray   # datetime64, one per segment, ascending
+    order: np.ndarray    # row positions sorted by month
+    starts: np.ndarray   # offset of each segment in `order`
+    counts: np.ndarray   # rows per segment
+    n_rows: int          # rows in the frame, including any NaT rows left out
+
+    @classmethod
+    def from_times(cls, times) -> "MonthlyGroups":
+        values = np.asarray(times).ravel()
+        if values.dtype.kind != "M":
+            values = pd.to_datetime(values).to_numpy()
+        # Hash the few distinct months, rank them, then stable-sort the small
+        # integer codes (a radix sort) instead of comparison-sorting datetimes.
+        # NaT rows get code -1 and, as in groupby, belong to no month.
+        codes, months = pd.factorize(values)
+        months = np.asarray(months)
+        rank = np.empty(len(months) + 1, dtype=np.int64)
+        rank[np.argsort(months)] = np.arange(len(months))
+        rank[-1] = -1
+        codes = rank[codes]
+        if len(months) < np.iinfo(np.int16).max:
+            codes = codes.astype(np.int16)
+        order = np.argsort(codes, kind="stable")
+        order = order[np.count_nonzero(codes < 0):]
+        counts = np.bincount(codes[codes >= 0], minlength=len(months))
+        starts = (np.cumsum(counts) - counts).astype(np.int64)
+        return cls(np.sort(months), order, starts, counts, len(values))
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame, time_col: str = "target_time") -> "MonthlyGroups":
+        return cls.from_times(frame[time_col].to_numpy())
+
+    def means(self, values: np.ndarray) -> np.ndarray:
+        """Per-month means of a (rows,) or (rows, columns) array, NaNs skipped."""
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) != self.n_rows:
+            raise ValueError(f"Expected {self.n_rows} rows, got {len(values)}.")
+        if len(self.months) == 0:
+            return np.zeros((0,) + values.shape[1:])
+        # Gather and reduce along the last axis of a contiguous (columns, rows) block.
+        block = np.ascontiguousarray(values.T).take(self.order, axis=-1)
+        finite = ~np.isnan(block)
+        if finite.all():
+            sums = np.add.reduceat(block, self.starts, axis=-1)
+            counts = self.counts
+        else:
+            sums = np.add.reduceat(np.where(finite, block, 0.0), self.starts, axis=-1)
+            counts = np.add.reduceat(finite, self.starts, axis=-1, dtype=np.int64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (sums / counts).T
+
+    def modes(self, labels: np.ndarray) -> np.ndarray:
+        """
+        Per-month most frequent label; ties go to the smallest label, as in Series.mode()[0].
+
+        NaN labels are skipped like Series.mode() does. Months without any valid
+        label come back as NaN, which makes the result a float array.
+        """
+        labels = np.asarray(labels)
+        valid = ~pd.isna(labels)
+        classes, codes = np.unique(labels[valid], return_inverse=True)
+        one_hot = np.full((len(labels), len(classes)), np.nan)
+        one_hot[valid] = codes.reshape(-1, 1) == np.arange(len(classes))
+        if len(classes) == 0:
+            return np.full(len(self.months), np.nan)
+        shares = self.means(one_hot)
+        empty = np.isnan(shares).all(axis=1)
+        modes = classes[np.where(empty, 0, np.nan_to_num(shares, nan=-1.0).argmax(axis=1))]
+        if empty.any():
+            modes = np.where(empty, np.nan, modes.astype(np.float64))
+        return modes
+
+    def aggregate(
+        self,
+        frame: pd.DataFrame,
+        columns: Mapping[str, str] | Sequence[str],
+        time_col: str = "target_time",
+    ) -> pd.DataFrame:
+        """Monthly means as a frame like groupby(time_col).agg(out=(col, "mean")).reset_index()."""
+        if not isinstance(columns, Mapping):
+            columns = {col: col for col in columns}
+        means = self.means(_column_block(frame, list(columns.values())))
+        out = pd.DataFrame(means, columns=list(columns.keys()))
+        out.insert(0, time_col, self.months)
+        return out
+
+
+def monthly_brier_scores(
+    groups: MonthlyGroups,
+    frame: pd.DataFrame,
+    prob_cols: Mapping[str, str],
+    obs_col: str = "is_dry",
+) -> dict[str, float]:
+    """Brier score of monthly mean probability vs observed dry fraction, per named column."""
+    monthly = groups.means(_column_block(frame, [obs_col, *prob_cols.values()]))
+    obs = monthly[:, :1]
+    scores = np.mean((monthly[:, 1:] - obs) ** 2, axis=0)
+    return {name: float(score) for name, score in zip(prob_cols, scores)}
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Time segment-offset aggregation against groupby.agg on a synthetic test frame.",
+    )
+    parser.add_argument("--n-rows", type=int, default=450_000)
+    parser.add_argument("--n-prob-cols", type=int, default=6)
+    return parser.parse_args()
+
+
+def benchmark(n_rows: int, n_prob_cols: int) -> None:
+    rng = np.random.default_rng(0)
+    n_months = 64
+    times = pd.Series(pd.date_range("2020-12-01", periods=n_months, freq="MS").values[rng.integers(0, n_months, n_rows)])
+    frame = pd.DataFrame({"time": times, "is_dry": (rng.random(n_rows) < 0.3).astype(float)})
+    prob_cols = [f"prob_{i}" for i in range(n_prob_cols)]
+    for col in prob_cols:
+        frame[col] = rng.random(n_rows)
+
+    start = time.perf_counter()
+    legacy_target = (pd.to_datetime(frame["time"]) + pd.DateOffset(months=1)).dt.to_period("M").dt.to_timestamp()
+    legacy_target_s = time.perf_counter() - start
+    start = time.perf_counter()
+    frame["target_time"] = target_month(frame["time"])
+    target_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    legacy = {}
+    for col in prob_cols:
+        monthly = frame.groupby("target_time").agg(y=("is_dry", "mean"), p=(col, "mean")).reset_index()
+        legacy[col] = float(np.mean((monthly["p"] - monthly["y"]) ** 2))
+    table = frame.groupby("target_time").agg(**{c: (c, "mean") for c in ["is_dry", *prob_cols]}).reset_index()
+    legacy_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    groups = MonthlyGroups.from_frame(frame)
+    scores = monthly_brier_scores(groups, frame, {col: col for col in prob_cols})
+    new_table = groups.aggregate(frame, ["is_dry", *prob_cols])
+    new_s = time.perf_counter() - start
+
+    max_diff = max(abs(scores[col] - legacy[col]) for col in prob_cols)
+    table_diff = float(np.abs(new_table[prob_cols].to_numpy() - table[prob_cols].to_numpy()).max())
+    print(f"Frame: {n_rows:,} rows, {n_months} months, {n_prob_cols} probability columns")
+    print(f"target month: DateOffset {legacy_target_s:.3f} s, datetime64[M] {target_s:.3f} s; "
+          f"identical: {legacy_target.equals(frame['target_time'])}")
+    print(f"groupby.agg per column + table: {legacy_s:.3f} s")
+    print(f"segment offsets + reduceat:     {new_s:.3f} s  ({legacy_s / max(new_s, 1e-9):.1f}x)")
+    print(f"max |Brier diff| {max_diff:.2e}, max |monthly mean diff| {table_diff:.2e}, "
+          f"same months: {bool((new_table['target_time'] == table['target_time']).all())}")
+
+
+def main() -> None:
+    args = parse_args()
+    if args.benchmark:
+        benchmark(args.n_rows, args.n_prob_cols)
+    else:
+        print("Nothing to do; pass --benchmark, or import MonthlyGroups.")
+
+
+if __name__ == "__main__":
+    main()
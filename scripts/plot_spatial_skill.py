@@ -24,11 +24,11 @@ Outputs:
 """
 from pathlib import Path
 import numpy as np
-import pandas as pd
 import xarray as xr
 import xgboost as xgb
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
+from dataset_loader import dataset_columns, load_split
 from feature_config import get_feature_columns
 
 DATA       = Path("data/processed/dataset_forecast.parquet")
@@ -40,10 +40,8 @@ INV_MAP   = {0: -1, 1: 0, 2: 1}
 
 # ── load data and model ───────────────────────────────────────────────────────
 print("Loading dataset and model...")
-df = pd.read_parquet(DATA)
-df["year"] = df["year"].astype(int)
-FEATURES = get_feature_columns(df.columns)
-test = df[df["year"] >= 2021].copy()
+FEATURES = get_feature_columns(dataset_columns(DATA))
+test = load_split("test", FEATURES, path=DATA, columns=["time", "latitude", "longitude"])
 
 assert MODEL_PATH.exists(), f"Model not found: {MODEL_PATH}. Run train_forecast_xgboost.py first."
 model = xgb.Booster()
@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+"""
+External-memory XGBoost training over partitioned forecast Parquet tables.
+
+run_multiregion_xgb_experiment.py trains each region on an in-memory
+DataFrame. At full 0.05 deg resolution a single model pooled over every
+region in region_config.REGIONS would not fit in RAM.
+
+ParquetBatches is an xgb.DataIter that streams the regions' forecast tables
+as pyarrow record batches of at most `batch_rows` rows. Only row groups
+whose `year` statistics overlap the split are read; there is one row group
+per target year, so most are skipped without decoding. Each batch gets:
+  - the features shared by every region's table,
+  - a one-hot region indicator column per region (region_<slug>),
+  - a per-region sample weight: class-balanced within the region, as in the
+    single-region runs, times a region factor. With region_weight="equal"
+    every region carries the same total weight, however many pixels it has.
+    With "rows" every row counts the same.
+XGBoost pulls the batches through the iterator into an ExtMemQuantileDMatrix
+(XGBoost >= 3.0; older versions fall back to DMatrix(iterator), the paged
+external-memory matrix). Peak memory is then about one batch plus the
+compressed histogram pages, not the pooled table.
+
+train_pooled() trains one booster with early stopping on the pooled
+validation years. It then streams the test years through
+Booster.inplace_predict for per-region pixel-level scores, and reports
+rows/sec and peak RSS.
+
+  python scripts/run_multiregion_xgb_experiment.py --pooled
+  python scripts/pooled_xgb.py --benchmark
+"""
+from __future__ import annotations
+
+from argparse import ArgumentParser, Namespace
+from collections.abc import Iterator, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+import json
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xgboost as xgb
+
+from dataset_loader import SPLITS, TARGET, dataset_columns, dataset_path
+from feature_config import BASE_FEATURES, get_feature_columns
+from region_config import REGIONS, Region, resolve_region
+
+
+BATCH_ROWS = 500_000
+REGION_WEIGHTS = ("equal", "rows")
+N_CLASSES = 3            # target_label -1/0/+1 -> class 0/1/2
+DRY_CLASS = 0
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+@dataclass(frozen=True)
+class PooledSource:
+    """One region's forecast table in the pooled model."""
+
+    slug: str
+    path: Path
+
+
+def pooled_sources(regions: Sequence[str | Region] | None = None) -> list[PooledSource]:
+    """Regions (default: all of REGIONS) whose forecast table exists; missing tables are skipped."""
+    chosen = [resolve_region(r) if isinstance(r, str) else r for r in (regions or REGIONS.values())]
+    sources = []
+    for region in chosen:
+        path = dataset_path(region)
+        if path.exists():
+            sources.append(PooledSource(region.slug, path))
+        else:
+            print(f"[pooled] no forecast table for {region.slug} ({path}); skipping")
+    if not sources:
+        raise FileNotFoundError("No region forecast tables found; build them with run_multiregion_xgb_experiment.py first.")
+    return sources
+
+
+def common_features(sources: Sequence[PooledSource]) -> list[str]:
+    """Model features present in every region's table, in get_feature_columns() order."""
+    per_source = [get_feature_columns(dataset_columns(src.path)) for src in sources]
+    shared = set.intersection(*(set(cols) for cols in per_source))
+    return [col for col in per_source[0] if col in shared]
+
+
+def split_row_groups(parquet: pq.ParquetFile, split: str) -> list[int]:
+    """Row groups whose `year` min/max statistics overlap the split."""
+    start, end = SPLITS[split]
+    meta = parquet.metadata
+    year_col = parquet.schema_arrow.get_field_index("year")
+    groups = []
+    for i in range(meta.num_row_groups):
+        stats = meta.row_group(i).column(year_col).statistics
+        if stats is None or not stats.has_min_max:
+            groups.append(i)
+            continue
+        if (start is None or stats.max >= start) and (end is None or stats.min <= end):
+            groups.append(i)
+    return groups
+
+
+def year_mask(years: np.ndarray, split: str) -> np.ndarray:
+    start, end = SPLITS[split]
+    mask = np.ones(len(years), dtype=bool)
+    if start is not None:
+        mask &= years >= start
+    if end is not None:
+        mask &= years <= end
+    return mask
+
+
+def class_counts(source: PooledSource, split: str = "train") -> np.ndarray:
+    """Rows per class in a split; reads only the label and year columns."""
+    parquet = pq.ParquetFile(source.path)
+    table = parquet.read_row_groups(split_row_groups(parquet, split), columns=[TARGET, "year"])
+    labels = table.column(TARGET).to_numpy()[year_mask(table.column("year").to_numpy(), split)]
+    labels = labels[np.isin(labels, (-1, 0, 1))].astype(np.int64) + 1
+    return np.bincount(labels, minlength=N_CLASSES)
+
+
+def region_class_weights(
+    counts: dict[str, np.ndarray],
+    region_weight: str = "equal",
+) -> dict[str, np.ndarray]:
+    """
+    Per-region weight of each class.
+
+    Within a region this is sklearn's "balanced" weight, n / (3 * count). With
+    region_weight="equal" each region is then scaled to the same total weight.
+    """
+    if region_weight not in REGION_WEIGHTS:
+        raise ValueError(f"region_weight must be one of {REGION_WEIGHTS}, got {region_weight!r}")
+    n_total = sum(int(c.sum()) for c in counts.values())
+    weights = {}
+    for slug, c in counts.items():
+        n = int(c.sum())
+        present = np.count_nonzero(c)
+        balanced = np.where(c > 0, n / (max(present, 1) * np.maximum(c, 1)), 0.0)
+        factor = n_total / (len(counts) * n) if region_weight == "equal" and n else 1.0
+        weights[slug] = (balanced * factor).astype(np.float32)
+    return weights
+
+
+def iter_batches(
+    sources: Sequence[PooledSource],
+    split: str,
+    features: Sequence[str],
+    batch_rows: int = BATCH_ROWS,
+) -> Iterator[tuple[int, np.ndarray, np.ndarray]]:
+    """
+    (source index, X, class) for each record batch of a split.
+
+    X is float32 (rows, features + one indicator per source). Rows outside the
+    split's years or without a -1/0/+1 label are dropped.
+    """
+    features = list(features)
+    n_feat = len(features)
+    wanted = list(dict.fromkeys([*features, TARGET, "year"]))
+    for i, source in enumerate(sources):
+        parquet = pq.ParquetFile(source.path)
+        groups = split_row_groups(parquet, split)
+        if not groups:
+            continue
+        for batch in parquet.iter_batches(batch_size=batch_rows, row_groups=groups, columns=wanted):
+            labels = batch.column(TARGET).to_numpy(zero_copy_only=False)
+            keep = year_mask(batch.column("year").to_numpy(zero_copy_only=False), split)
+            keep &= np.isin(labels, (-1, 0, 1))
+            n = int(keep.sum())
+            if n == 0:
+                continue
+            X = np.zeros((n, n_feat + len(sources)), dtype=np.float32)
+            for j, col in enumerate(features):
+                X[:, j] = batch.column(col).to_numpy(zero_copy_only=False)[keep]
+            X[:, n_feat + i] = 1.0
+            yield i, X, labels[keep].astype(np.int64) + 1
+
+
+class ParquetBatches(xgb.DataIter):
+    """xgb.DataIter over iter_batches() with per-region class weights."""
+
+    def __init__(
+        self,
+        sources: Sequence[PooledSource],
+        split: str,
+        features: Sequence[str],
+        class_weights: dict[str, np.ndarray] | None = None,
+        batch_rows: int = BATCH_ROWS,
+        cache_prefix: str | None = None,
+    ):
+        self.sources = list(sources)
+        self.split = split
+        self.features = list(features)
+        self.feature_names = self.features + [f"region_{src.slug}" for src in self.sources]
+        self.class_weights = class_weights
+        self.batch_rows = batch_rows
+        self.n_rows = 0          # rows in one full pass
+        self.n_batches = 0       # batches in one full pass
+        self._pass_rows = 0
+        self._pass_batches = 0
+        self._batches = self._start()
+        super().__init__(cache_prefix=cache_prefix)
+
+    def _start(self):
+        return iter_batches(self.sources, self.split, self.features, self.batch_rows)
+
+    def next(self, input_data) -> bool:
+        try:
+            i, X, label = next(self._batches)
+        except StopIteration:
+            return False
+        weight = None
+        if self.class_weights is not None:
+            weight = self.class_weights[self.sources[i].slug][label]
+        input_data(data=X, label=label, weight=weight, feature_names=self.feature_names)
+        self._pass_rows += len(label)
+        self._pass_batches += 1
+        return True
+
+    def reset(self) -> None:
+        # XGBoost makes several passes; keep the counts of one full pass.
+        self.n_rows = max(self.n_rows, self._pass_rows)
+        self.n_batches = max(self.n_batches, self._pass_batches)
+        self._pass_rows = 0
+        self._pass_batches = 0
+        self._batches = self._start()
+
+
+def external_matrix(batches: ParquetBatches, ref=None, max_bin: int = 256):
+    """Quantized external-memory matrix for a batch iterator."""
+    if hasattr(xgb, "ExtMemQuantileDMatrix"):
+        return xgb.ExtMemQuantileDMatrix(batches, max_bin=max_bin, ref=ref)
+    # XGBoost < 3.0: paged DMatrix with the iterator's cache_prefix.
+    return xgb.DMatrix(batches)
+
+
+def score_region(probs: np.ndarray, label: np.ndarray, clim_dry: float) -> dict[str, float]:
+    """Pixel-level test scores of one region."""
+    is_dry = (label == DRY_CLASS).astype(np.float64)
+    p_dry = probs[:, DRY_CLASS].astype(np.float64)
+    bs = float(np.mean((p_dry - is_dry) ** 2))
+    bs_clim = float(np.mean((clim_dry - is_dry) ** 2))
+    picked = np.clip(probs[np.arange(len(label)), label], 1e-15, 1.0)
+    return {
+        "n_test": int(len(label)),
+        "accuracy": float(np.mean(probs.argmax(axis=1) == label)),
+        "mlogloss": float(-np.mean(np.log(picked))),
+        "brier_dry": bs,
+        "brier_dry_clim": bs_clim,
+        "bss_dry_pixel": float(1.0 - bs / bs_clim) if bs_clim > 0 else float("nan"),
+    }
+
+
+def train_pooled(
+    sources: Sequence[PooledSource],
+    params: dict[str, object],
+    out_dir: Path,
+    num_boost_round: int = 2000,
+    early_stopping_rounds: int = 50,
+    verbose_eval: int | bool = 100,
+    batch_rows: int = BATCH_ROWS,
+    region_weight: str = "equal",
+) -> dict[str, object]:
+    """Train one pooled booster over `sources`; write the model, scores and a run summary to out_dir."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    features = common_features(sources)
+    counts = {src.slug: class_counts(src) for src in sources}
+    weights = region_class_weights(counts, region_weight)
+    print(f"[pooled] {len(sources)} regions, features: {features}")
+    for src in sources:
+        print(f"[pooled] {src.slug}: train class counts {counts[src.slug].tolist()}, "
+              f"class weights {np.round(weights[src.slug], 3).tolist()}")
+
+    # Quantized pages are only needed for training; prediction reads raw batches.
+    with tempfile.TemporaryDirectory(prefix="xgb_pages_", dir=out_dir) as page_dir:
+        start = time.perf_counter()
+        train_it = ParquetBatches(sources, "train", features, weights, batch_rows, str(Path(page_dir) / "train"))
+        dtrain = external_matrix(train_it)
+        val_it = ParquetBatches(sources, "val", features, None, batch_rows, str(Path(page_dir) / "val"))
+        dval = external_matrix(val_it, ref=dtrain)
+        build_s = time.perf_counter() - start
+        build_rss = peak_rss_mb()
+        print(f"[pooled] Quantized {train_it.n_rows:,} train + {val_it.n_rows:,} val rows in {build_s:.1f} s "
+              f"({(train_it.n_rows + val_it.n_rows) / max(build_s, 1e-9):,.0f} rows/s); peak RSS {build_rss:,.0f} MiB")
+
+        start = time.perf_counter()
+        model = xgb.train(
+            params=params,
+            dtrain=dtrain,
+            num_boost_round=num_boost_round,
+            evals=[(dtrain, "train"), (dval, "val")],
+            early_stopping_rounds=early_stopping_rounds,
+            verbose_eval=verbose_eval,
+        )
+        train_s = time.perf_counter() - start
+        del dtrain, dval
+    n_rounds = model.num_boosted_rounds()
+    iteration_range = (0, model.best_iteration + 1)
+    train_rate = train_it.n_rows * n_rounds / max(train_s, 1e-9)
+    print(f"[pooled] {n_rounds} rounds in {train_s:.1f} s ({train_rate:,.0f} row-rounds/s); "
+          f"best iteration {model.best_iteration}; peak RSS {peak_rss_mb():,.0f} MiB")
+
+    start = time.perf_counter()
+    probs: dict[int, list[np.ndarray]] = {i: [] for i in range(len(sources))}
+    labels: dict[int, list[np.ndarray]] = {i: [] for i in range(len(sources))}
+    n_test = 0
+    for i, X, label in iter_batches(sources, "test", features, batch_rows):
+        probs[i].append(np.asarray(model.inplace_predict(X, iteration_range=iteration_range), dtype=np.float32))
+        labels[i].append(label.astype(np.int8))
+        n_test += len(label)
+    predict_s = time.perf_counter() - start
+
+    rows = []
+    for i, src in enumerate(sources):
+        if not labels[i]:
+            continue
+        clim_dry = float(counts[src.slug][DRY_CLASS] / max(counts[src.slug].sum(), 1))
+        scores = score_region(np.concatenate(probs[i]), np.concatenate(labels[i]).astype(np.int64), clim_dry)
+        rows.append({"region": src.slug, "train_dry_frac": clim_dry, **scores})
+    region_scores = pd.DataFrame(rows)
+
+    model_path = out_dir / "pooled_xgb_model.json"
+    scores_path = out_dir / "pooled_region_scores.csv"
+    summary_path = out_dir / "pooled_summary.json"
+    model.save_model(model_path.as_posix())
+    region_scores.to_csv(scores_path, index=False)
+    summary = {
+        "regions": [src.slug for src in sources],
+        "features": train_it.feature_names,
+        "region_weight": region_weight,
+        "batch_rows": batch_rows,
+        "train_rows": train_it.n_rows,
+        "val_rows": val_it.n_rows,
+        "test_rows": n_test,
+        "train_batches": train_it.n_batches,
+        "best_iteration": int(model.best_iteration),
+        "boosted_rounds": int(n_rounds),
+        "quantize_seconds": round(build_s, 3),
+        "quantize_rows_per_sec": round((train_it.n_rows + val_it.n_rows) / max(build_s, 1e-9), 1),
+        "train_seconds": round(train_s, 3),
+        "train_row_rounds_per_sec": round(train_rate, 1),
+        "predict_rows_per_sec": round(n_test / max(predict_s, 1e-9), 1),
+        "peak_rss_mib_after_quantize": round(build_rss, 1),
+        "peak_rss_mib": round(peak_rss_mb(), 1),
+        "external_memory": "ExtMemQuantileDMatrix" if hasattr(xgb, "ExtMemQuantileDMatrix") else "DMatrix(DataIter)",
+    }
+    summary_path.write_text(json.dumps(summary, indent=2) + "\n")
+    print(region_scores.round(4).to_string(index=False))
+    print(f"[pooled] Test: {n_test:,} rows at {summary['predict_rows_per_sec']:,.0f} rows/s; "
+          f"peak RSS {summary['peak_rss_mib']:,.0f} MiB")
+    print(f"Wrote {model_path}")
+    print(f"Wrote {scores_path}")
+    print(f"Wrote {summary_path}")
+    return summary
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Train on synthetic partitioned region tables, external memory first, then in memory.",
+    )
+    parser.add_argument("--n-regions", type=int, default=3)
+    parser.add_argument("--rows-per-year", type=int, default=50_000)
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    return parser.parse_args()
+
+
+def _write_synthetic_table(path: Path, rng: np.random.Generator, rows_per_year: int) -> None:
+    """Forecast-like table with one row group per target year, as tabular_builder writes."""
+    features = list(BASE_FEATURES)
+    writer = None
+    for year in range(1991, 2026):
+        X = rng.normal(size=(rows_per_year, len(features))).astype(np.float32)
+        signal = X[:, 0] + 0.5 * X[:, 3] + rng.normal(scale=1.0, size=rows_per_year)
+        columns = {name: X[:, j] for j, name in enumerate(features)}
+        columns[TARGET] = np.digitize(signal, [-0.8, 0.8]).astype(np.int8) - 1
+        columns["year"] = np.full(rows_per_year, year, dtype=np.int32)
+        table = pa.table(columns)
+        if writer is None:
+            writer = pq.ParquetWriter(path, table.schema, write_statistics=True)
+        writer.write_table(table, row_group_size=table.num_rows)
+    writer.close()
+
+
+def benchmark(n_regions: int, rows_per_year: int, batch_rows: int) -> None:
+    rng = np.random.default_rng(0)
+    params = {"objective": "multi:softprob", "num_class": N_CLASSES, "tree_method": "hist", "max_depth": 6, "eta": 0.1}
+    rounds = 20
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        sources = []
+        for r in range(n_regions):
+            path = tmp / f"dataset_forecast_region{r}.parquet"
+            _write_synthetic_table(path, rng, rows_per_year * (r + 1))
+            sources.append(PooledSource(f"region{r}", path))
+        rss_before = peak_rss_mb()
+
+        # External memory first: ru_maxrss only grows, so this order isolates its peak.
+        start = time.perf_counter()
+        summary = train_pooled(sources, params, tmp / "out", num_boost_round=rounds,
+                               early_stopping_rounds=rounds, verbose_eval=False, batch_rows=batch_rows)
+        ext_s = time.perf_counter() - start
+        ext_rss = peak_rss_mb()
+
+        start = time.perf_counter()
+        features = common_features(sources)
+        weights = region_class_weights({src.slug: class_counts(src) for src in sources})
+        parts = list(iter_batches(sources, "train", features, batch_rows=10 ** 9))
+        X = np.concatenate([part[1] for part in parts])
+        y = np.concatenate([part[2] for part in parts])
+        w = np.concatenate([weights[sources[part[0]].slug][part[2]] for part in parts])
+        xgb.train(params, xgb.DMatrix(X, label=y, weight=w), num_boost_round=rounds)
+        mem_s = time.perf_counter() - start
+        mem_rss = peak_rss_mb()
+
+    print(f"Regions: {n_regions}; train rows {summary['train_rows']:,}; batch_rows {batch_rows:,}; {rounds} rounds")
+    print(f"peak RSS before training:  {rss_before:,.0f} MiB")
+    print(f"external memory:           {ext_s:.1f} s, peak RSS {ext_rss:,.0f} MiB, "
+          f"{summary['quantize_rows_per_sec']:,.0f} rows/s quantize, "
+          f"{summary['train_row_rounds_per_sec']:,.0f} row-rounds/s train ({summary['external_memory']})")
+    print(f"in-memory DMatrix:         {mem_s:.1f} s, peak RSS {mem_rss:,.0f} MiB")
+
+
+def main() -> None:
+    args = parse_args()
+    if args.benchmark:
+        benchmark(args.n_regions, args.rows_per_year, args.batch_rows)
+    else:
+        print("Nothing to do; pass --benchmark, or run run_multiregion_xgb_experiment.py --pooled.")
+
+
+if __name__ == "__main__":
+    main()
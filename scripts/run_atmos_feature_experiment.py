@@ -28,7 +28,9 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import classification_report, confusion_matrix
 from sklearn.utils.class_weight import compute_sample_weight
 
+from bootstrap_engine import bootstrap_bss_ci
 from feature_config import get_feature_columns
+from monthly_groups import MonthlyGroups, monthly_brier_scores, target_month
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
@@ -168,33 +170,10 @@ def bootstrap_bss(
     n_bootstrap: int,
     seed: int = 42,
 ) -> tuple[float, float]:
-    rng = np.random.default_rng(seed)
-    idx = np.arange(len(monthly))
-    vals = []
     y = monthly["y_true_dry_frac"].to_numpy()
     p = monthly[pred_col].to_numpy()
     ref = monthly[ref_col].to_numpy()
-    for _ in range(n_bootstrap):
-        sample = rng.choice(idx, size=len(idx), replace=True)
-        vals.append(bss(y[sample], p[sample], ref[sample]))
-    lo, hi = np.nanquantile(vals, [0.025, 0.975])
-    return float(lo), float(hi)
-
-
-def target_month(series: pd.Series) -> pd.Series:
-    return (pd.to_datetime(series) + pd.DateOffset(months=1)).dt.to_period("M").dt.to_timestamp()
-
-
-def monthly_bs(frame: pd.DataFrame, prob_col: str) -> float:
-    monthly = (
-        frame.groupby("target_time")
-        .agg(
-            y_true_dry_frac=("is_dry", "mean"),
-            pred_prob_dry=(prob_col, "mean"),
-        )
-        .reset_index()
-    )
-    return brier(monthly["y_true_dry_frac"].to_numpy(), monthly["pred_prob_dry"].to_numpy())
+    return bootstrap_bss_ci(y, p, ref, n_bootstrap, seed)
 
 
 def run_experiment(df: pd.DataFrame, ar_ivt_cols: list[str], n_bootstrap: int) -> None:
@@ -298,25 +277,21 @@ def run_experiment(df: pd.DataFrame, ar_ivt_cols: list[str], n_bootstrap: int) -
         "isotonic": "xgb_isotonic_prob_dry",
         "platt": "xgb_platt_prob_dry",
     }
-    val_bs_by_method = {
-        method: monthly_bs(val, col)
-        for method, col in calibration_cols.items()
-    }
+    val_bs_by_method = monthly_brier_scores(MonthlyGroups.from_frame(val), val, calibration_cols)
     best_method = min(val_bs_by_method, key=val_bs_by_method.get)
     best_col = calibration_cols[best_method]
     test["xgb_selected_prob_dry"] = test[best_col]
 
-    monthly = (
-        test.groupby("target_time")
-        .agg(
-            y_true_dry_frac=("is_dry", "mean"),
-            xgb_raw_prob_dry=("xgb_raw_prob_dry", "mean"),
-            xgb_isotonic_prob_dry=("xgb_isotonic_prob_dry", "mean"),
-            xgb_platt_prob_dry=("xgb_platt_prob_dry", "mean"),
-            xgb_selected_prob_dry=("xgb_selected_prob_dry", "mean"),
-            clim_prob_dry=("clim_prob_dry", "mean"),
-        )
-        .reset_index()
+    monthly = MonthlyGroups.from_frame(test).aggregate(
+        test,
+        {
+            "y_true_dry_frac": "is_dry",
+            "xgb_raw_prob_dry": "xgb_raw_prob_dry",
+            "xgb_isotonic_prob_dry": "xgb_isotonic_prob_dry",
+            "xgb_platt_prob_dry": "xgb_platt_prob_dry",
+            "xgb_selected_prob_dry": "xgb_selected_prob_dry",
+            "clim_prob_dry": "clim_prob_dry",
+        },
     )
 
     y = monthly["y_true_dry_frac"].to_numpy()
@@ -19,7 +19,6 @@ from argparse import ArgumentParser, Namespace
 from pathlib import Path
 
 import numpy as np
-import pandas as pd
 import torch
 import torch.nn as nn
 import torch.optim as optim
@@ -27,7 +26,9 @@ from sklearn.isotonic import IsotonicRegression
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import classification_report
 
+from dataset_loader import dataset_columns, load_splits
 from feature_config import get_feature_columns
+from monthly_groups import MonthlyGroups, monthly_brier_scores, target_month
 
 
 DATA = Path("data/processed/dataset_forecast.parquet")
@@ -149,13 +150,10 @@ def main() -> None:
     args = parse_args()
 
     print(f"Loading dataset: {DATA}")
-    df = pd.read_parquet(DATA)
-    df["year"] = df["year"].astype(int)
-    features = get_feature_columns(df.columns)
-
-    train = df[df["year"] <= 2016].copy()
-    val = df[(df["year"] >= 2017) & (df["year"] <= 2020)].copy()
-    test = df[df["year"] >= 2021].copy()
+    features = get_feature_columns(dataset_columns(DATA))
+    train, val, test = load_splits(
+        features, path=DATA, columns=["time", "month", "latitude", "longitude"]
+    )
 
     if args.max_train_rows is not None and len(train) > args.max_train_rows:
         train = train.sample(args.max_train_rows, random_state=42)
@@ -251,8 +249,8 @@ def main() -> None:
     val_df["clim_prob_dry"] = val_df["month"].map(train_monthly_dry).fillna(global_dry)
     test_df["clim_prob_dry"] = test_df["month"].map(train_monthly_dry).fillna(global_dry)
 
-    val_df["target_time"] = (pd.to_datetime(val_df["time"]) + pd.DateOffset(months=1)).dt.to_period("M").dt.to_timestamp()
-    test_df["target_time"] = (pd.to_datetime(test_df["time"]) + pd.DateOffset(months=1)).dt.to_period("M").dt.to_timestamp()
+    val_df["target_time"] = target_month(val_df["time"])
+    test_df["target_time"] = target_month(test_df["time"])
 
     # Recompute validation probs from the model for clean calibration.
     with torch.no_grad():
@@ -287,26 +285,12 @@ def main() -> None:
         ref_bs = brier(y, ref)
         return float(1.0 - brier(y, p) / ref_bs) if ref_bs > 0 else float("nan")
 
-    def monthly_bs(frame: pd.DataFrame, prob_col: str) -> float:
-        monthly = (
-            frame.groupby("target_time")
-            .agg(
-                y_true_dry_frac=("is_dry", "mean"),
-                pred_prob_dry=(prob_col, "mean"),
-            )
-            .reset_index()
-        )
-        return brier(monthly["y_true_dry_frac"].to_numpy(), monthly["pred_prob_dry"].to_numpy())
-
     calibration_cols = {
         "none": "edl_raw_prob_dry",
         "isotonic": "edl_isotonic_prob_dry",
         "platt": "edl_platt_prob_dry",
     }
-    val_bs_by_method = {
-        method: monthly_bs(val_df, col)
-        for method, col in calibration_cols.items()
-    }
+    val_bs_by_method = monthly_brier_scores(MonthlyGroups.from_frame(val_df), val_df, calibration_cols)
     best_method = min(val_bs_by_method, key=val_bs_by_method.get)
     best_col = calibration_cols[best_method]
     test_df["edl_selected_prob_dry"] = test_df[best_col]
@@ -315,20 +299,19 @@ def main() -> None:
     test_df["aleatoric_u"] = aleatoric_u
     test_df["epistemic_u"] = epistemic_u
 
-    monthly = (
-        test_df.groupby("target_time")
-        .agg(
-            y_true_dry_frac=("is_dry", "mean"),
-            edl_raw_prob_dry=("edl_raw_prob_dry", "mean"),
-            edl_isotonic_prob_dry=("edl_isotonic_prob_dry", "mean"),
-            edl_platt_prob_dry=("edl_platt_prob_dry", "mean"),
-            edl_selected_prob_dry=("edl_selected_prob_dry", "mean"),
-            clim_prob_dry=("clim_prob_dry", "mean"),
-            total_u=("total_u", "mean"),
-            aleatoric_u=("aleatoric_u", "mean"),
-            epistemic_u=("epistemic_u", "mean"),
-        )
-        .reset_index()
+    monthly = MonthlyGroups.from_frame(test_df).aggregate(
+        test_df,
+        {
+            "y_true_dry_frac": "is_dry",
+            "edl_raw_prob_dry": "edl_raw_prob_dry",
+            "edl_isotonic_prob_dry": "edl_isotonic_prob_dry",
+            "edl_platt_prob_dry": "edl_platt_prob_dry",
+            "edl_selected_prob_dry": "edl_selected_prob_dry",
+            "clim_prob_dry": "clim_prob_dry",
+            "total_u": "total_u",
+            "aleatoric_u": "aleatoric_u",
+            "epistemic_u": "epistemic_u",
+        },
     )
 
     y = monthly["y_true_dry_frac"].to_numpy()
@@ -20,6 +20,7 @@ risk and should be used as methodological evidence.
 from __future__ import annotations
 
 from argparse import ArgumentParser, Namespace
+from contextlib import ExitStack
 from pathlib import Path
 import shutil
 
@@ -27,12 +28,16 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 import xgboost as xgb
+from joblib import Parallel, delayed
 from sklearn.isotonic import IsotonicRegression
 from sklearn.linear_model import LogisticRegression
 from sklearn.utils.class_weight import compute_sample_weight
 
+from bootstrap_engine import bootstrap_bss_ci
 from build_dataset_seasonal import _build_one
 from feature_config import BASE_FEATURES
+from monthly_groups import MonthlyGroups, monthly_brier_scores
+from shared_table import SharedTable, frame_of, year_rows
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
@@ -65,6 +70,12 @@ def parse_args() -> Namespace:
     parser.add_argument("--random-seed", type=int, default=20260506)
     parser.add_argument("--output-prefix", default="evaluation_inflation_audit")
     parser.add_argument("--copy-report", action="store_true")
+    parser.add_argument(
+        "--n-jobs",
+        type=int,
+        default=1,
+        help="Scenarios run in parallel; >1 shares each audit table with the workers via shared memory.",
+    )
     return parser.parse_args()
 
 
@@ -84,14 +95,7 @@ def bootstrap_arrays(
     n_bootstrap: int,
     seed: int,
 ) -> tuple[float, float]:
-    rng = np.random.default_rng(seed)
-    idx = np.arange(len(y))
-    vals = np.empty(n_bootstrap, dtype=float)
-    for i in range(n_bootstrap):
-        sample = rng.choice(idx, size=len(idx), replace=True)
-        vals[i] = bss(y[sample], p[sample], ref[sample])
-    lo, hi = np.nanquantile(vals, [0.025, 0.975])
-    return float(lo), float(hi)
+    return bootstrap_bss_ci(y, p, ref, n_bootstrap, seed)
 
 
 def add_target_time(df: pd.DataFrame, lead_months: int) -> pd.DataFrame:
@@ -161,9 +165,9 @@ def build_overlap_spi3_dataset(path: Path, rebuild: bool) -> None:
 
 
 def split_chronological(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    train = df[df["target_year"] <= 2016].copy()
-    val = df[(df["target_year"] >= 2017) & (df["target_year"] <= 2020)].copy()
-    test = df[df["target_year"] >= 2021].copy()
+    train = year_rows(df, "target_year", None, 2016)
+    val = year_rows(df, "target_year", 2017, 2020)
+    test = year_rows(df, "target_year", 2021, None)
     return train, val, test
 
 
@@ -180,20 +184,20 @@ def split_random_rows(
     train_idx = order[:n_train]
     val_idx = order[n_train:n_train + n_val]
     test_idx = order[n_train + n_val:]
-    return df.iloc[train_idx].copy(), df.iloc[val_idx].copy(), df.iloc[test_idx].copy()
+    return df.iloc[train_idx], df.iloc[val_idx], df.iloc[test_idx]
 
 
 def add_climatology(train: pd.DataFrame, frames: list[pd.DataFrame], target_col: str) -> list[pd.DataFrame]:
     train_dry = train.assign(is_dry=(train[target_col] == -1).astype(float))
     month_clim = train_dry.groupby("target_month")["is_dry"].mean()
     global_clim = float(train_dry["is_dry"].mean())
-    out = []
-    for frame in frames:
-        copy = frame.copy()
-        copy["is_dry"] = (copy[target_col] == -1).astype(float)
-        copy["clim_prob_dry"] = copy["target_month"].map(month_clim).fillna(global_clim)
-        out.append(copy)
-    return out
+    return [
+        frame.assign(
+            is_dry=(frame[target_col] == -1).astype(float),
+            clim_prob_dry=frame["target_month"].map(month_clim).fillna(global_clim),
+        )
+        for frame in frames
+    ]
 
 
 def train_xgb(
@@ -251,15 +255,8 @@ def train_xgb(
     val_platt = platt.predict_proba(val_raw.reshape(-1, 1))[:, 1]
     test_platt = platt.predict_proba(test_raw.reshape(-1, 1))[:, 1]
 
-    scored = test.copy()
-    scored["raw_prob_dry"] = test_raw
-    scored["isotonic_prob_dry"] = test_iso
-    scored["platt_prob_dry"] = test_platt
-
-    val_scored = val.copy()
-    val_scored["raw_prob_dry"] = val_raw
-    val_scored["isotonic_prob_dry"] = val_iso
-    val_scored["platt_prob_dry"] = val_platt
+    scored = test.assign(raw_prob_dry=test_raw, isotonic_prob_dry=test_iso, platt_prob_dry=test_platt)
+    val_scored = val.assign(raw_prob_dry=val_raw, isotonic_prob_dry=val_iso, platt_prob_dry=val_platt)
     metadata = {
         "best_iteration": int(model.best_iteration),
         "feature_count": len(features),
@@ -272,18 +269,15 @@ def train_xgb(
     return scored, {"val": val_scored, **metadata}
 
 
-def monthly_scores(frame: pd.DataFrame, pred_col: str) -> pd.DataFrame:
-    return (
-        frame.groupby("target_time", observed=True)
-        .agg(
-            y_true_dry_frac=("is_dry", "mean"),
-            pred_prob_dry=(pred_col, "mean"),
-            clim_prob_dry=("clim_prob_dry", "mean"),
-            n_pixels=("is_dry", "size"),
-        )
-        .reset_index()
-        .sort_values("target_time")
+def monthly_scores(frame: pd.DataFrame, pred_col: str, groups: MonthlyGroups | None = None) -> pd.DataFrame:
+    if groups is None:
+        groups = MonthlyGroups.from_frame(frame)
+    monthly = groups.aggregate(
+        frame,
+        {"y_true_dry_frac": "is_dry", "pred_prob_dry": pred_col, "clim_prob_dry": "clim_prob_dry"},
     )
+    monthly["n_pixels"] = groups.counts
+    return monthly
 
 
 def select_calibration(
@@ -297,9 +291,7 @@ def select_calibration(
     }
     scores: dict[str, float] = {}
     if selection_level == "monthly":
-        for method, col in candidates.items():
-            monthly = monthly_scores(val_scored, col)
-            scores[method] = brier(monthly["y_true_dry_frac"].to_numpy(), monthly["pred_prob_dry"].to_numpy())
+        scores = monthly_brier_scores(MonthlyGroups.from_frame(val_scored), val_scored, candidates)
     elif selection_level == "pixel":
         y = val_scored["is_dry"].to_numpy(dtype=float)
         for method, col in candidates.items():
@@ -316,9 +308,10 @@ def evaluate_level(
     inference_level: str,
     n_bootstrap: int,
     seed: int,
+    groups: MonthlyGroups | None = None,
 ) -> dict[str, object]:
     if inference_level == "monthly":
-        unit = monthly_scores(scored, pred_col)
+        unit = monthly_scores(scored, pred_col, groups)
         y = unit["y_true_dry_frac"].to_numpy(dtype=float)
         p = unit["pred_prob_dry"].to_numpy(dtype=float)
         ref = unit["clim_prob_dry"].to_numpy(dtype=float)
@@ -355,7 +348,7 @@ def evaluate_level(
 
 def run_scenario(
     name: str,
-    df: pd.DataFrame,
+    df: pd.DataFrame | SharedTable,
     features: list[str],
     target_col: str,
     split_kind: str,
@@ -367,6 +360,7 @@ def run_scenario(
     n_pixel_bootstrap: int,
     seed: int,
 ) -> tuple[list[dict[str, object]], pd.DataFrame]:
+    df = frame_of(df)
     if split_kind == "chronological":
         train, val, test = split_chronological(df)
     elif split_kind == "random_rows":
@@ -381,6 +375,7 @@ def run_scenario(
     best_method, val_bs = select_calibration(meta["val"], calibration_selection_level)
     pred_col = f"{best_method}_prob_dry"
     scored["selected_prob_dry"] = scored[pred_col]
+    groups = MonthlyGroups.from_frame(scored)
 
     scenario_base = {
         "scenario": name,
@@ -405,6 +400,7 @@ def run_scenario(
             "monthly",
             n_bootstrap=n_bootstrap,
             seed=seed + 11,
+            groups=groups,
         ),
         evaluate_level(
             scored,
@@ -415,7 +411,7 @@ def run_scenario(
             seed=seed + 17,
         ),
     ]
-    monthly = monthly_scores(scored, "selected_prob_dry")
+    monthly = monthly_scores(scored, "selected_prob_dry", groups)
     monthly["scenario"] = name
     monthly["selected_calibration"] = best_method
     return rows, monthly
@@ -543,13 +539,24 @@ def main() -> None:
             "monthly",
         ),
     ]
-    for i, spec in enumerate(specs):
-        rows, monthly = run_scenario(
-            *spec,
-            n_bootstrap=args.n_bootstrap,
-            n_pixel_bootstrap=args.n_pixel_bootstrap,
-            seed=args.random_seed + 1000 * i,
+    with ExitStack() as stack:
+        if args.n_jobs > 1:
+            # Each table is written to shared memory once; workers get a small handle.
+            shared: dict[int, SharedTable] = {}
+            for spec in specs:
+                if id(spec[1]) not in shared:
+                    shared[id(spec[1])] = stack.enter_context(SharedTable.create(spec[1]))
+            specs = [(spec[0], shared[id(spec[1])], *spec[2:]) for spec in specs]
+        results = Parallel(n_jobs=args.n_jobs)(
+            delayed(run_scenario)(
+                *spec,
+                n_bootstrap=args.n_bootstrap,
+                n_pixel_bootstrap=args.n_pixel_bootstrap,
+                seed=args.random_seed + 1000 * i,
+            )
+            for i, spec in enumerate(specs)
         )
+    for rows, monthly in results:
         all_rows.extend(rows)
         all_monthly.append(monthly)
 
@@ -34,7 +34,9 @@ import numpy as np
 import pandas as pd
 import xgboost as xgb
 
+from dataset_loader import dataset_columns, load_split
 from feature_config import get_feature_columns
+from monthly_groups import MonthlyGroups, monthly_brier_scores, target_month
 
 DATA       = Path("data/processed/dataset_forecast.parquet")
 MODEL_PATH = Path("outputs/forecast_xgb_model.json")
@@ -47,17 +49,14 @@ CLASSES   = [-1, 0, 1]
 
 # ── load data ────────────────────────────────────────────────────────────────
 print("Loading dataset...")
-df = pd.read_parquet(DATA)
-df["year"] = df["year"].astype(int)
-FEATURES = get_feature_columns(df.columns)
+FEATURES = get_feature_columns(dataset_columns(DATA))
 
-train = df[df["year"] <= 2016].copy()
-val   = df[(df["year"] >= 2017) & (df["year"] <= 2020)].copy()
-test  = df[df["year"] >= 2021].copy()
+train = load_split("train", FEATURES, path=DATA, columns=["time"])
+test  = load_split("test", FEATURES, path=DATA, columns=["time"])
 
-test["month_dt"] = (
-    pd.to_datetime(test["time"]) + pd.DateOffset(months=1)
-).dt.to_period("M").dt.to_timestamp()
+test["month_dt"] = target_month(test["time"])
+test["is_dry"] = (test["target_label"] == -1).astype(float)
+test_groups = MonthlyGroups.from_frame(test, "month_dt")
 
 assert MODEL_PATH.exists(), f"Model not found at {MODEL_PATH}. Run train_forecast_xgboost.py first."
 model = xgb.Booster()
@@ -71,10 +70,11 @@ if iteration_range is not None:
     print(f"Using XGBoost best_iteration={iteration_range[1] - 1}")
 
 
-def predict_probs(dmatrix: xgb.DMatrix) -> np.ndarray:
+def predict_probs(X: np.ndarray) -> np.ndarray:
+    """Class probabilities for a float32 (rows, FEATURES) block, without a DMatrix."""
     if iteration_range is None:
-        return model.predict(dmatrix)
-    return model.predict(dmatrix, iteration_range=iteration_range)
+        return model.inplace_predict(X)
+    return model.inplace_predict(X, iteration_range=iteration_range)
 
 # ── climatological baseline ───────────────────────────────────────────────────
 train["month_num"] = (
@@ -106,15 +106,8 @@ def bss_score(bs_model: float, bs_ref: float) -> float:
 
 def monthly_bss(test_df: pd.DataFrame, prob_col: str) -> float:
     """Aggregate pixel probabilities to monthly level and compute BSS vs climatology."""
-    monthly = test_df.groupby("month_dt").agg(
-        y_true_dry_frac=("target_label", lambda s: (s == -1).mean()),
-        pred_dry_frac   =(prob_col, "mean"),
-        clim_dry_frac   =("clim_prob_dry", "mean"),
-    )
-    obs   = monthly["y_true_dry_frac"].values.astype(float)
-    pred  = monthly["pred_dry_frac"].values
-    clim  = monthly["clim_dry_frac"].values
-    return bss_score(brier_score(obs, pred), brier_score(obs, clim))
+    scores = monthly_brier_scores(test_groups, test_df, {"model": prob_col, "clim": "clim_prob_dry"})
+    return bss_score(scores["model"], scores["clim"])
 
 
 # ── compute training-set mean for neutral fill ───────────────────────────────
@@ -138,8 +131,9 @@ ALL_GROUPS = {
 
 # ── all-features baseline ─────────────────────────────────────────────────────
 print("Computing all-features baseline...")
-dtest_full = xgb.DMatrix(test[FEATURES], feature_names=FEATURES)
-probs_full = predict_probs(dtest_full)          # (n, 3)
+# The test block is converted from pandas once; each ablation edits a copy.
+X_full = test[FEATURES].to_numpy(dtype=np.float32)
+probs_full = predict_probs(X_full)              # (n, 3)
 test["prob_dry_full"] = probs_full[:, 0]
 bss_full = monthly_bss(test, "prob_dry_full")
 print(f"  All features: BSS = {bss_full:.4f}")
@@ -150,11 +144,10 @@ rows: list[dict] = [{"group": "all_features", "ablated_features": "", "bss": bss
 
 for group_name, feats_to_ablate in ALL_GROUPS.items():
     print(f"  Ablating {group_name}: {feats_to_ablate}")
-    X_abl = test[FEATURES].copy()
+    X_abl = X_full.copy()
     for f in feats_to_ablate:
-        X_abl[f] = float(train_means[f])  # replace with training mean
-    dtest_abl = xgb.DMatrix(X_abl, feature_names=FEATURES)
-    probs_abl = predict_probs(dtest_abl)
+        X_abl[:, FEATURES.index(f)] = float(train_means[f])  # replace with training mean
+    probs_abl = predict_probs(X_abl)
     col_name  = f"prob_dry_{group_name}"
     test[col_name] = probs_abl[:, 0]
     bss_abl   = monthly_bss(test, col_name)
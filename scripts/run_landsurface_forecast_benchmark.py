@@ -33,6 +33,7 @@ import requests
 import xarray as xr
 from sklearn.isotonic import IsotonicRegression
 
+from bootstrap_engine import bootstrap_bss_ci
 from region_config import resolve_region
 
 
@@ -139,17 +140,10 @@ def bootstrap_bss(
     n_bootstrap: int = 2000,
     seed: int = 42,
 ) -> tuple[float, float]:
-    rng = np.random.default_rng(seed)
-    idx = np.arange(len(monthly))
     y = monthly["y_true_dry_frac"].to_numpy(dtype=float)
     p = monthly[pred_col].to_numpy(dtype=float)
     ref = monthly[ref_col].to_numpy(dtype=float)
-    vals = np.empty(n_bootstrap, dtype=float)
-    for i in range(n_bootstrap):
-        sample = rng.choice(idx, size=len(idx), replace=True)
-        vals[i] = bss(y[sample], p[sample], ref[sample])
-    lo, hi = np.nanquantile(vals, [0.025, 0.975])
-    return float(lo), float(hi)
+    return bootstrap_bss_ci(y, p, ref, n_bootstrap, seed)
 
 
 def choose_var(ds: xr.Dataset, candidates: list[str]) -> str:
@@ -24,12 +24,16 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import xgboost as xgb
+from joblib import Parallel, delayed
 from sklearn.isotonic import IsotonicRegression
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import classification_report, confusion_matrix
 from sklearn.utils.class_weight import compute_sample_weight
 
+from bootstrap_engine import bootstrap_bss_ci
 from feature_config import BASE_FEATURES
+from monthly_groups import MonthlyGroups, monthly_brier_scores
+from shared_table import SharedTable, frame_of, year_rows
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
@@ -96,6 +100,12 @@ def parse_args() -> Namespace:
     parser.add_argument("--n-bootstrap", type=int, default=2000)
     parser.add_argument("--output-prefix", default=None)
     parser.add_argument("--copy-report", action="store_true")
+    parser.add_argument(
+        "--n-jobs",
+        type=int,
+        default=1,
+        help="Variants trained in parallel; >1 shares the table with the workers via shared memory.",
+    )
     return parser.parse_args()
 
 
@@ -115,17 +125,10 @@ def bootstrap_bss(
     n_bootstrap: int,
     seed: int,
 ) -> tuple[float, float]:
-    rng = np.random.default_rng(seed)
-    idx = np.arange(len(monthly))
     y = monthly["y_true_dry_frac"].to_numpy(dtype=float)
     p = monthly[pred_col].to_numpy(dtype=float)
     ref = monthly[ref_col].to_numpy(dtype=float)
-    vals = np.empty(n_bootstrap, dtype=float)
-    for i in range(n_bootstrap):
-        sample = rng.choice(idx, size=len(idx), replace=True)
-        vals[i] = bss(y[sample], p[sample], ref[sample])
-    lo, hi = np.nanquantile(vals, [0.025, 0.975])
-    return float(lo), float(hi)
+    return bootstrap_bss_ci(y, p, ref, n_bootstrap, seed)
 
 
 def amplitude_ratio(y: pd.Series, p: pd.Series) -> float:
@@ -179,29 +182,15 @@ def active_climate_features(columns: list[str], include_pdo: bool) -> list[str]:
     return features
 
 
-def monthly_bs(frame: pd.DataFrame, prob_col: str) -> float:
-    monthly = (
-        frame.groupby("target_time", observed=True)
-        .agg(y_true_dry_frac=("is_dry", "mean"), pred_prob_dry=(prob_col, "mean"))
-        .reset_index()
-    )
-    return brier(
-        monthly["y_true_dry_frac"].to_numpy(dtype=float),
-        monthly["pred_prob_dry"].to_numpy(dtype=float),
-    )
-
-
 def add_climatology(train: pd.DataFrame, target_col: str, frame: pd.DataFrame) -> pd.DataFrame:
-    out = frame.copy()
     train_dry = train.assign(is_dry=(train[target_col] == -1).astype(float))
     month_clim = train_dry.groupby("month")["is_dry"].mean()
     global_clim = float(train_dry["is_dry"].mean())
-    out["clim_prob_dry"] = out["month"].map(month_clim).fillna(global_clim)
-    return out
+    return frame.assign(clim_prob_dry=frame["month"].map(month_clim).fillna(global_clim))
 
 
 def train_variant(
-    df: pd.DataFrame,
+    df: pd.DataFrame | SharedTable,
     target_spi: int,
     lead_months: int,
     variant: str,
@@ -209,14 +198,15 @@ def train_variant(
     n_bootstrap: int,
     output_prefix: str,
 ) -> tuple[pd.DataFrame, pd.DataFrame]:
+    df = frame_of(df)
     target_col = f"target_label_spi{target_spi}"
     persistence_feature = f"spi{target_spi}_lag1"
     if persistence_feature not in df.columns:
         raise ValueError(f"Missing target-consistent persistence feature: {persistence_feature}")
 
-    train = df[df["year"] <= 2016].copy()
-    val = df[(df["year"] >= 2017) & (df["year"] <= 2020)].copy()
-    test = df[df["year"] >= 2021].copy()
+    train = year_rows(df, "year", None, 2016)
+    val = year_rows(df, "year", 2017, 2020)
+    test = year_rows(df, "year", 2021, None)
     if train.empty or val.empty or test.empty:
         raise ValueError(f"Bad split for {variant}: train={train.shape} val={val.shape} test={test.shape}")
 
@@ -294,21 +284,21 @@ def train_variant(
         "isotonic": f"{variant}_isotonic_prob_dry",
         "platt": f"{variant}_platt_prob_dry",
     }
-    val_bs = {method: monthly_bs(val, col) for method, col in cal_cols.items()}
+    val_bs = monthly_brier_scores(MonthlyGroups.from_frame(val), val, cal_cols)
     best_method = min(val_bs, key=val_bs.get)
     test[f"{variant}_selected_prob_dry"] = test[cal_cols[best_method]]
     test[f"{variant}_persistence_prob_dry"] = (test[persistence_feature] <= -1.0).astype(float)
 
     group_cols = {
-        "y_true_dry_frac": ("is_dry", "mean"),
-        "clim_prob_dry": ("clim_prob_dry", "mean"),
-        f"{variant}_raw_prob_dry": (f"{variant}_raw_prob_dry", "mean"),
-        f"{variant}_isotonic_prob_dry": (f"{variant}_isotonic_prob_dry", "mean"),
-        f"{variant}_platt_prob_dry": (f"{variant}_platt_prob_dry", "mean"),
-        f"{variant}_selected_prob_dry": (f"{variant}_selected_prob_dry", "mean"),
-        f"{variant}_persistence_prob_dry": (f"{variant}_persistence_prob_dry", "mean"),
+        "y_true_dry_frac": "is_dry",
+        "clim_prob_dry": "clim_prob_dry",
+        f"{variant}_raw_prob_dry": f"{variant}_raw_prob_dry",
+        f"{variant}_isotonic_prob_dry": f"{variant}_isotonic_prob_dry",
+        f"{variant}_platt_prob_dry": f"{variant}_platt_prob_dry",
+        f"{variant}_selected_prob_dry": f"{variant}_selected_prob_dry",
+        f"{variant}_persistence_prob_dry": f"{variant}_persistence_prob_dry",
     }
-    monthly = test.groupby("target_time", observed=True).agg(**group_cols).reset_index()
+    monthly = MonthlyGroups.from_frame(test).aggregate(test, group_cols)
 
     y_pred = np.array([INV_LABEL_MAP[i] for i in probs_test.argmax(axis=1)])
     report = classification_report(
@@ -585,20 +575,26 @@ def main() -> None:
         .reset_index()
     )
 
-    monthly_parts = []
-    summary_parts = []
-    for variant, features in features_by_variant.items():
-        monthly, summary = train_variant(
-            df=df,
-            target_spi=args.target_spi,
-            lead_months=args.lead_months,
-            variant=variant,
-            features=features,
-            n_bootstrap=args.n_bootstrap,
-            output_prefix=output_prefix,
-        )
-        monthly_parts.append(monthly)
-        summary_parts.append(summary)
+    variant_kwargs = dict(
+        target_spi=args.target_spi,
+        lead_months=args.lead_months,
+        n_bootstrap=args.n_bootstrap,
+        output_prefix=output_prefix,
+    )
+    if args.n_jobs > 1:
+        with SharedTable.create(df) as table:
+            print(f"Shared {table.nbytes / 2**20:,.0f} MiB table with {args.n_jobs} workers")
+            results = Parallel(n_jobs=args.n_jobs)(
+                delayed(train_variant)(df=table, variant=variant, features=features, **variant_kwargs)
+                for variant, features in features_by_variant.items()
+            )
+    else:
+        results = [
+            train_variant(df=df, variant=variant, features=features, **variant_kwargs)
+            for variant, features in features_by_variant.items()
+        ]
+    monthly_parts = [monthly for monthly, _ in results]
+    summary_parts = [summary for _, summary in results]
 
     combined_monthly = monthly_parts[0]
     for monthly in monthly_parts[1:]:
@@ -28,12 +28,17 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 import xgboost as xgb
-from sklearn.isotonic import IsotonicRegression
-from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import classification_report, confusion_matrix
 from sklearn.utils.class_weight import compute_sample_weight
 
+from bootstrap_engine import bootstrap_bss_ci
+from calibration import fit_calibrators
 from feature_config import get_feature_columns
+from gap_fill import fill_nearest
+from grid_registry import gather, grid_registry, month_index, row_keys
+from monthly_groups import MonthlyGroups, monthly_brier_scores, target_month
+from regrid import regrid
+from spatial_features import NBR_MEAN_FEATURES, add_features, ensure_feature_cube
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
@@ -54,12 +59,7 @@ TARGET = "target_label"
 LABEL_MAP = {-1: 0, 0: 1, 1: 2}
 INV_LABEL_MAP = {v: k for k, v in LABEL_MAP.items()}
 
-CHIRPS_SPATIAL_FEATURES = [
-    "spi1_nbr_mean",
-    "spi3_nbr_mean",
-    "spi6_nbr_mean",
-    "pr_nbr_mean",
-]
+CHIRPS_SPATIAL_FEATURES = list(NBR_MEAN_FEATURES)
 MET_SPATIAL_FEATURES = [
     "t2m_anom_grid_lag1",
     "t2m_anom_grid_lag2",
@@ -149,57 +149,10 @@ def saturation_vapor_pressure_kpa(temp_c: xr.DataArray) -> xr.DataArray:
 
 def fill_spatial_nans(da: xr.DataArray) -> xr.DataArray:
     """Fill ERA5-Land land/sea-mask gaps from nearest valid spatial neighbors."""
-    original_lat = da["latitude"]
-    original_lon = da["longitude"]
-    filled = (
-        da.sortby("latitude").sortby("longitude")
-        .interpolate_na("longitude", method="nearest", fill_value="extrapolate")
-        .interpolate_na("latitude", method="nearest", fill_value="extrapolate")
-    )
-    return filled.sel(latitude=original_lat, longitude=original_lon)
-
-
-def nbr_mean(da: xr.DataArray, name: str) -> xr.DataArray:
-    lat_name = "latitude" if "latitude" in da.coords else "lat"
-    lon_name = "longitude" if "longitude" in da.coords else "lon"
-    out = da.rolling({lat_name: 3, lon_name: 3}, min_periods=1, center=True).mean()
-    out.name = name
-    return out
-
-
-def flat_dataset(ds: xr.Dataset) -> pd.DataFrame:
-    lat_name = "latitude" if "latitude" in ds.coords else "lat"
-    lon_name = "longitude" if "longitude" in ds.coords else "lon"
-    flat = ds.stack(pixel=(lat_name, lon_name)).reset_index("pixel").to_dataframe()
-    if "time" not in flat.columns:
-        flat = flat.reset_index()
-    flat = flat.rename(columns={lat_name: "latitude", lon_name: "longitude"})
-    flat["time"] = pd.to_datetime(flat["time"]).dt.to_period("M").dt.to_timestamp()
-    return flat
-
+    return fill_nearest(da, cache_file=MET_FILE)
 
-def build_chirps_spatial_features() -> pd.DataFrame:
-    print("Building CHIRPS neighborhood features...")
-    pr_ds = xr.open_dataset(PR_FILE).load()
-    spi_ds = xr.open_dataset(SPI_FILE).load()
 
-    pr = pr_ds["pr"].astype("float32")
-    spi1 = spi_ds["spi1"].astype("float32").sel(time=pr.time)
-    spi3 = spi_ds["spi3"].astype("float32").sel(time=pr.time)
-    spi6 = spi_ds["spi6"].astype("float32").sel(time=pr.time)
-
-    ds = xr.Dataset({
-        "spi1_nbr_mean": nbr_mean(spi1, "spi1_nbr_mean"),
-        "spi3_nbr_mean": nbr_mean(spi3, "spi3_nbr_mean"),
-        "spi6_nbr_mean": nbr_mean(spi6, "spi6_nbr_mean"),
-        "pr_nbr_mean": nbr_mean(pr, "pr_nbr_mean"),
-    })
-    out = flat_dataset(ds)
-    print(f"  CHIRPS spatial feature table: {out.shape}")
-    return out
-
-
-def build_met_spatial_features() -> pd.DataFrame:
+def build_met_spatial_features() -> xr.Dataset:
     print("Building gridded ERA5-Land temperature/VPD anomaly features...")
     pr_ds = xr.open_dataset(PR_FILE)
     target_lat = pr_ds["latitude"]
@@ -223,41 +176,33 @@ def build_met_spatial_features() -> pd.DataFrame:
     t2m_anom = t2m_c.groupby("time.month") - t2m_clim
     vpd_anom = vpd_kpa.groupby("time.month") - vpd_clim
 
-    # xarray interpolation is simplest and safest when both axes are ascending.
-    t2m_anom = t2m_anom.sortby("latitude").sortby("longitude")
-    vpd_anom = vpd_anom.sortby("latitude").sortby("longitude")
-    target_lat_sorted = target_lat.sortby(target_lat)
-    target_lon_sorted = target_lon.sortby(target_lon)
-
-    def interp_to_chirps(da: xr.DataArray) -> xr.DataArray:
-        linear = da.interp(
-            latitude=target_lat_sorted,
-            longitude=target_lon_sorted,
-            method="linear",
-        )
-        nearest = da.interp(
-            latitude=target_lat_sorted,
-            longitude=target_lon_sorted,
-            method="nearest",
-        )
-        # Linear interpolation leaves a thin NaN rim when CHIRPS cell centers sit
-        # just outside the ERA5 coordinate span. Nearest is used only as a rim
-        # fallback so we keep the full canonical CHIRPS grid.
-        return linear.combine_first(nearest).sel(latitude=target_lat, longitude=target_lon)
-
-    t2m_interp = interp_to_chirps(t2m_anom)
-    vpd_interp = interp_to_chirps(vpd_anom)
+    # Cached sparse bilinear weights (regrid.py); CHIRPS cells just outside
+    # the ERA5 span take the nearest ERA5 cell, so the full canonical CHIRPS
+    # grid is kept.
+    t2m_interp = regrid(t2m_anom, target_lat, target_lon, method="bilinear")
+    vpd_interp = regrid(vpd_anom, target_lat, target_lon, method="bilinear")
 
     ds = xr.Dataset({
         "t2m_anom_grid_lag1": t2m_interp.astype("float32"),
         "t2m_anom_grid_lag2": t2m_interp.shift(time=1).astype("float32"),
         "vpd_anom_grid_lag1": vpd_interp.astype("float32"),
         "vpd_anom_grid_lag2": vpd_interp.shift(time=1).astype("float32"),
+    }).transpose("time", "latitude", "longitude")
+    print(f"  ERA5 spatial-met feature cube: {dict(ds.sizes)}")
+    # Summarise each variable in place; flattening the cube to a frame just to
+    # print it would hold a full copy in memory.
+    summary = pd.DataFrame({
+        name: {
+            "count": int(ds[name].count()),
+            "mean": float(ds[name].mean()),
+            "std": float(ds[name].std(ddof=1)),
+            "min": float(ds[name].min()),
+            "max": float(ds[name].max()),
+        }
+        for name in MET_SPATIAL_FEATURES
     })
-    out = flat_dataset(ds)
-    print(f"  ERA5 spatial-met feature table: {out.shape}")
-    print(out[MET_SPATIAL_FEATURES].describe())
-    return out
+    print(summary)
+    return ds
 
 
 def build_feature_frame() -> pd.DataFrame:
@@ -266,12 +211,18 @@ def build_feature_frame() -> pd.DataFrame:
     df["time"] = pd.to_datetime(df["time"]).dt.to_period("M").dt.to_timestamp()
     df["year"] = df["year"].astype(int)
 
-    chirps_sp = build_chirps_spatial_features()
-    met_sp = build_met_spatial_features()
-
-    keys = ["time", "latitude", "longitude"]
-    out = df.merge(chirps_sp[keys + CHIRPS_SPATIAL_FEATURES], on=keys, how="left")
-    out = out.merge(met_sp[keys + MET_SPATIAL_FEATURES], on=keys, how="left")
+    print("Gathering CHIRPS neighborhood features...")
+    out = add_features(df, ensure_feature_cube(PR_FILE, SPI_FILE), CHIRPS_SPATIAL_FEATURES)
+
+    # The met cube is interpolated onto the CHIRPS grid, so the grid registry's
+    # pixel_id indexes it directly.
+    met = build_met_spatial_features()
+    pixel_id, months = row_keys(out, grid_registry(PR_FILE))
+    met_months = month_index(met["time"].values)
+    out = out.assign(**{
+        name: gather(met[name].values, met_months, pixel_id, months)
+        for name in MET_SPATIAL_FEATURES
+    })
 
     missing_spatial = int(out[CHIRPS_SPATIAL_FEATURES].isna().sum().sum())
     missing_met_rows = int(out[MET_SPATIAL_FEATURES].isna().any(axis=1).sum())
@@ -294,22 +245,6 @@ def bss(y: np.ndarray, p: np.ndarray, ref: np.ndarray) -> float:
     return float(1.0 - brier(y, p) / ref_bs) if ref_bs > 0 else float("nan")
 
 
-def target_month(series: pd.Series) -> pd.Series:
-    return (pd.to_datetime(series) + pd.DateOffset(months=1)).dt.to_period("M").dt.to_timestamp()
-
-
-def monthly_bs(frame: pd.DataFrame, prob_col: str) -> float:
-    monthly = (
-        frame.groupby("target_time")
-        .agg(
-            y_true_dry_frac=("is_dry", "mean"),
-            pred_prob_dry=(prob_col, "mean"),
-        )
-        .reset_index()
-    )
-    return brier(monthly["y_true_dry_frac"].to_numpy(), monthly["pred_prob_dry"].to_numpy())
-
-
 def bootstrap_bss(
     monthly: pd.DataFrame,
     pred_col: str,
@@ -317,17 +252,10 @@ def bootstrap_bss(
     n_bootstrap: int,
     seed: int = 42,
 ) -> tuple[float, float]:
-    rng = np.random.default_rng(seed)
-    idx = np.arange(len(monthly))
-    vals = []
     y = monthly["y_true_dry_frac"].to_numpy()
     p = monthly[pred_col].to_numpy()
     ref = monthly[ref_col].to_numpy()
-    for _ in range(n_bootstrap):
-        sample = rng.choice(idx, size=len(idx), replace=True)
-        vals.append(bss(y[sample], p[sample], ref[sample]))
-    lo, hi = np.nanquantile(vals, [0.025, 0.975])
-    return float(lo), float(hi)
+    return bootstrap_bss_ci(y, p, ref, n_bootstrap, seed)
 
 
 def add_calibrated_dry_probs(
@@ -356,15 +284,11 @@ def add_calibrated_dry_probs(
     val_raw = probs_val[:, dry_idx]
     test_raw = probs_test[:, dry_idx]
 
-    iso = IsotonicRegression(out_of_bounds="clip")
-    iso.fit(val_raw, val["is_dry"].to_numpy())
-    val_iso = iso.predict(val_raw)
-    test_iso = iso.predict(test_raw)
-
-    platt = LogisticRegression(solver="lbfgs")
-    platt.fit(val_raw.reshape(-1, 1), val["is_dry"].to_numpy())
-    val_platt = platt.predict_proba(val_raw.reshape(-1, 1))[:, 1]
-    test_platt = platt.predict_proba(test_raw.reshape(-1, 1))[:, 1]
+    calibrators = fit_calibrators(val_raw, val["is_dry"].to_numpy())
+    val_iso = calibrators["isotonic"].predict(val_raw)
+    test_iso = calibrators["isotonic"].predict(test_raw)
+    val_platt = calibrators["platt"].predict(val_raw)
+    test_platt = calibrators["platt"].predict(test_raw)
 
     val["xgb_raw_prob_dry"] = val_raw
     val["xgb_isotonic_prob_dry"] = val_iso
@@ -378,7 +302,7 @@ def add_calibrated_dry_probs(
         "isotonic": "xgb_isotonic_prob_dry",
         "platt": "xgb_platt_prob_dry",
     }
-    val_bs_by_method = {method: monthly_bs(val, col) for method, col in calibration_cols.items()}
+    val_bs_by_method = monthly_brier_scores(MonthlyGroups.from_frame(val), val, calibration_cols)
     best_method = min(val_bs_by_method, key=val_bs_by_method.get)
     test["xgb_selected_prob_dry"] = test[calibration_cols[best_method]]
     return val, test, best_method, val_bs_by_method
@@ -449,17 +373,16 @@ def run_experiment(df: pd.DataFrame, n_bootstrap: int) -> None:
     )
     print(report)
 
-    monthly = (
-        test.groupby("target_time")
-        .agg(
-            y_true_dry_frac=("is_dry", "mean"),
-            xgb_raw_prob_dry=("xgb_raw_prob_dry", "mean"),
-            xgb_isotonic_prob_dry=("xgb_isotonic_prob_dry", "mean"),
-            xgb_platt_prob_dry=("xgb_platt_prob_dry", "mean"),
-            xgb_selected_prob_dry=("xgb_selected_prob_dry", "mean"),
-            clim_prob_dry=("clim_prob_dry", "mean"),
-        )
-        .reset_index()
+    monthly = MonthlyGroups.from_frame(test).aggregate(
+        test,
+        {
+            "y_true_dry_frac": "is_dry",
+            "xgb_raw_prob_dry": "xgb_raw_prob_dry",
+            "xgb_isotonic_prob_dry": "xgb_isotonic_prob_dry",
+            "xgb_platt_prob_dry": "xgb_platt_prob_dry",
+            "xgb_selected_prob_dry": "xgb_selected_prob_dry",
+            "clim_prob_dry": "clim_prob_dry",
+        },
     )
 
     y = monthly["y_true_dry_frac"].to_numpy()
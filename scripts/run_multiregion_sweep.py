@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""
+Run the multi-region experiment for several regions concurrently under one core budget.
+
+run_multiregion_xgb_experiment.py handles one region per call, and a sweep ran
+the regions one after another. Inside a region, joblib SPI workers, XGBoost
+threads and BLAS threads each sized themselves to the whole machine, so simply
+launching regions side by side oversubscribed the cores. Each run also rewrote
+the shared multiregion_summary.csv, and concurrent runs would overwrite each
+other's rows.
+
+This scheduler splits a core budget (--cores, default all) into --jobs
+slots. Each region runs as its own runner process in a free slot, with that
+slot's share of cores passed as:
+  - --spi-n-jobs  (joblib SPI workers),
+  - --nthread     (XGBoost threads),
+  - OMP/OpenBLAS/MKL/numexpr/Accelerate thread limits in the environment,
+    set before the child imports numpy.
+Children run with --no-global-summary. Once every region has finished, their
+summary.csv files are merged into multiregion_summary.csv in a single atomic
+write. Per-region logs, wall times and the end-to-end sweep time are written
+to outputs/multiregion/sweep/.
+
+  python scripts/run_multiregion_sweep.py --cores 16 --jobs 4 -- --model both --copy-report
+"""
+from __future__ import annotations
+
+from argparse import REMAINDER, ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from region_config import REGIONS, resolve_region
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+RUNNER = Path(__file__).resolve().with_name("run_multiregion_xgb_experiment.py")
+OUT_ROOT = PROJECT_ROOT / "outputs" / "multiregion"
+REPORT_ROOT = PROJECT_ROOT / "results" / "multiregion"
+SWEEP_DIR = OUT_ROOT / "sweep"
+THREAD_ENV = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+)
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--regions",
+        nargs="+",
+        default=None,
+        help="Region slugs or aliases. Defaults to every configured region.",
+    )
+    parser.add_argument(
+        "--cores",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Total cores shared by all concurrent region runs.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="Regions run at once. Defaults to min(#regions, --cores).",
+    )
+    parser.add_argument(
+        "runner_args",
+        nargs=REMAINDER,
+        help="Arguments after `--` are passed to every run_multiregion_xgb_experiment.py call.",
+    )
+    return parser.parse_args()
+
+
+def thread_budget(cores: int, jobs: int) -> list[int]:
+    """Threads per slot: the core budget split across `jobs` slots, remainder to the first slots."""
+    if cores < 1 or jobs < 1:
+        raise ValueError(f"cores and jobs must be >= 1, got cores={cores}, jobs={jobs}")
+    jobs = min(jobs, cores)
+    base, extra = divmod(cores, jobs)
+    return [base + (1 if i < extra else 0) for i in range(jobs)]
+
+
+def runner_command(slug: str, threads: int, runner_args: list[str]) -> list[str]:
+    return [
+        sys.executable,
+        str(RUNNER),
+        "--region", slug,
+        "--spi-n-jobs", str(threads),
+        "--nthread", str(threads),
+        "--no-global-summary",
+        *runner_args,
+    ]
+
+
+def thread_env(threads: int) -> dict[str, str]:
+    env = dict(os.environ)
+    env.update({name: str(threads) for name in THREAD_ENV})
+    env["PYTHONUNBUFFERED"] = "1"
+    return env
+
+
+def run_region(slug: str, slots: "queue.Queue[int]", budget: list[int], runner_args: list[str]) -> dict[str, object]:
+    """Run one region in the next free slot, logging to SWEEP_DIR/<slug>.log."""
+    slot = slots.get()
+    threads = budget[slot]
+    log_path = SWEEP_DIR / f"{slug}.log"
+    cmd = runner_command(slug, threads, runner_args)
+    print(f"[sweep] start {slug} (slot {slot}, {threads} threads)")
+    start = time.perf_counter()
+    try:
+        with open(log_path, "w") as log:
+            log.write(" ".join(cmd) + "\n")
+            log.flush()
+            returncode = subprocess.call(cmd, stdout=log, stderr=subprocess.STDOUT, env=thread_env(threads), cwd=PROJECT_ROOT)
+    finally:
+        slots.put(slot)
+    seconds = time.perf_counter() - start
+    status = "ok" if returncode == 0 else f"failed ({returncode})"
+    print(f"[sweep] {status}: {slug} in {seconds:.1f} s (log {log_path})")
+    return {"region": slug, "slot": slot, "threads": threads, "seconds": round(seconds, 1), "returncode": returncode}
+
+
+def merge_region_summaries(since: float) -> pd.DataFrame | None:
+    """
+    Merge region summary.csv files written since `since` into multiregion_summary.csv.
+
+    Masked and strided runs write under their own slug, so summaries are found by
+    modification time rather than by the requested region names.
+    """
+    # Imported here: the runner pulls in xgboost and the SPI stack, which the
+    # scheduler itself does not need until the merge.
+    from run_multiregion_xgb_experiment import update_global_summary
+
+    frames = [
+        pd.read_csv(path)
+        for path in sorted(OUT_ROOT.glob("*/summary.csv"))
+        if path.stat().st_mtime >= since
+    ]
+    if not frames:
+        print("[sweep] no region summaries were written; global summary unchanged")
+        return None
+    rows = pd.concat(frames, ignore_index=True)
+    update_global_summary(rows.to_dict("records"))
+    return rows
+
+
+def main() -> None:
+    args = parse_args()
+    runner_args = args.runner_args[1:] if args.runner_args[:1] == ["--"] else args.runner_args
+    slugs = [resolve_region(name).slug for name in (args.regions or list(REGIONS))]
+    jobs = args.jobs or min(len(slugs), args.cores)
+    budget = thread_budget(args.cores, jobs)
+    SWEEP_DIR.mkdir(parents=True, exist_ok=True)
+    print(f"[sweep] {len(slugs)} regions, {args.cores} cores in {len(budget)} slots: threads per slot {budget}")
+
+    slots: queue.Queue[int] = queue.Queue()
+    for slot in range(len(budget)):
+        slots.put(slot)
+    started = time.time()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(budget)) as pool:
+        runs = list(pool.map(lambda slug: run_region(slug, slots, budget, runner_args), slugs))
+    sweep_seconds = time.perf_counter() - start
+
+    merge_region_summaries(started)
+    if "--copy-report" in runner_args and (OUT_ROOT / "multiregion_summary.csv").exists():
+        REPORT_ROOT.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(OUT_ROOT / "multiregion_summary.csv", REPORT_ROOT / "multiregion_summary.csv")
+
+    timing = pd.DataFrame(runs)
+    timing.loc[len(timing)] = {
+        "region": "ALL (end to end)", "slot": -1, "threads": args.cores,
+        "seconds": round(sweep_seconds, 1), "returncode": int(any(run["returncode"] for run in runs)),
+    }
+    timing_path = SWEEP_DIR / "sweep_timing.csv"
+    timing.to_csv(timing_path, index=False)
+    serial = sum(run["seconds"] for run in runs)
+    print(timing.to_string(index=False))
+    print(f"[sweep] end to end {sweep_seconds:.1f} s vs {serial:.1f} s summed region time; wrote {timing_path}")
+    failed = [run["region"] for run in runs if run["returncode"]]
+    if failed:
+        print(f"[sweep] failed regions: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,10 @@ Workflow per region:
   3. Build the same SPI-1[t+1] forecast table used by the canonical pipeline.
   4. Train/evaluate tabular and/or 3x3-neighbourhood XGBoost.
 
+With --pooled, step 4 instead trains one model over the existing forecast
+tables of all regions, streamed through XGBoost external memory
+(pooled_xgb.py), and writes outputs/multiregion/pooled/.
+
 Primary metric:
   Monthly dry-fraction Brier Skill Score (BSS) vs train-period monthly
   climatology, with monthly bootstrap confidence intervals.
@@ -24,7 +28,7 @@ from dataclasses import replace
 from datetime import datetime, timezone
 from pathlib import Path
 import json
-import re
+import os
 import shutil
 import sys
 
@@ -33,19 +37,40 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 import xgboost as xgb
-from joblib import Parallel, delayed
-from scipy.stats import gamma as gamma_dist, norm
-from sklearn.isotonic import IsotonicRegression
-from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import classification_report, confusion_matrix, roc_auc_score
 from sklearn.utils.class_weight import compute_sample_weight
 
+from chirps_clip import (
+    available_chirps_files,
+    clip_chirps_incremental,
+    clip_file,
+    clipped_pr_file,
+    concat_months,
+    latest_chirps_year,
+    stride_region,
+    write_clipped,
+)
+from bootstrap_engine import bootstrap_bss_ci
+from calibration import fit_calibrators, save_calibrators
+from dataset_loader import dataset_columns, load_split
 from feature_config import get_feature_columns
+from grid_registry import grid_registry
+from monthly_groups import MonthlyGroups, monthly_brier_scores, target_month
+from pooled_xgb import BATCH_ROWS, REGION_WEIGHTS, pooled_sources, train_pooled
 from region_config import REGIONS, Region, region_table, resolve_region
+from spatial_features import NBR_MEAN_FEATURES, add_features, ensure_feature_cube
+from spi_blocks import spi_family_shared, write_spi_blocks
+from spi_engine import spi_family
+from stage_cache import Stage
+from tabular_builder import (
+    FEATURE_LAGS,
+    iter_target_year_blocks,
+    month_start,
+    write_blocks,
+)
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
-RAW_CHIRPS = PROJECT_ROOT / "data" / "raw" / "chirps_v3" / "monthly"
 PROCESSED = PROJECT_ROOT / "data" / "processed"
 REGION_DATA_ROOT = PROCESSED / "regions"
 OUT_ROOT = PROJECT_ROOT / "outputs" / "multiregion"
@@ -62,12 +87,7 @@ MISSING_SENTINELS = (-9.9, -99.99, -999.0)
 LABEL_MAP = {-1: 0, 0: 1, 1: 2}
 INV_LABEL_MAP = {v: k for k, v in LABEL_MAP.items()}
 TARGET = "target_label"
-SPATIAL_FEATURES = [
-    "spi1_nbr_mean",
-    "spi3_nbr_mean",
-    "spi6_nbr_mean",
-    "pr_nbr_mean",
-]
+SPATIAL_FEATURES = list(NBR_MEAN_FEATURES)
 
 
 def parse_args() -> Namespace:
@@ -94,6 +114,14 @@ def parse_args() -> Namespace:
         help="Last CHIRPS year to use. Defaults to the latest local raw CHIRPS year.",
     )
     parser.add_argument("--rebuild-pr", action="store_true", help="Rebuild clipped CHIRPS region file.")
+    parser.add_argument(
+        "--incremental-pr",
+        action="store_true",
+        help=(
+            "Update an existing clipped CHIRPS region file from new or changed raw "
+            "yearly files only (tracked by a source manifest) instead of reusing it as-is."
+        ),
+    )
     parser.add_argument("--rebuild-spi", action="store_true", help="Recompute region SPI file.")
     parser.add_argument("--rebuild-dataset", action="store_true", help="Rebuild region forecast parquet.")
     parser.add_argument(
@@ -117,9 +145,31 @@ def parse_args() -> Namespace:
         default=1,
         help="Parallel jobs for SPI fitting. Use >1 for large full-resolution regions.",
     )
+    parser.add_argument(
+        "--spi-memory-budget",
+        default=None,
+        help=(
+            "Compute SPI out of core in pixel blocks sized to this budget (e.g. 2G) "
+            "instead of loading the whole cube; overrides --spi-n-jobs."
+        ),
+    )
     parser.add_argument("--num-boost-round", type=int, default=2000)
     parser.add_argument("--early-stopping-rounds", type=int, default=50)
     parser.add_argument("--verbose-eval", type=int, default=100)
+    parser.add_argument(
+        "--nthread",
+        type=int,
+        default=0,
+        help="XGBoost threads; 0 uses XGBoost's default (all cores). Set by run_multiregion_sweep.py.",
+    )
+    parser.add_argument(
+        "--no-global-summary",
+        action="store_true",
+        help=(
+            "Write only the region summary, not outputs/multiregion/multiregion_summary.csv; "
+            "used by concurrent sweeps, which merge region summaries at the end."
+        ),
+    )
     parser.add_argument(
         "--prepare-only",
         action="store_true",
@@ -162,37 +212,35 @@ def parse_args() -> Namespace:
         default=None,
         help="Optional mask variable name inside --mask-file. Defaults from --country-mask/--basin-mask.",
     )
+    parser.add_argument(
+        "--pooled",
+        action="store_true",
+        help=(
+            "Train one pooled XGBoost model over the existing forecast tables of all regions "
+            "(or --pooled-regions), streaming Parquet batches through external memory."
+        ),
+    )
+    parser.add_argument(
+        "--pooled-regions",
+        nargs="+",
+        default=None,
+        help="Region slugs or aliases for --pooled. Defaults to every configured region.",
+    )
+    parser.add_argument(
+        "--batch-rows",
+        type=int,
+        default=BATCH_ROWS,
+        help="Maximum rows per Parquet batch fed to XGBoost in --pooled mode.",
+    )
+    parser.add_argument(
+        "--region-weight",
+        choices=REGION_WEIGHTS,
+        default="equal",
+        help="--pooled sample weights: 'equal' total weight per region, or 'rows' (every row alike).",
+    )
     return parser.parse_args()
 
 
-def available_chirps_files(start_year: int, end_year: int | None) -> list[Path]:
-    files = sorted(RAW_CHIRPS.glob("chirps-v3.0.*.monthly.nc"))
-    selected = []
-    for path in files:
-        match = re.search(r"chirps-v3\.0\.(\d{4})\.monthly\.nc$", path.name)
-        if not match:
-            continue
-        year = int(match.group(1))
-        if year < start_year:
-            continue
-        if end_year is not None and year > end_year:
-            continue
-        selected.append(path)
-    if not selected:
-        raise FileNotFoundError(f"No CHIRPS monthly files found in {RAW_CHIRPS}")
-    return selected
-
-
-def latest_chirps_year() -> int:
-    files = available_chirps_files(BASELINE_START_YEAR, None)
-    years = []
-    for path in files:
-        match = re.search(r"chirps-v3\.0\.(\d{4})\.monthly\.nc$", path.name)
-        if match:
-            years.append(int(match.group(1)))
-    return max(years)
-
-
 def region_dir(region: Region) -> Path:
     return REGION_DATA_ROOT / region.slug
 
@@ -206,16 +254,17 @@ def report_dir(region: Region) -> Path:
 
 
 def region_paths(region: Region, start_year: int, end_year: int, use_canonical: bool) -> dict[str, Path]:
+    pr_file = clipped_pr_file(region, start_year, end_year, use_canonical)
     if region.slug == "cvalley" and use_canonical:
         return {
-            "pr": PROCESSED / f"chirps_v3_monthly_cvalley_{start_year}_{end_year}.nc",
+            "pr": pr_file,
             "spi": PROCESSED / f"chirps_v3_monthly_cvalley_spi_{start_year}_{end_year}.nc",
             "dataset": PROCESSED / "dataset_forecast.parquet",
             "sample": PROCESSED / "dataset_forecast_sample.csv",
         }
     rdir = region_dir(region)
     return {
-        "pr": rdir / f"chirps_v3_monthly_{region.slug}_{start_year}_{end_year}.nc",
+        "pr": pr_file,
         "spi": rdir / f"chirps_v3_monthly_{region.slug}_spi_{start_year}_{end_year}.nc",
         "dataset": rdir / f"dataset_forecast_{region.slug}.parquet",
         "sample": rdir / f"dataset_forecast_{region.slug}_sample.csv",
@@ -238,21 +287,24 @@ def masked_dataset_paths(region: Region) -> dict[str, Path]:
     }
 
 
-def select_lat_lon(ds: xr.Dataset, region: Region, grid_stride: int = 1) -> xr.Dataset:
-    lat_name = "latitude" if "latitude" in ds.coords else "lat"
-    lon_name = "longitude" if "longitude" in ds.coords else "lon"
+SCRIPTS_DIR = Path(__file__).resolve().parent
 
-    lat_min, lat_max = sorted((region.lat_min, region.lat_max))
-    if float(ds[lat_name][0]) > float(ds[lat_name][-1]):
-        ds = ds.sel({lat_name: slice(lat_max, lat_min)})
-    else:
-        ds = ds.sel({lat_name: slice(lat_min, lat_max)})
 
-    lon_min, lon_max = sorted((region.lon_min, region.lon_max))
-    ds = ds.sel({lon_name: slice(lon_min, lon_max)})
-    if grid_stride > 1:
-        ds = ds.isel({lat_name: slice(None, None, grid_stride), lon_name: slice(None, None, grid_stride)})
-    return ds
+def artifact_stage(
+    out_file: Path,
+    outputs: list[Path],
+    inputs: list[Path],
+    params: dict[str, object],
+    modules: list[str],
+) -> Stage:
+    """Stage record for a regional artifact, keyed on inputs, params and producing modules."""
+    return Stage(
+        name=f"multiregion_{out_file.stem}",
+        outputs=outputs,
+        inputs=inputs,
+        params=params,
+        code=[SCRIPTS_DIR / module for module in modules],
+    )
 
 
 def clip_chirps(
@@ -262,13 +314,23 @@ def clip_chirps(
     end_year: int,
     force: bool,
     grid_stride: int,
+    incremental: bool = False,
 ) -> None:
-    if out_file.exists() and not force:
-        print(f"Using existing clipped CHIRPS file: {out_file}")
+    files = available_chirps_files(start_year, end_year)
+    if incremental and not force:
+        clip_chirps_incremental(region, out_file, files, grid_stride=grid_stride)
+        return
+    stage = artifact_stage(
+        out_file,
+        [out_file],
+        files,
+        {"bbox": region.bbox, "grid_stride": grid_stride, "years": [start_year, end_year]},
+        ["chirps_clip.py"],
+    )
+    if not force and stage.fresh():
+        print(f"Using up-to-date clipped CHIRPS file: {out_file}")
         return
 
-    files = available_chirps_files(start_year, end_year)
-    out_file.parent.mkdir(parents=True, exist_ok=True)
     print(f"Clipping CHIRPS for {region.name}: {len(files)} yearly files")
     print(f"Region bbox lat[{region.lat_min}, {region.lat_max}] lon[{region.lon_min}, {region.lon_max}]")
     if grid_stride > 1:
@@ -277,101 +339,23 @@ def clip_chirps(
     clipped = []
     for idx, file in enumerate(files, start=1):
         print(f"  clipping {file.name} ({idx}/{len(files)})")
-        part = xr.open_dataset(file)
-        part = select_lat_lon(part, region, grid_stride=grid_stride)
-        if part.sizes.get("latitude", part.sizes.get("lat", 0)) == 0 or part.sizes.get(
-            "longitude", part.sizes.get("lon", 0)
-        ) == 0:
-            raise ValueError(f"Region selection produced an empty grid for {region.slug}")
-        var = next(
-            (v for v in part.data_vars if v.lower().startswith(("precip", "pr"))),
-            list(part.data_vars)[0],
-        )
-        part = part[[var]].rename({var: "pr"})
-        if "lat" in part.coords:
-            part = part.rename({"lat": "latitude"})
-        if "lon" in part.coords:
-            part = part.rename({"lon": "longitude"})
-        clipped.append(part.load())
-
-    ds = xr.concat(clipped, dim="time").sortby("time")
-    time_index = pd.Index(ds["time"].values)
-    ds = ds.isel(time=~time_index.duplicated())
-
-    encoding = {"pr": dict(zlib=True, complevel=4)}
-    ds.to_netcdf(out_file, encoding=encoding)
+        clipped.append(clip_file(file, region, grid_stride=grid_stride))
+
+    ds = concat_months(clipped)
+    write_clipped(ds, out_file, files)
     print(f"Wrote clipped CHIRPS: {out_file}")
     print("Dims:", {k: int(v) for k, v in ds.sizes.items()})
+    stage.record()
 
 
-def precip_to_spi(series: np.ndarray, baseline_mask: np.ndarray) -> np.ndarray:
-    base = series[baseline_mask]
-    base = base[~np.isnan(base)]
-    spi = np.full(len(series), np.nan, dtype=np.float32)
-
-    if len(base) < 10:
-        return spi
-    p_zero = np.mean(base == 0)
-    nonzero = base[base > 0]
-    if len(nonzero) < 5:
-        return spi
-
-    fit_alpha, _, fit_beta = gamma_dist.fit(nonzero, floc=0)
-    for i, val in enumerate(series):
-        if np.isnan(val):
-            continue
-        if val == 0:
-            cdf_val = p_zero
-        else:
-            cdf_val = p_zero + (1.0 - p_zero) * gamma_dist.cdf(val, fit_alpha, scale=fit_beta)
-        cdf_val = np.clip(cdf_val, 1e-6, 1 - 1e-6)
-        spi[i] = norm.ppf(cdf_val)
-    return spi
-
-
-def rolling_sum(arr3d: np.ndarray, window: int) -> np.ndarray:
-    out = np.full_like(arr3d, np.nan, dtype=np.float64)
-    for t in range(window - 1, arr3d.shape[0]):
-        block = arr3d[t - window + 1 : t + 1]
-        out[t] = np.nansum(block, axis=0)
-        has_nan = np.any(np.isnan(block), axis=0)
-        out[t][has_nan] = np.nan
-    return out
-
-
-def rolling_sum_1d(series: np.ndarray, window: int) -> np.ndarray:
-    out = np.full(len(series), np.nan, dtype=np.float64)
-    for t in range(window - 1, len(series)):
-        block = series[t - window + 1 : t + 1]
-        if np.any(np.isnan(block)):
-            continue
-        out[t] = np.sum(block)
-    return out
-
-
-def compute_spi_for_pixel(
-    series: np.ndarray,
+def compute_spi_block(
+    pr_block: np.ndarray,
     months_arr: np.ndarray,
     baseline_mask: np.ndarray,
 ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
-    spi1 = np.full(len(series), np.nan, dtype=np.float32)
-    spi3 = np.full(len(series), np.nan, dtype=np.float32)
-    spi6 = np.full(len(series), np.nan, dtype=np.float32)
-    rolled = {
-        1: series,
-        3: rolling_sum_1d(series, 3),
-        6: rolling_sum_1d(series, 6),
-    }
-    out = {1: spi1, 3: spi3, 6: spi6}
-    for window, values in rolled.items():
-        for month in range(1, 13):
-            month_idx = np.where(months_arr == month)[0]
-            base_idx = np.where(baseline_mask & (months_arr == month))[0]
-            mask_for_month = np.zeros(len(series), dtype=bool)
-            mask_for_month[base_idx] = True
-            base_within_month = mask_for_month[month_idx]
-            out[window][month_idx] = precip_to_spi(values[month_idx], base_within_month)
-    return spi1, spi3, spi6
+    """SPI-1/3/6 for a (time, pixel) block with whole-array gamma fits."""
+    spi, _ = spi_family(pr_block, months_arr, baseline_mask, (1, 3, 6))
+    return spi[0], spi[1], spi[2]
 
 
 def compute_spi_parallel(
@@ -381,54 +365,42 @@ def compute_spi_parallel(
     n_jobs: int,
 ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     ntimes, nlat, nlon = pr_vals.shape
-    n_pixels = nlat * nlon
-    flat = pr_vals.reshape(ntimes, n_pixels).T
-    print(f"Parallel SPI fitting across {n_pixels:,} pixels with n_jobs={n_jobs}...")
-    results = Parallel(n_jobs=n_jobs, verbose=10, batch_size=64)(
-        delayed(compute_spi_for_pixel)(flat[i], months_arr, baseline_mask)
-        for i in range(n_pixels)
-    )
-    spi1 = np.empty((ntimes, n_pixels), dtype=np.float32)
-    spi3 = np.empty((ntimes, n_pixels), dtype=np.float32)
-    spi6 = np.empty((ntimes, n_pixels), dtype=np.float32)
-    for i, (pix_spi1, pix_spi3, pix_spi6) in enumerate(results):
-        spi1[:, i] = pix_spi1
-        spi3[:, i] = pix_spi3
-        spi6[:, i] = pix_spi6
-    return (
-        spi1.reshape(ntimes, nlat, nlon),
-        spi3.reshape(ntimes, nlat, nlon),
-        spi6.reshape(ntimes, nlat, nlon),
-    )
+    print(f"Parallel SPI fitting across {nlat * nlon:,} pixels in shared memory with n_jobs={n_jobs}...")
+    spi = spi_family_shared(pr_vals, months_arr, baseline_mask, (1, 3, 6), n_jobs)
+    return spi[0], spi[1], spi[2]
 
 
-def compute_spi_from_rolled(
-    rolled_vals: np.ndarray,
-    months_arr: np.ndarray,
-    baseline_mask: np.ndarray,
-    window: int,
-) -> np.ndarray:
-    ntimes, nlat, nlon = rolled_vals.shape
-    spi_out = np.full_like(rolled_vals, np.nan, dtype=np.float32)
-    for month in range(1, 13):
-        month_idx = np.where(months_arr == month)[0]
-        base_idx = np.where(baseline_mask & (months_arr == month))[0]
-        mask_for_month = np.zeros(ntimes, dtype=bool)
-        mask_for_month[base_idx] = True
-        base_within_month = mask_for_month[month_idx]
-        for j in range(nlat):
-            for k in range(nlon):
-                spi_out[month_idx, j, k] = precip_to_spi(
-                    rolled_vals[month_idx, j, k],
-                    base_within_month,
-                )
-        print(f"  SPI-{window} month {month:02d}/12 done")
-    return spi_out
-
-
-def make_spi_labels(pr_file: Path, spi_file: Path, force: bool, n_jobs: int) -> None:
-    if spi_file.exists() and not force:
-        print(f"Using existing SPI file: {spi_file}")
+def make_spi_labels(
+    pr_file: Path,
+    spi_file: Path,
+    force: bool,
+    n_jobs: int,
+    memory_budget: str | None = None,
+) -> None:
+    stage = artifact_stage(
+        spi_file,
+        [spi_file],
+        [pr_file],
+        {"windows": [1, 3, 6], "baseline": [BASELINE_START_YEAR, BASELINE_END_YEAR]},
+        ["spi_engine.py", "spi_blocks.py"],
+    )
+    if not force and stage.fresh():
+        print(f"Using up-to-date SPI file: {spi_file}")
+        return
+
+    if memory_budget:
+        summary = write_spi_blocks(
+            pr_file,
+            spi_file,
+            (1, 3, 6),
+            memory_budget,
+            (BASELINE_START_YEAR, BASELINE_END_YEAR),
+            label_windows=(1, 3),
+            label_dtype=np.float32,
+        )
+        print(f"Saved SPI labels: {spi_file}")
+        print("SPI-1 label counts:", summary["label_counts"][1])
+        stage.record()
         return
 
     print(f"Loading clipped CHIRPS for SPI: {pr_file}")
@@ -445,30 +417,8 @@ def make_spi_labels(pr_file: Path, spi_file: Path, force: bool, n_jobs: int) ->
             pr_vals, months_arr, baseline_mask, n_jobs=n_jobs
         )
     else:
-        print(f"Computing SPI-1 for grid {nlat} x {nlon} across {ntimes} months...")
-        spi1_vals = np.full_like(pr_vals, np.nan, dtype=np.float32)
-        for month in range(1, 13):
-            month_idx = np.where(months_arr == month)[0]
-            base_idx = np.where(baseline_mask & (months_arr == month))[0]
-            mask_for_month = np.zeros(ntimes, dtype=bool)
-            mask_for_month[base_idx] = True
-            base_within_month = mask_for_month[month_idx]
-            for j in range(nlat):
-                for k in range(nlon):
-                    spi1_vals[month_idx, j, k] = precip_to_spi(
-                        pr_vals[month_idx, j, k],
-                        base_within_month,
-                    )
-            print(f"  SPI-1 month {month:02d}/12 done")
-
-        print("Computing SPI-3 and SPI-6 rolling precipitation sums...")
-        pr3_vals = rolling_sum(pr_vals, 3)
-        pr6_vals = rolling_sum(pr_vals, 6)
-
-        print("Computing SPI-3...")
-        spi3_vals = compute_spi_from_rolled(pr3_vals, months_arr, baseline_mask, 3)
-        print("Computing SPI-6...")
-        spi6_vals = compute_spi_from_rolled(pr6_vals, months_arr, baseline_mask, 6)
+        print(f"Computing SPI-1/3/6 for grid {nlat} x {nlon} across {ntimes} months...")
+        spi1_vals, spi3_vals, spi6_vals = compute_spi_block(pr_vals, months_arr, baseline_mask)
 
     label1_vals = np.full_like(spi1_vals, np.nan, dtype=np.float32)
     finite1 = np.isfinite(spi1_vals)
@@ -507,6 +457,7 @@ def make_spi_labels(pr_file: Path, spi_file: Path, force: bool, n_jobs: int) ->
         for label, value in {"dry": -1, "normal": 0, "wet": 1}.items()
     }
     print("SPI-1 label counts:", counts)
+    stage.record()
 
 
 def load_climate_features(times: pd.DatetimeIndex, climate_features: str) -> tuple[pd.DataFrame, list[str]]:
@@ -582,6 +533,17 @@ def load_grid_mask(mask_file: Path, template: xr.DataArray, var_name: str = "cou
         mask_ds.close()
 
 
+def load_forecast_table(dataset_file: Path) -> pd.DataFrame:
+    """Feature columns as float32 and labels as int8, via the shared loader cache."""
+    available = dataset_columns(dataset_file)
+    # The canonical cvalley table has no region column.
+    keys = [
+        c for c in ("region", "time", "year", "month", "latitude", "longitude", "pixel_id", "month_index")
+        if c in available
+    ]
+    return load_split("all", get_feature_columns(available), path=dataset_file, columns=keys)
+
+
 def build_forecast_dataset(
     region: Region,
     pr_file: Path,
@@ -592,12 +554,23 @@ def build_forecast_dataset(
     force: bool,
     mask_file: Path | None = None,
     mask_var: str = "country_mask",
+    canonical: bool = False,
 ) -> pd.DataFrame:
-    if dataset_file.exists() and not force:
-        print(f"Using existing forecast dataset: {dataset_file}")
-        df = pd.read_parquet(dataset_file)
-        df["time"] = pd.to_datetime(df["time"])
-        return df
+    # The canonical cvalley table belongs to build_dataset_forecast.py / run_pipeline.py.
+    if canonical and dataset_file.exists():
+        print(f"Using canonical forecast dataset: {dataset_file}")
+        return load_forecast_table(dataset_file)
+    inputs = [pr_file, spi_file] + ([CLIMATE_FILE] if climate_features != "none" else [])
+    stage = artifact_stage(
+        dataset_file,
+        [dataset_file, sample_file],
+        inputs + ([mask_file] if mask_file is not None else []),
+        {"region": region.slug, "climate_features": climate_features, "mask_var": mask_var},
+        ["tabular_builder.py"],
+    )
+    if not force and stage.fresh():
+        print(f"Using up-to-date forecast dataset: {dataset_file}")
+        return load_forecast_table(dataset_file)
 
     print(f"Building forecast table for {region.name}")
     pr_ds = xr.open_dataset(pr_file).load()
@@ -609,136 +582,84 @@ def build_forecast_dataset(
     spi6 = spi_ds["spi6"].sel(time=pr.time)
     label = spi_ds["drought_label_spi1"].sel(time=pr.time)
 
+    grid_registry(pr_file)
     grid_mask = None
     if mask_file is not None:
         grid_mask = load_grid_mask(mask_file, pr, var_name=mask_var)
         n_keep = int(grid_mask.sum())
         n_total = int(grid_mask.size)
         print(f"Applying grid mask '{mask_var}': {mask_file} ({n_keep:,}/{n_total:,} grid cells retained)")
-        pr = pr.where(grid_mask)
-        spi1 = spi1.where(grid_mask)
-        spi3 = spi3.where(grid_mask)
-        spi6 = spi6.where(grid_mask)
-        label = label.where(grid_mask)
-
-    target = label.shift(time=-1)
-    target.name = "target_label"
 
-    ds_stacked = xr.Dataset(
-        {
-            "spi1_lag1": spi1,
-            "spi1_lag2": spi1.shift(time=1),
-            "spi1_lag3": spi1.shift(time=2),
-            "spi3_lag1": spi3,
-            "spi6_lag1": spi6,
-            "pr_lag1": pr,
-            "pr_lag2": pr.shift(time=1),
-            "pr_lag3": pr.shift(time=2),
-            "target_label": target,
-        }
-    ).stack(pixel=("latitude", "longitude"))
-    if grid_mask is not None:
-        flat_mask = grid_mask.stack(pixel=("latitude", "longitude"))
-        ds_stacked = ds_stacked.where(flat_mask, drop=True)
-
-    df = ds_stacked.reset_index("pixel").to_dataframe()
-    if "time" not in df.columns:
-        df = df.reset_index()
-    df["time"] = pd.to_datetime(df["time"]).dt.to_period("M").dt.to_timestamp()
-
-    all_times = pd.DatetimeIndex(sorted(df["time"].unique()))
-    cdf, exog_cols = load_climate_features(all_times, climate_features)
+    times = month_start(pr.time.values)
+    cdf, exog_cols = load_climate_features(pd.DatetimeIndex(times), climate_features)
     if exog_cols:
-        df = df.merge(cdf, on="time", how="left")
         print(f"Added climate features: {exog_cols}")
 
-    feat_cols = [
-        "spi1_lag1",
-        "spi1_lag2",
-        "spi1_lag3",
-        "spi3_lag1",
-        "spi6_lag1",
-        "pr_lag1",
-        "pr_lag2",
-        "pr_lag3",
-    ]
-    before = len(df)
-    df = df.dropna(subset=["target_label"] + feat_cols + exog_cols).copy()
-    dropped = before - len(df)
-    if dropped:
-        print(f"Dropped rows with missing target/features: {dropped:,}")
-
-    target_time = pd.to_datetime(df["time"]) + pd.DateOffset(months=1)
-    df["month"] = target_time.dt.month
-    df["year"] = target_time.dt.year
-    df["month_sin"] = np.sin(2 * np.pi * df["month"] / 12.0)
-    df["month_cos"] = np.cos(2 * np.pi * df["month"] / 12.0)
-    df["region"] = region.slug
-    df["target_label"] = df["target_label"].astype(np.int8)
+    cubes = {
+        "pr": pr.values,
+        "spi1": spi1.values,
+        "spi3": spi3.values,
+        "spi6": spi6.values,
+        "label": label.values,
+    }
+    feat_cols = list(FEATURE_LAGS)
+    blocks = iter_target_year_blocks(
+        times,
+        pr.latitude.values,
+        pr.longitude.values,
+        cubes,
+        FEATURE_LAGS,
+        {"target_label": ("label", 1)},
+        lead=1,
+        exog={col: cdf[col].to_numpy() for col in exog_cols},
+        pixel_mask=None if grid_mask is None else grid_mask.values,
+    )
+
+    def with_region(blocks):
+        for columns in blocks:
+            columns["region"] = np.full(len(columns["time"]), region.slug, dtype=object)
+            # The label cube decodes as float (NaN fill); rows kept here are finite.
+            columns["target_label"] = columns["target_label"].astype(np.int8)
+            yield columns
 
     cols = (
         ["region", "time", "year", "month", "month_sin", "month_cos", "latitude", "longitude"]
+        + ["pixel_id", "month_index"]
         + feat_cols
         + exog_cols
         + ["target_label"]
     )
-    df = df[cols]
-    dataset_file.parent.mkdir(parents=True, exist_ok=True)
-    df.to_parquet(dataset_file, index=False)
-    df.head(10_000).to_csv(sample_file, index=False)
-    print(f"Wrote dataset: {dataset_file} rows={len(df):,} cols={df.shape[1]}")
-    print("Class distribution:\n", df["target_label"].value_counts().sort_index())
-    return df
+    summary = write_blocks(dataset_file, with_region(blocks), cols, sample_file=sample_file)
+    print(f"Wrote dataset: {dataset_file} rows={summary.rows:,} cols={len(cols)} row_groups={summary.row_groups}")
+    print("Class distribution:\n", summary.class_counts)
+    stage.record()
+    return load_forecast_table(dataset_file)
 
 
-def build_spatial_feature_frame(
+def add_spatial_features(
+    df: pd.DataFrame,
     pr_file: Path,
     spi_file: Path,
     mask_file: Path | None = None,
     mask_var: str = "country_mask",
 ) -> pd.DataFrame:
-    print("Building 3x3 spatial-neighbourhood features...")
-    pr_ds = xr.open_dataset(pr_file).load()
-    spi_ds = xr.open_dataset(spi_file).load()
-    pr = pr_ds["pr"].astype("float32")
-    spi1 = spi_ds["spi1"].sel(time=pr.time).astype("float32")
-    spi3 = spi_ds["spi3"].sel(time=pr.time).astype("float32")
-    spi6 = spi_ds["spi6"].sel(time=pr.time).astype("float32")
-
+    print("Gathering 3x3 spatial-neighbourhood features...")
     grid_mask = None
     if mask_file is not None:
-        grid_mask = load_grid_mask(mask_file, pr, var_name=mask_var)
+        with xr.open_dataset(pr_file) as pr_ds:
+            grid_mask = load_grid_mask(mask_file, pr_ds["pr"], var_name=mask_var)
         n_keep = int(grid_mask.sum())
         n_total = int(grid_mask.size)
-        print(f"Applying grid mask '{mask_var}' before neighbourhood rolling: {n_keep:,}/{n_total:,} grid cells retained")
-        pr = pr.where(grid_mask)
-        spi1 = spi1.where(grid_mask)
-        spi3 = spi3.where(grid_mask)
-        spi6 = spi6.where(grid_mask)
-
-    def nbr_mean(da: xr.DataArray, name: str) -> xr.DataArray:
-        rolled = da.rolling({"latitude": 3, "longitude": 3}, min_periods=1, center=True).mean()
-        rolled.name = name
-        return rolled
-
-    nbr_ds = xr.Dataset(
-        {
-            "spi1_nbr_mean": nbr_mean(spi1, "spi1_nbr_mean"),
-            "spi3_nbr_mean": nbr_mean(spi3, "spi3_nbr_mean"),
-            "spi6_nbr_mean": nbr_mean(spi6, "spi6_nbr_mean"),
-            "pr_nbr_mean": nbr_mean(pr, "pr_nbr_mean"),
-        }
-    ).stack(pixel=("latitude", "longitude"))
-    if grid_mask is not None:
-        flat_mask = grid_mask.stack(pixel=("latitude", "longitude"))
-        nbr_ds = nbr_ds.where(flat_mask, drop=True)
+        print(f"Applying grid mask '{mask_var}' before neighbourhood statistics: {n_keep:,}/{n_total:,} grid cells retained")
 
-    nbr_df = nbr_ds.reset_index("pixel").to_dataframe()
-    if "time" not in nbr_df.columns:
-        nbr_df = nbr_df.reset_index()
-    nbr_df["time"] = pd.to_datetime(nbr_df["time"]).dt.to_period("M").dt.to_timestamp()
-    print(f"Neighbourhood feature table: {nbr_df.shape}")
-    return nbr_df[["time", "latitude", "longitude"] + SPATIAL_FEATURES]
+    cube_file = ensure_feature_cube(
+        pr_file,
+        spi_file,
+        grid_mask=grid_mask,
+        mask_file=mask_file,
+        mask_var=mask_var,
+    )
+    return add_features(df, cube_file, SPATIAL_FEATURES, grid_mask=grid_mask)
 
 
 def brier(y: np.ndarray, p: np.ndarray) -> float:
@@ -757,34 +678,14 @@ def bootstrap_bss(
     n_bootstrap: int,
     seed: int = 42,
 ) -> tuple[float, float]:
-    rng = np.random.default_rng(seed)
-    idx = np.arange(len(monthly))
-    vals = []
     y = monthly["y_true_dry_frac"].to_numpy()
     p = monthly[pred_col].to_numpy()
     ref = monthly[ref_col].to_numpy()
-    for _ in range(n_bootstrap):
-        sample = rng.choice(idx, size=len(idx), replace=True)
-        vals.append(bss(y[sample], p[sample], ref[sample]))
-    lo, hi = np.nanquantile(vals, [0.025, 0.975])
-    return float(lo), float(hi)
-
-
-def monthly_bs(frame: pd.DataFrame, prob_col: str) -> float:
-    monthly = (
-        frame.groupby("target_time")
-        .agg(y_true_dry_frac=("is_dry", "mean"), pred_prob_dry=(prob_col, "mean"))
-        .reset_index()
-    )
-    return brier(monthly["y_true_dry_frac"].to_numpy(), monthly["pred_prob_dry"].to_numpy())
+    return bootstrap_bss_ci(y, p, ref, n_bootstrap, seed)
 
 
-def target_month(series: pd.Series) -> pd.Series:
-    return (pd.to_datetime(series) + pd.DateOffset(months=1)).dt.to_period("M").dt.to_timestamp()
-
-
-def xgb_params() -> dict[str, object]:
-    return {
+def xgb_params(nthread: int = 0) -> dict[str, object]:
+    params = {
         "objective": "multi:softprob",
         "num_class": 3,
         "eval_metric": "mlogloss",
@@ -799,6 +700,9 @@ def xgb_params() -> dict[str, object]:
         "alpha": 0.1,
         "seed": 42,
     }
+    if nthread > 0:
+        params["nthread"] = nthread
+    return params
 
 
 def evaluate_model(
@@ -838,7 +742,7 @@ def evaluate_model(
 
     print(f"[{region.slug}/{model_name}] Training XGBoost...")
     model = xgb.train(
-        params=xgb_params(),
+        params=xgb_params(args.nthread),
         dtrain=dtrain,
         num_boost_round=args.num_boost_round,
         evals=[(dtrain, "train"), (dval, "val")],
@@ -863,15 +767,11 @@ def evaluate_model(
     val["target_time"] = target_month(val["time"])
     test["target_time"] = target_month(test["time"])
 
-    iso = IsotonicRegression(out_of_bounds="clip")
-    iso.fit(val_raw, val["is_dry"].to_numpy())
-    val_iso = iso.predict(val_raw)
-    test_iso = iso.predict(test_raw)
-
-    platt = LogisticRegression(solver="lbfgs")
-    platt.fit(val_raw.reshape(-1, 1), val["is_dry"].to_numpy())
-    val_platt = platt.predict_proba(val_raw.reshape(-1, 1))[:, 1]
-    test_platt = platt.predict_proba(test_raw.reshape(-1, 1))[:, 1]
+    calibrators = fit_calibrators(val_raw, val["is_dry"].to_numpy())
+    val_iso = calibrators["isotonic"].predict(val_raw)
+    test_iso = calibrators["isotonic"].predict(test_raw)
+    val_platt = calibrators["platt"].predict(val_raw)
+    test_platt = calibrators["platt"].predict(test_raw)
 
     val["xgb_raw_prob_dry"] = val_raw
     val["xgb_isotonic_prob_dry"] = val_iso
@@ -885,22 +785,21 @@ def evaluate_model(
         "isotonic": "xgb_isotonic_prob_dry",
         "platt": "xgb_platt_prob_dry",
     }
-    val_bs_by_method = {method: monthly_bs(val, col) for method, col in calibration_cols.items()}
+    val_bs_by_method = monthly_brier_scores(MonthlyGroups.from_frame(val), val, calibration_cols)
     best_method = min(val_bs_by_method, key=val_bs_by_method.get)
     best_col = calibration_cols[best_method]
     test["xgb_selected_prob_dry"] = test[best_col]
 
-    monthly = (
-        test.groupby("target_time")
-        .agg(
-            y_true_dry_frac=("is_dry", "mean"),
-            xgb_raw_prob_dry=("xgb_raw_prob_dry", "mean"),
-            xgb_isotonic_prob_dry=("xgb_isotonic_prob_dry", "mean"),
-            xgb_platt_prob_dry=("xgb_platt_prob_dry", "mean"),
-            xgb_selected_prob_dry=("xgb_selected_prob_dry", "mean"),
-            clim_prob_dry=("clim_prob_dry", "mean"),
-        )
-        .reset_index()
+    monthly = MonthlyGroups.from_frame(test).aggregate(
+        test,
+        {
+            "y_true_dry_frac": "is_dry",
+            "xgb_raw_prob_dry": "xgb_raw_prob_dry",
+            "xgb_isotonic_prob_dry": "xgb_isotonic_prob_dry",
+            "xgb_platt_prob_dry": "xgb_platt_prob_dry",
+            "xgb_selected_prob_dry": "xgb_selected_prob_dry",
+            "clim_prob_dry": "clim_prob_dry",
+        },
     )
 
     y_month = monthly["y_true_dry_frac"].to_numpy()
@@ -941,6 +840,8 @@ def evaluate_model(
 
     model_path = out_dir / f"{model_name}_model.json"
     model.save_model(model_path.as_posix())
+    calibrators_path = out_dir / f"{model_name}_calibrators.json"
+    save_calibrators(calibrators_path, calibrators)
 
     probs_path = out_dir / f"{model_name}_test_probs.npz"
     np.savez_compressed(
@@ -1010,6 +911,7 @@ def evaluate_model(
             "Outputs:",
             f"  {monthly_path}",
             f"  {model_path}",
+            f"  {calibrators_path}",
             f"  {probs_path}",
             f"  {fi_path}",
         ]
@@ -1043,6 +945,13 @@ def evaluate_model(
     }
 
 
+def write_csv_atomic(frame: pd.DataFrame, path: Path) -> None:
+    """Write a CSV next to `path` and rename it into place, so readers never see a partial file."""
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    frame.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+
 def update_global_summary(rows: list[dict[str, object]]) -> None:
     if not rows:
         return
@@ -1056,7 +965,7 @@ def update_global_summary(rows: list[dict[str, object]]) -> None:
     else:
         combined = new
     combined = combined.sort_values(["region", "model"])
-    combined.to_csv(summary_path, index=False)
+    write_csv_atomic(combined, summary_path)
     print(f"Updated global multi-region summary: {summary_path}")
 
 
@@ -1070,7 +979,7 @@ def update_region_summary(out_dir: Path, rows: list[dict[str, object]]) -> Path:
     else:
         combined = new
     combined = combined.sort_values(["region", "model"])
-    combined.to_csv(summary_path, index=False)
+    write_csv_atomic(combined, summary_path)
     print(f"Wrote region summary: {summary_path}")
     return summary_path
 
@@ -1126,6 +1035,18 @@ def main() -> None:
     if args.list_regions:
         print(region_table())
         return
+    if args.pooled:
+        train_pooled(
+            pooled_sources(args.pooled_regions or list(REGIONS)),
+            xgb_params(args.nthread),
+            OUT_ROOT / "pooled",
+            num_boost_round=args.num_boost_round,
+            early_stopping_rounds=args.early_stopping_rounds,
+            verbose_eval=args.verbose_eval,
+            batch_rows=args.batch_rows,
+            region_weight=args.region_weight,
+        )
+        return
 
     if args.grid_stride < 1:
         raise ValueError("--grid-stride must be >= 1")
@@ -1135,17 +1056,8 @@ def main() -> None:
     base_region = resolve_region(args.region)
     source_region = base_region
     if args.grid_stride > 1:
-        source_region = replace(
-            base_region,
-            slug=f"{base_region.slug}_stride{args.grid_stride}",
-            name=f"{base_region.name} (grid-stride {args.grid_stride} smoke)",
-            rationale=(
-                base_region.rationale
-                + f" Smoke-test run using every {args.grid_stride}th CHIRPS grid cell; "
-                "do not treat as a full-region scientific result."
-            ),
-        )
-    end_year = args.end_year or latest_chirps_year()
+        source_region = stride_region(base_region, args.grid_stride)
+    end_year = args.end_year or latest_chirps_year(BASELINE_START_YEAR)
     use_canonical = base_region.slug == "cvalley" and args.grid_stride == 1 and not args.no_canonical_cvalley
     paths = region_paths(source_region, args.start_year, end_year, use_canonical)
 
@@ -1194,8 +1106,18 @@ def main() -> None:
         print(f"Mask variable: {mask_var}")
 
     if not use_canonical:
-        clip_chirps(source_region, paths["pr"], args.start_year, end_year, args.rebuild_pr, args.grid_stride)
-        make_spi_labels(paths["pr"], paths["spi"], args.rebuild_spi, args.spi_n_jobs)
+        clip_chirps(
+            source_region,
+            paths["pr"],
+            args.start_year,
+            end_year,
+            args.rebuild_pr,
+            args.grid_stride,
+            incremental=args.incremental_pr,
+        )
+        make_spi_labels(
+            paths["pr"], paths["spi"], args.rebuild_spi, args.spi_n_jobs, args.spi_memory_budget
+        )
 
     if args.prepare_grid_only:
         print("Prepare-grid-only requested; stopping before forecast dataset build.")
@@ -1211,6 +1133,7 @@ def main() -> None:
         force=args.rebuild_dataset and (not use_canonical or mask_kind is not None),
         mask_file=mask_file,
         mask_var=mask_var or "country_mask",
+        canonical=use_canonical and mask_kind is None,
     )
 
     if args.prepare_only:
@@ -1224,17 +1147,13 @@ def main() -> None:
         model_df = df
         features = get_feature_columns(model_df.columns)
         if model_name == "spatial":
-            spatial = build_spatial_feature_frame(
+            model_df = add_spatial_features(
+                model_df,
                 paths["pr"],
                 paths["spi"],
                 mask_file=mask_file,
                 mask_var=mask_var or "country_mask",
             )
-            model_df = model_df.merge(
-                spatial,
-                on=["time", "latitude", "longitude"],
-                how="left",
-            )
             missing = int(model_df[SPATIAL_FEATURES].isna().sum().sum())
             if missing:
                 print(f"Spatial features missing values: {missing:,}; filling with 0.")
@@ -1243,7 +1162,8 @@ def main() -> None:
         model_rows.append(evaluate_model(run_region, model_df, model_name, features, out_dir, args))
 
     update_region_summary(out_dir, model_rows)
-    update_global_summary(model_rows)
+    if not args.no_global_summary:
+        update_global_summary(model_rows)
     if args.copy_report:
         copy_report_artifacts(run_region, out_dir, model_rows)
 
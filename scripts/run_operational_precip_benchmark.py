@@ -29,6 +29,8 @@ import pandas as pd
 import pyarrow.parquet as pq
 from sklearn.isotonic import IsotonicRegression
 
+from bootstrap_engine import bootstrap_bss_ci
+
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 DATASET = PROJECT_ROOT / "data" / "processed" / "dataset_forecast.parquet"
@@ -113,17 +115,10 @@ def bss(y: np.ndarray, p: np.ndarray, ref: np.ndarray) -> float:
 
 
 def bootstrap_bss(monthly: pd.DataFrame, pred_col: str, n_bootstrap: int, seed: int = 42) -> tuple[float, float]:
-    rng = np.random.default_rng(seed)
-    idx = np.arange(len(monthly))
     y = monthly["y_true_dry_frac"].to_numpy(dtype=float)
     ref = monthly["clim_prob_dry"].to_numpy(dtype=float)
     pred = monthly[pred_col].to_numpy(dtype=float)
-    vals = np.empty(n_bootstrap, dtype=float)
-    for i in range(n_bootstrap):
-        sample = rng.choice(idx, size=len(idx), replace=True)
-        vals[i] = bss(y[sample], pred[sample], ref[sample])
-    lo, hi = np.nanquantile(vals, [0.025, 0.975])
-    return float(lo), float(hi)
+    return bootstrap_bss_ci(y, pred, ref, n_bootstrap, seed)
 
 
 def load_observed_monthly(
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+"""
+Run the canonical Central Valley pipeline as a DAG of content-addressed stages.
+
+Stages (see STAGES below) describe clip -> SPI -> forecast table -> train ->
+evaluate, plus the optional external downloads and ERA5 experiments. Each
+stage is keyed by a hash of its input files, parameters and code (see
+stage_cache.py), so only stages whose key changed, or whose outputs are
+missing or were modified, are rerun. A stage downstream of one that reran is
+rerun only if the rebuilt outputs changed its key. Outputs without a stage
+record are rebuilt rather than adopted, since the pipeline cannot tell what
+they were built from. Dependencies are inferred from inputs that are another
+stage's outputs. Independent stages, for example the ERA5 download and SPI
+fitting, run concurrently up to --jobs.
+
+Each stage's stdout/stderr goes to data/processed/.stage_cache/logs/<stage>.log.
+
+Usage:
+  python scripts/run_pipeline.py --dry-run          # show which stages would run
+  python scripts/run_pipeline.py --jobs 3           # run default stages
+  python scripts/run_pipeline.py evaluate           # a target and its upstream stages
+  python scripts/run_pipeline.py met_experiment --force spi
+"""
+from __future__ import annotations
+
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+from stage_cache import PROJECT_ROOT, STAMP_DIR, Stage
+
+
+SCRIPTS = PROJECT_ROOT / "scripts"
+RAW = PROJECT_ROOT / "data" / "raw" / "chirps_v3" / "monthly"
+PROCESSED = PROJECT_ROOT / "data" / "processed"
+OUTPUTS = PROJECT_ROOT / "outputs"
+LOG_DIR = STAMP_DIR / "logs"
+
+PR_FILE = PROCESSED / "chirps_v3_monthly_cvalley_1991_2026.nc"
+SPI_FILE = PROCESSED / "chirps_v3_monthly_cvalley_spi_1991_2026.nc"
+SPATIAL_FILE = PROCESSED / "chirps_v3_monthly_cvalley_spatial_features_1991_2026.nc"
+SPI_PARAMS = PROCESSED / "chirps_v3_monthly_cvalley_spi_params_1991_2020.nc"
+CLIMATE_FILE = PROCESSED / "climate_indices_monthly.csv"
+DATASET = PROCESSED / "dataset_forecast.parquet"
+CURRENT_YEAR = datetime.now(timezone.utc).year
+MET_FILE = PROCESSED / f"era5_land_met_monthly_cvalley_1991_{CURRENT_YEAR}.nc"
+# External sources publish monthly; keying downloads on the month refreshes
+# them once per month, and unchanged content leaves downstream stages fresh.
+RELEASE_MONTH = datetime.now(timezone.utc).strftime("%Y-%m")
+
+
+def _script_stage(name: str, script: str, outputs, inputs=(), args=(), params=None, default=True) -> Stage:
+    path = SCRIPTS / script
+    return Stage(
+        name=name,
+        outputs=list(outputs),
+        inputs=list(inputs),
+        params=params or {},
+        code=[path],
+        cmd=[str(path.relative_to(PROJECT_ROOT)), *args],
+        default=default,
+    )
+
+
+STAGES = [
+    _script_stage("clip", "clip_to_cvalley_monthly.py", [PR_FILE], inputs=[RAW]),
+    _script_stage("spi", "make_spi_labels.py", [SPI_FILE, SPI_PARAMS], inputs=[PR_FILE]),
+    _script_stage("spatial_features", "spatial_features.py", [SPATIAL_FILE], inputs=[PR_FILE, SPI_FILE]),
+    _script_stage(
+        "climate_indices",
+        "download_climate_indices.py",
+        [CLIMATE_FILE],
+        params={"release": RELEASE_MONTH},
+    ),
+    _script_stage(
+        "era5_met",
+        "download_era5_land_met_monthly.py",
+        [MET_FILE],
+        params={"release": RELEASE_MONTH},
+        default=False,
+    ),
+    _script_stage(
+        "forecast_table",
+        "build_dataset_forecast.py",
+        [DATASET, PROCESSED / "dataset_forecast_sample.csv"],
+        inputs=[PR_FILE, SPI_FILE, CLIMATE_FILE],
+        args=["--climate-features", "nino34"],
+    ),
+    _script_stage(
+        "train_logreg", "train_forecast_logreg.py",
+        [OUTPUTS / "forecast_logreg_model.pkl"], inputs=[DATASET],
+    ),
+    _script_stage(
+        "train_rf", "train_forecast_rf.py",
+        [OUTPUTS / "forecast_rf_model.pkl"], inputs=[DATASET],
+    ),
+    _script_stage(
+        "train_xgb", "train_forecast_xgboost.py",
+        [OUTPUTS / "forecast_xgb_model.json", OUTPUTS / "forecast_xgb_test_probs.npz"],
+        inputs=[DATASET],
+    ),
+    _script_stage(
+        "train_xgb_spatial", "train_forecast_xgb_spatial.py",
+        [
+            OUTPUTS / "xgb_spatial_model.json",
+            OUTPUTS / "xgb_spatial_test_probs.npz",
+            OUTPUTS / "xgb_spatial_val_probs.npz",
+        ],
+        inputs=[DATASET, SPATIAL_FILE],
+    ),
+    _script_stage(
+        "evaluate", "evaluate_forecast_skill.py",
+        [
+            OUTPUTS / "forecast_skill_scores.txt",
+            OUTPUTS / "forecast_skill_bss_hss_table.csv",
+            OUTPUTS / "paired_significance_matrix.csv",
+            OUTPUTS / "calib_study_results.csv",
+        ],
+        inputs=[
+            DATASET,
+            CLIMATE_FILE,
+            OUTPUTS / "forecast_xgb_test_probs.npz",
+            OUTPUTS / "forecast_xgb_model.json",
+            OUTPUTS / "forecast_logreg_model.pkl",
+            OUTPUTS / "forecast_rf_model.pkl",
+            OUTPUTS / "xgb_spatial_test_probs.npz",
+            OUTPUTS / "xgb_spatial_val_probs.npz",
+        ],
+    ),
+    _script_stage(
+        "met_experiment", "run_met_feature_experiment.py",
+        [OUTPUTS / "met_feature_xgb_experiment_scores.txt"],
+        inputs=[DATASET, MET_FILE],
+        default=False,
+    ),
+]
+
+
+def stage_graph(stages: list[Stage]) -> dict[str, set[str]]:
+    """Upstream stage names of every stage, inferred from produced/consumed paths."""
+    producer = {Path(out).resolve(): stage.name for stage in stages for out in stage.outputs}
+    return {
+        stage.name: {
+            producer[Path(p).resolve()]
+            for p in stage.inputs
+            if Path(p).resolve() in producer and producer[Path(p).resolve()] != stage.name
+        }
+        for stage in stages
+    }
+
+
+def select(stages: list[Stage], graph: dict[str, set[str]], targets: list[str]) -> list[Stage]:
+    """Targets (default stages when empty) plus all their upstream stages, in topological order."""
+    by_name = {stage.name: stage for stage in stages}
+    unknown = [t for t in targets if t not in by_name]
+    if unknown:
+        raise SystemExit(f"Unknown stage(s): {', '.join(unknown)}. Known: {', '.join(by_name)}")
+    wanted: set[str] = set()
+    todo = list(targets) or [stage.name for stage in stages if stage.default]
+    while todo:
+        name = todo.pop()
+        if name not in wanted:
+            wanted.add(name)
+            todo.extend(graph[name])
+    ordered, placed = [], set()
+    while len(ordered) < len(wanted):
+        progressed = False
+        for stage in stages:
+            if stage.name in wanted and stage.name not in placed and graph[stage.name] <= placed:
+                ordered.append(stage)
+                placed.add(stage.name)
+                progressed = True
+        if not progressed:
+            raise SystemExit("Stage graph has a cycle")
+    return ordered
+
+
+def run_stage(stage: Stage) -> tuple[int, float]:
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    with open(LOG_DIR / f"{stage.name}.log", "w") as log:
+        proc = subprocess.run(
+            [sys.executable, *stage.cmd],
+            cwd=PROJECT_ROOT,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+    return proc.returncode, time.perf_counter() - start
+
+
+def dry_run(stages: list[Stage], graph: dict[str, set[str]], force: set[str]) -> None:
+    will_run: set[str] = set()
+    for stage in stages:
+        if graph[stage.name] & will_run:
+            status = "pending (rerun if upstream output changes)"
+        elif stage.name in force:
+            status = "forced"
+        else:
+            status = stage.status()
+            if status == "legacy":
+                status = "legacy (no record; rebuild)"
+        if status != "fresh":
+            will_run.add(stage.name)
+        print(f"  {stage.name:<18} {status}")
+
+
+def execute(stages: list[Stage], graph: dict[str, set[str]], force: set[str], jobs: int) -> int:
+    pending = {stage.name: stage for stage in stages}
+    done: set[str] = set()
+    failed: set[str] = set()
+    running: dict[Future, tuple[Stage, str]] = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for name in list(pending):
+                stage = pending[name]
+                if graph[name] & failed:
+                    print(f"[{name}] skipped: upstream stage failed")
+                    failed.add(name)
+                    del pending[name]
+                    continue
+                if not graph[name] <= done:
+                    continue
+                del pending[name]
+                key = stage.key()
+                if name not in force and stage.fresh(adopt=False):
+                    print(f"[{name}] up to date")
+                    done.add(name)
+                    continue
+                print(f"[{name}] running: python {' '.join(stage.cmd)}")
+                running[pool.submit(run_stage, stage)] = (stage, key)
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, key = running.pop(future)
+                code, seconds = future.result()
+                missing = [str(p) for p in stage.outputs if not Path(p).exists()]
+                if code != 0 or missing:
+                    reason = f"exit code {code}" if code != 0 else f"missing outputs {missing}"
+                    print(f"[{stage.name}] FAILED after {seconds:.0f} s ({reason}); "
+                          f"see {LOG_DIR / (stage.name + '.log')}")
+                    failed.add(stage.name)
+                else:
+                    stage.record(key)
+                    print(f"[{stage.name}] done in {seconds:.0f} s")
+                    done.add(stage.name)
+    return 1 if failed else 0
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("targets", nargs="*", help="Stages to bring up to date (default: all default stages).")
+    parser.add_argument("--jobs", type=int, default=2, help="Maximum stages running concurrently.")
+    parser.add_argument("--force", nargs="+", default=[], help="Stages to rerun even if fresh.")
+    parser.add_argument("--dry-run", action="store_true", help="Print stage status without running anything.")
+    parser.add_argument("--list", action="store_true", help="List stages and their upstream dependencies.")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    graph = stage_graph(STAGES)
+    if args.list:
+        for stage in STAGES:
+            deps = ", ".join(sorted(graph[stage.name])) or "-"
+            print(f"  {stage.name:<18} after: {deps}{'' if stage.default else '  (optional)'}")
+        return
+    stages = select(STAGES, graph, args.targets)
+    force = set(args.force)
+    unknown = sorted(force - graph.keys())
+    if unknown:
+        raise SystemExit(f"Unknown --force stage(s): {', '.join(unknown)}. Known: {', '.join(graph)}")
+    if args.dry_run:
+        dry_run(stages, graph, force)
+        return
+    sys.exit(execute(stages, graph, force, args.jobs))
+
+
+if __name__ == "__main__":
+    main()
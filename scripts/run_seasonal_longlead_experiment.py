@@ -18,8 +18,11 @@ from sklearn.isotonic import IsotonicRegression
 from sklearn.metrics import classification_report, confusion_matrix
 from sklearn.utils.class_weight import compute_sample_weight
 
+from bootstrap_engine import bootstrap_bss_ci
 from feature_config import get_feature_columns
-from build_dataset_seasonal import _build_one
+from monthly_groups import MonthlyGroups
+from build_dataset_seasonal import CLIMATE_FILE, _build_one, spi_family_path, target_spi_map
+from stage_cache import Stage
 
 from region_config import resolve_region, region_table
 
@@ -74,7 +77,18 @@ def parse_args() -> ArgumentParser:
         default=None,
         help="Optional SPI NetCDF override (advanced).",
     )
-    parser.add_argument("--target-spi", type=int, choices=[3, 6], default=3)
+    parser.add_argument(
+        "--target-spi",
+        type=int,
+        default=3,
+        help="Target SPI window; windows other than 3/6 are read from the SPI family cube.",
+    )
+    parser.add_argument(
+        "--spi-family-file",
+        type=Path,
+        default=None,
+        help="SPI family cube from make_spi_family.py. Defaults to the *_spi_family_* file next to the SPI file.",
+    )
     parser.add_argument("--lead-months", type=int, default=3)
     parser.add_argument(
         "--climate-features",
@@ -191,17 +205,10 @@ def bootstrap_bss(
     n_bootstrap: int,
     seed: int = 42,
 ) -> tuple[float, float]:
-    rng = np.random.default_rng(seed)
-    idx = np.arange(len(monthly))
-    vals = []
     y = monthly["y_true_dry_frac"].to_numpy()
     p = monthly[pred_col].to_numpy()
     ref = monthly[ref_col].to_numpy()
-    for _ in range(n_bootstrap):
-        sample = rng.choice(idx, size=len(idx), replace=True)
-        vals.append(bss(y[sample], p[sample], ref[sample]))
-    lo, hi = np.nanquantile(vals, [0.025, 0.975])
-    return float(lo), float(hi)
+    return bootstrap_bss_ci(y, p, ref, n_bootstrap, seed)
 
 
 def _load_or_build_dataset(
@@ -211,14 +218,36 @@ def _load_or_build_dataset(
     rebuild_dataset: bool,
     pr_file: Path,
     spi_file: Path,
+    spi_family_file: Path,
     dataset_path: Path,
     mask_kind: str,
     mask_file: Path | None,
     mask_var: str | None,
     region_slug: str,
 ) -> pd.DataFrame:
-    if dataset_path.exists() and not rebuild_dataset:
-        print(f"Loading existing dataset: {dataset_path}")
+    inputs = [pr_file, spi_file]
+    if target_spi not in (3, 6):
+        inputs.append(spi_family_file)
+    if climate_features != "none":
+        inputs.append(CLIMATE_FILE)
+    if mask_file is not None:
+        inputs.append(mask_file)
+    stage = Stage(
+        name=f"seasonal_{dataset_path.parent.name}_{dataset_path.stem}",
+        outputs=[dataset_path],
+        inputs=inputs,
+        params={
+            "target_spi": target_spi,
+            "lead_months": lead_months,
+            "climate_features": climate_features,
+            "mask_kind": mask_kind,
+            "mask_var": mask_var,
+            "region": region_slug,
+        },
+        code=[Path(__file__).resolve().parent / "build_dataset_seasonal.py"],
+    )
+    if not rebuild_dataset and stage.fresh():
+        print(f"Loading up-to-date dataset: {dataset_path}")
         df = pd.read_parquet(dataset_path)
         df["time"] = pd.to_datetime(df["time"])
         df["target_time"] = pd.to_datetime(df["target_time"])
@@ -242,7 +271,13 @@ def _load_or_build_dataset(
     spi1 = spi_ds["spi1"].sel(time=pr.time)
     spi3 = spi_ds["spi3"].sel(time=pr.time)
     spi6 = spi_ds["spi6"].sel(time=pr.time)
-    spi_target = spi3 if target_spi == 3 else spi6
+    spi_map = target_spi_map(spi_ds, spi_family_file)
+    if target_spi not in spi_map:
+        raise FileNotFoundError(
+            f"SPI-{target_spi} is not in {spi_file} and no family cube provides it; "
+            f"run scripts/make_spi_family.py to create {spi_family_file}."
+        )
+    spi_target = spi_map[target_spi].sel(time=pr.time)
 
     mask = load_mask(mask_kind, region_slug, pr, mask_file=mask_file, mask_var=mask_var)
     if mask is not None:
@@ -268,6 +303,7 @@ def _load_or_build_dataset(
     df.to_parquet(dataset_path, index=False)
     df.head(10000).to_csv(dataset_path.with_suffix(".sample.csv"), index=False)
     print(f"Wrote: {dataset_path} rows={len(df):,}")
+    stage.record()
     return df
 
 
@@ -371,16 +407,15 @@ def run_experiment(
     test["xgb_cal_prob_dry"] = probs_cal[:, LABEL_MAP[-1]]
     test["persistence_prob_dry"] = (test[persistence_feature] <= -1.0).astype(float)
 
-    monthly = (
-        test.groupby("target_time")
-        .agg(
-            y_true_dry_frac=("is_dry", "mean"),
-            xgb_prob_dry=("xgb_prob_dry", "mean"),
-            xgb_cal_prob_dry=("xgb_cal_prob_dry", "mean"),
-            clim_prob_dry=("clim_prob_dry", "mean"),
-            persistence_prob_dry=("persistence_prob_dry", "mean"),
-        )
-        .reset_index()
+    monthly = MonthlyGroups.from_frame(test).aggregate(
+        test,
+        {
+            "y_true_dry_frac": "is_dry",
+            "xgb_prob_dry": "xgb_prob_dry",
+            "xgb_cal_prob_dry": "xgb_cal_prob_dry",
+            "clim_prob_dry": "clim_prob_dry",
+            "persistence_prob_dry": "persistence_prob_dry",
+        },
     )
 
     bs_clim = brier(monthly["y_true_dry_frac"].to_numpy(), monthly["clim_prob_dry"].to_numpy())
@@ -511,6 +546,7 @@ def main() -> None:
         rebuild_dataset=args.rebuild_dataset,
         pr_file=pr_file,
         spi_file=spi_file,
+        spi_family_file=args.spi_family_file or spi_family_path(spi_file),
         dataset_path=dataset_path,
         mask_kind=args.mask_kind,
         mask_file=args.mask_file,
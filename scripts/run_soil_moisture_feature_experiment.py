@@ -30,7 +30,10 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import classification_report, confusion_matrix
 from sklearn.utils.class_weight import compute_sample_weight
 
+from bootstrap_engine import bootstrap_bss_ci
 from feature_config import get_feature_columns
+from grid_registry import month_index, month_positions
+from monthly_groups import MonthlyGroups, monthly_brier_scores, target_month
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
@@ -199,7 +202,13 @@ def build_dataset() -> pd.DataFrame:
     df = pd.read_parquet(DATA)
     df["time"] = pd.to_datetime(df["time"]).dt.to_period("M").dt.to_timestamp()
     soil = build_soil_monthly_features()
-    out = df.merge(soil, on="time", how="left")
+    # Region-mean series: one value per month, gathered by month_index.
+    months = df["month_index"].to_numpy() if "month_index" in df.columns else month_index(df["time"].to_numpy())
+    pos = month_positions(month_index(soil["time"].to_numpy()), months)
+    out = df.assign(**{
+        col: np.where(pos >= 0, soil[col].to_numpy()[np.maximum(pos, 0)], np.nan)
+        for col in SOIL_FEATURES
+    })
     missing = int(out[SOIL_FEATURES].isna().any(axis=1).sum())
     if missing:
         print(f"Rows with missing soil features before dropna: {missing:,}")
@@ -226,33 +235,10 @@ def bootstrap_bss(
     n_bootstrap: int,
     seed: int = 42,
 ) -> tuple[float, float]:
-    rng = np.random.default_rng(seed)
-    idx = np.arange(len(monthly))
-    vals = []
     y = monthly["y_true_dry_frac"].to_numpy()
     p = monthly[pred_col].to_numpy()
     ref = monthly[ref_col].to_numpy()
-    for _ in range(n_bootstrap):
-        sample = rng.choice(idx, size=len(idx), replace=True)
-        vals.append(bss(y[sample], p[sample], ref[sample]))
-    lo, hi = np.nanquantile(vals, [0.025, 0.975])
-    return float(lo), float(hi)
-
-
-def target_month(series: pd.Series) -> pd.Series:
-    return (pd.to_datetime(series) + pd.DateOffset(months=1)).dt.to_period("M").dt.to_timestamp()
-
-
-def monthly_bs(frame: pd.DataFrame, prob_col: str) -> float:
-    monthly = (
-        frame.groupby("target_time")
-        .agg(
-            y_true_dry_frac=("is_dry", "mean"),
-            pred_prob_dry=(prob_col, "mean"),
-        )
-        .reset_index()
-    )
-    return brier(monthly["y_true_dry_frac"].to_numpy(), monthly["pred_prob_dry"].to_numpy())
+    return bootstrap_bss_ci(y, p, ref, n_bootstrap, seed)
 
 
 def run_experiment(df: pd.DataFrame, n_bootstrap: int) -> None:
@@ -355,22 +341,21 @@ def run_experiment(df: pd.DataFrame, n_bootstrap: int) -> None:
         "isotonic": "xgb_isotonic_prob_dry",
         "platt": "xgb_platt_prob_dry",
     }
-    val_bs_by_method = {method: monthly_bs(val, col) for method, col in calibration_cols.items()}
+    val_bs_by_method = monthly_brier_scores(MonthlyGroups.from_frame(val), val, calibration_cols)
     best_method = min(val_bs_by_method, key=val_bs_by_method.get)
     best_col = calibration_cols[best_method]
     test["xgb_selected_prob_dry"] = test[best_col]
 
-    monthly = (
-        test.groupby("target_time")
-        .agg(
-            y_true_dry_frac=("is_dry", "mean"),
-            xgb_raw_prob_dry=("xgb_raw_prob_dry", "mean"),
-            xgb_isotonic_prob_dry=("xgb_isotonic_prob_dry", "mean"),
-            xgb_platt_prob_dry=("xgb_platt_prob_dry", "mean"),
-            xgb_selected_prob_dry=("xgb_selected_prob_dry", "mean"),
-            clim_prob_dry=("clim_prob_dry", "mean"),
-        )
-        .reset_index()
+    monthly = MonthlyGroups.from_frame(test).aggregate(
+        test,
+        {
+            "y_true_dry_frac": "is_dry",
+            "xgb_raw_prob_dry": "xgb_raw_prob_dry",
+            "xgb_isotonic_prob_dry": "xgb_isotonic_prob_dry",
+            "xgb_platt_prob_dry": "xgb_platt_prob_dry",
+            "xgb_selected_prob_dry": "xgb_selected_prob_dry",
+            "clim_prob_dry": "clim_prob_dry",
+        },
     )
 
     y = monthly["y_true_dry_frac"].to_numpy()
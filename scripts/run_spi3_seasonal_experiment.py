@@ -36,7 +36,9 @@ from sklearn.isotonic import IsotonicRegression
 from sklearn.metrics import classification_report, confusion_matrix
 from sklearn.utils.class_weight import compute_sample_weight
 
+from bootstrap_engine import bootstrap_bss_ci
 from feature_config import get_feature_columns
+from monthly_groups import MonthlyGroups, target_month
 
 PROCESSED = Path("data/processed")
 OUT_DIR = Path("outputs")
@@ -181,8 +183,7 @@ def build_dataset(lead_months: int, climate_features: str, out_path: Path) -> pd
     df = df.dropna(subset=[TARGET, "target_spi3"] + feat_cols + exog_cols).copy()
     print(f"Dropped rows with missing feature/target values: {before - len(df):,}")
 
-    target_time = pd.to_datetime(df["time"]) + pd.DateOffset(months=lead_months)
-    df["target_time"] = target_time.dt.to_period("M").dt.to_timestamp()
+    df["target_time"] = target_month(df["time"], lead_months)
     df["month"] = df["target_time"].dt.month
     df["year"] = df["target_time"].dt.year
     df["month_sin"] = np.sin(2 * np.pi * df["month"] / 12.0)
@@ -225,17 +226,10 @@ def bootstrap_bss(
     n_bootstrap: int,
     seed: int = 42,
 ) -> tuple[float, float]:
-    rng = np.random.default_rng(seed)
-    idx = np.arange(len(monthly))
-    vals = []
     y = monthly["y_true_dry_frac"].to_numpy()
     p = monthly[pred_col].to_numpy()
     ref = monthly[ref_col].to_numpy()
-    for _ in range(n_bootstrap):
-        sample = rng.choice(idx, size=len(idx), replace=True)
-        vals.append(bss(y[sample], p[sample], ref[sample]))
-    lo, hi = np.nanquantile(vals, [0.025, 0.975])
-    return float(lo), float(hi)
+    return bootstrap_bss_ci(y, p, ref, n_bootstrap, seed)
 
 
 def run_experiment(df: pd.DataFrame, lead_months: int, n_bootstrap: int) -> None:
@@ -320,16 +314,15 @@ def run_experiment(df: pd.DataFrame, lead_months: int, n_bootstrap: int) -> None
     test["xgb_cal_prob_dry"] = probs_cal[:, LABEL_MAP[-1]]
     test["persistence_prob_dry"] = (test["spi3_lag1"] <= -1.0).astype(float)
 
-    monthly = (
-        test.groupby("target_time")
-        .agg(
-            y_true_dry_frac=("is_dry", "mean"),
-            xgb_prob_dry=("xgb_prob_dry", "mean"),
-            xgb_cal_prob_dry=("xgb_cal_prob_dry", "mean"),
-            clim_prob_dry=("clim_prob_dry", "mean"),
-            persistence_prob_dry=("persistence_prob_dry", "mean"),
-        )
-        .reset_index()
+    monthly = MonthlyGroups.from_frame(test).aggregate(
+        test,
+        {
+            "y_true_dry_frac": "is_dry",
+            "xgb_prob_dry": "xgb_prob_dry",
+            "xgb_cal_prob_dry": "xgb_cal_prob_dry",
+            "clim_prob_dry": "clim_prob_dry",
+            "persistence_prob_dry": "persistence_prob_dry",
+        },
     )
 
     bs_clim = brier(monthly["y_true_dry_frac"].to_numpy(), monthly["clim_prob_dry"].to_numpy())
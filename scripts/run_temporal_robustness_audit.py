@@ -22,11 +22,15 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 import xgboost as xgb
-from sklearn.isotonic import IsotonicRegression
-from sklearn.linear_model import LogisticRegression
+from joblib import Parallel, delayed
 from sklearn.utils.class_weight import compute_sample_weight
 
+from bootstrap_engine import bootstrap_bss_ci
+from calibration import Calibrator, fit_calibrators
+from dataset_loader import dataset_columns, load_split
 from feature_config import get_feature_columns
+from monthly_groups import MonthlyGroups
+from shared_table import SharedTable, frame_of, year_rows
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
@@ -59,6 +63,12 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--max-depth", type=int, default=6)
     parser.add_argument("--eta", type=float, default=0.05)
     parser.add_argument("--nthread", type=int, default=0)
+    parser.add_argument(
+        "--n-jobs",
+        type=int,
+        default=1,
+        help="Splits trained in parallel; >1 shares the table with the workers via shared memory.",
+    )
     parser.add_argument(
         "--max-train-rows",
         type=int,
@@ -99,13 +109,7 @@ def bootstrap_bss(
     n_bootstrap: int,
     seed: int,
 ) -> tuple[float, float]:
-    rng = np.random.default_rng(seed)
-    n = len(y)
-    vals = np.empty(n_bootstrap, dtype=float)
-    for i in range(n_bootstrap):
-        idx = rng.integers(0, n, size=n)
-        vals[i] = bss(y[idx], p[idx], ref[idx])
-    return float(np.nanpercentile(vals, 2.5)), float(np.nanpercentile(vals, 97.5))
+    return bootstrap_bss_ci(y, p, ref, n_bootstrap, seed)
 
 
 def safe_corr(a: pd.Series, b: pd.Series) -> float:
@@ -122,21 +126,28 @@ def amplitude_ratio(obs: pd.Series, pred: pd.Series) -> float:
 
 
 def add_target_time(df: pd.DataFrame) -> pd.DataFrame:
-    out = df.copy()
-    out["time"] = pd.to_datetime(out["time"])
-    out["target_time"] = out["time"] + pd.DateOffset(months=1)
-    out["target_year"] = out["target_time"].dt.year.astype(int)
-    out["target_month"] = out["target_time"].dt.month.astype(int)
-    return out
+    time = pd.to_datetime(df["time"])
+    target_time = time + pd.DateOffset(months=1)
+    return df.assign(
+        time=time,
+        target_time=target_time,
+        target_year=target_time.dt.year.astype(int),
+        target_month=target_time.dt.month.astype(int),
+    )
 
 
 def monthly_observed_from_pixels(df: pd.DataFrame) -> pd.DataFrame:
-    tmp = df[["target_time", "target_year", "target_month", TARGET]].copy()
-    tmp["is_dry"] = (tmp[TARGET] == -1).astype(float)
-    return (
-        tmp.groupby(["target_time", "target_year", "target_month"], as_index=False)
-        .agg(obs_dry_frac=("is_dry", "mean"), n_pixels=("is_dry", "size"))
-        .sort_values("target_time")
+    groups = MonthlyGroups.from_frame(df)
+    is_dry = (df[TARGET].to_numpy() == -1).astype(float)
+    months = pd.DatetimeIndex(groups.months)
+    return pd.DataFrame(
+        {
+            "target_time": months,
+            "target_year": months.year.astype(int),
+            "target_month": months.month.astype(int),
+            "obs_dry_frac": groups.means(is_dry),
+            "n_pixels": groups.counts,
+        }
     )
 
 
@@ -192,9 +203,9 @@ def attach_climatology_references(
 
 
 def split_frame(df: pd.DataFrame, spec: SplitSpec) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    train = df[df["target_year"] <= spec.train_end].copy()
-    val = df[(df["target_year"] >= spec.val_start) & (df["target_year"] <= spec.val_end)].copy()
-    test = df[(df["target_year"] >= spec.test_start) & (df["target_year"] <= spec.test_end)].copy()
+    train = year_rows(df, "target_year", None, spec.train_end)
+    val = year_rows(df, "target_year", spec.val_start, spec.val_end)
+    test = year_rows(df, "target_year", spec.test_start, spec.test_end)
     return train, val, test
 
 
@@ -224,56 +235,36 @@ def xgb_params(args: argparse.Namespace) -> dict[str, object]:
     return params
 
 
-def fit_calibrators(
-    val_raw: np.ndarray,
-    y_val_dry: np.ndarray,
-    test_raw: np.ndarray,
-) -> dict[str, np.ndarray]:
-    preds = {"none": test_raw.clip(0.0, 1.0)}
-
-    iso = IsotonicRegression(out_of_bounds="clip")
-    iso.fit(val_raw, y_val_dry)
-    preds["isotonic"] = iso.predict(test_raw).clip(0.0, 1.0)
-
-    platt = LogisticRegression(solver="lbfgs")
-    platt.fit(val_raw.reshape(-1, 1), y_val_dry)
-    preds["platt"] = platt.predict_proba(test_raw.reshape(-1, 1))[:, 1].clip(0.0, 1.0)
+def calibrated_probs(calibrators: dict[str, Calibrator], raw: np.ndarray) -> dict[str, np.ndarray]:
+    preds = {"none": raw.clip(0.0, 1.0)}
+    for method, calibrator in calibrators.items():
+        preds[method] = calibrator.predict(raw).clip(0.0, 1.0)
     return preds
 
 
 def select_calibration(
     val: pd.DataFrame,
-    val_raw: np.ndarray,
+    candidates: dict[str, np.ndarray],
     y_val_dry: np.ndarray,
 ) -> tuple[str, dict[str, float]]:
-    candidates: dict[str, np.ndarray] = {"none": val_raw.clip(0.0, 1.0)}
-    iso = IsotonicRegression(out_of_bounds="clip")
-    iso.fit(val_raw, y_val_dry)
-    candidates["isotonic"] = iso.predict(val_raw).clip(0.0, 1.0)
-    platt = LogisticRegression(solver="lbfgs")
-    platt.fit(val_raw.reshape(-1, 1), y_val_dry)
-    candidates["platt"] = platt.predict_proba(val_raw.reshape(-1, 1))[:, 1].clip(0.0, 1.0)
-
-    tmp = val[["target_time", TARGET]].copy()
-    tmp["obs"] = y_val_dry
-    scores: dict[str, float] = {}
-    obs_monthly = tmp.groupby("target_time")["obs"].mean()
-    for method, pred in candidates.items():
-        tmp[method] = pred
-        pred_monthly = tmp.groupby("target_time")[method].mean().reindex(obs_monthly.index)
-        scores[method] = brier_score(obs_monthly.to_numpy(), pred_monthly.to_numpy())
+    monthly = MonthlyGroups.from_frame(val).means(np.column_stack([y_val_dry, *candidates.values()]))
+    scores = {
+        method: brier_score(monthly[:, 0], monthly[:, i + 1]) for i, method in enumerate(candidates)
+    }
     best = min(scores, key=scores.get)
     return best, scores
 
 
 def run_split(
-    df: pd.DataFrame,
+    df: pd.DataFrame | SharedTable,
     monthly_all: pd.DataFrame,
     spec: SplitSpec,
     features: list[str],
     args: argparse.Namespace,
     split_idx: int,
 ) -> tuple[pd.DataFrame, list[dict[str, object]]]:
+    # Parallel workers get a SharedTable view instead of a pickled copy.
+    df = frame_of(df)
     train, val, test = split_frame(df, spec)
     if train.empty or val.empty or test.empty:
         raise ValueError(f"Empty split {spec}: train={train.shape}, val={val.shape}, test={test.shape}")
@@ -312,23 +303,25 @@ def run_split(
     test_raw = test_probs[:, DRY_IDX]
     y_val_dry = (val[TARGET].to_numpy() == -1).astype(int)
 
-    best_calibration, val_bs = select_calibration(val, val_raw, y_val_dry)
-    calibrated = fit_calibrators(val_raw, y_val_dry, test_raw)
-
-    test_monthly = test[["target_time", "target_year", "target_month", TARGET]].copy()
-    test_monthly["obs"] = (test_monthly[TARGET] == -1).astype(float)
-    for method, pred in calibrated.items():
-        test_monthly[f"prob_{method}"] = pred
-    monthly = (
-        test_monthly.groupby(["target_time", "target_year", "target_month"], as_index=False)
-        .agg(
-            obs_dry_frac=("obs", "mean"),
-            xgb_raw_prob_dry=("prob_none", "mean"),
-            xgb_isotonic_prob_dry=("prob_isotonic", "mean"),
-            xgb_platt_prob_dry=("prob_platt", "mean"),
-            n_pixels=("obs", "size"),
-        )
-        .sort_values("target_time")
+    calibrators = fit_calibrators(val_raw, y_val_dry)
+    best_calibration, val_bs = select_calibration(val, calibrated_probs(calibrators, val_raw), y_val_dry)
+    calibrated = calibrated_probs(calibrators, test_raw)
+
+    groups = MonthlyGroups.from_frame(test)
+    obs = (test[TARGET].to_numpy() == -1).astype(float)
+    means = groups.means(np.column_stack([obs, calibrated["none"], calibrated["isotonic"], calibrated["platt"]]))
+    months = pd.DatetimeIndex(groups.months)
+    monthly = pd.DataFrame(
+        {
+            "target_time": months,
+            "target_year": months.year.astype(int),
+            "target_month": months.month.astype(int),
+            "obs_dry_frac": means[:, 0],
+            "xgb_raw_prob_dry": means[:, 1],
+            "xgb_isotonic_prob_dry": means[:, 2],
+            "xgb_platt_prob_dry": means[:, 3],
+            "n_pixels": groups.counts,
+        }
     )
     monthly["selected_calibration"] = best_calibration
     monthly["xgb_selected_prob_dry"] = monthly[f"xgb_{best_calibration if best_calibration != 'none' else 'raw'}_prob_dry"]
@@ -483,15 +476,24 @@ def main() -> None:
     args.out_dir.mkdir(parents=True, exist_ok=True)
 
     print(f"Loading {args.dataset}")
-    df = pd.read_parquet(args.dataset)
+    features = get_feature_columns(dataset_columns(args.dataset))
+    # Rolling splits need every year, but only the audit columns are read.
+    df = load_split("all", features, path=args.dataset, columns=["time", "latitude", "longitude"])
     df = add_target_time(df)
-    features = get_feature_columns(df.columns)
     monthly_all = monthly_observed_from_pixels(df)
 
     monthly_outputs: list[pd.DataFrame] = []
     summary_rows: list[dict[str, object]] = []
-    for i, spec in enumerate(default_splits()):
-        monthly, rows = run_split(df, monthly_all, spec, features, args, i)
+    if args.n_jobs > 1:
+        with SharedTable.create(df) as table:
+            print(f"Shared {table.nbytes / 2**20:,.0f} MiB table with {args.n_jobs} workers")
+            results = Parallel(n_jobs=args.n_jobs)(
+                delayed(run_split)(table, monthly_all, spec, features, args, i)
+                for i, spec in enumerate(default_splits())
+            )
+    else:
+        results = [run_split(df, monthly_all, spec, features, args, i) for i, spec in enumerate(default_splits())]
+    for monthly, rows in results:
         monthly_outputs.append(monthly)
         summary_rows.extend(rows)
 
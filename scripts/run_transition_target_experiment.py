@@ -40,7 +40,9 @@ import xgboost as xgb
 from sklearn.isotonic import IsotonicRegression
 from sklearn.utils.class_weight import compute_sample_weight
 
+from bootstrap_engine import bootstrap_bss_ci
 from feature_config import get_feature_columns
+from monthly_groups import MonthlyGroups, target_month
 
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
@@ -153,17 +155,10 @@ def bootstrap_bss(
     n_bootstrap: int,
     seed: int,
 ) -> tuple[float, float]:
-    rng = np.random.default_rng(seed)
-    idx = np.arange(len(monthly))
     y = monthly["y_true_event_frac"].to_numpy(dtype=float)
     p = monthly[pred_col].to_numpy(dtype=float)
     ref = monthly[ref_col].to_numpy(dtype=float)
-    vals = np.empty(n_bootstrap, dtype=float)
-    for i in range(n_bootstrap):
-        sample = rng.choice(idx, size=len(idx), replace=True)
-        vals[i] = bss(y[sample], p[sample], ref[sample])
-    lo, hi = np.nanquantile(vals, [0.025, 0.975])
-    return float(lo), float(hi)
+    return bootstrap_bss_ci(y, p, ref, n_bootstrap, seed)
 
 
 def bootstrap_bss_arrays(
@@ -173,14 +168,7 @@ def bootstrap_bss_arrays(
     n_bootstrap: int,
     seed: int,
 ) -> tuple[float, float]:
-    rng = np.random.default_rng(seed)
-    idx = np.arange(len(y))
-    vals = np.empty(n_bootstrap, dtype=float)
-    for i in range(n_bootstrap):
-        sample = rng.choice(idx, size=len(idx), replace=True)
-        vals[i] = bss(y[sample], p[sample], ref[sample])
-    lo, hi = np.nanquantile(vals, [0.025, 0.975])
-    return float(lo), float(hi)
+    return bootstrap_bss_ci(y, p, ref, n_bootstrap, seed)
 
 
 def amplitude_ratio(y: pd.Series, p: pd.Series) -> float:
@@ -219,20 +207,14 @@ def aggregate_monthly(
     frame: pd.DataFrame,
     pred_cols: dict[str, str],
     ref_col: str,
+    groups: MonthlyGroups | None = None,
 ) -> pd.DataFrame:
-    agg: dict[str, tuple[str, str]] = {
-        "y_true_event_frac": ("event", "mean"),
-        "n_pixels": ("event", "size"),
-        "reference_prob_event": (ref_col, "mean"),
-    }
-    for out_col, source_col in pred_cols.items():
-        agg[out_col] = (source_col, "mean")
-    return (
-        frame.groupby("target_time", observed=True)
-        .agg(**agg)
-        .reset_index()
-        .sort_values("target_time")
-    )
+    if groups is None:
+        groups = MonthlyGroups.from_frame(frame)
+    columns = {"y_true_event_frac": "event", "reference_prob_event": ref_col, **pred_cols}
+    monthly = groups.aggregate(frame, columns)
+    monthly.insert(2, "n_pixels", groups.counts)
+    return monthly
 
 
 def score_line(
@@ -332,7 +314,7 @@ def main() -> None:
 
     # Align a canonical target-month timestamp for monthly aggregation.
     df["time"] = pd.to_datetime(df["time"]).dt.to_period("M").dt.to_timestamp()
-    df["target_time"] = (df["time"] + pd.DateOffset(months=1)).dt.to_period("M").dt.to_timestamp()
+    df["target_time"] = target_month(df["time"])
 
     df = build_transition_labels(df, args.transition)
 
@@ -406,17 +388,15 @@ def main() -> None:
 
     test = add_climatology_baselines(train=train, test=test, kind=args.transition)
 
-    monthly = (
-        test.groupby("target_time", observed=True)
-        .agg(
-            y_true_event_frac=("event", "mean"),
-            xgb_prob_event=("xgb_prob_event", "mean"),
-            xgb_cal_prob_event=("xgb_cal_prob_event", "mean"),
-            clim_prob_event=("clim_prob_event", "mean"),
-            clim_cond_prob_event=("clim_cond_prob_event", "mean"),
-        )
-        .reset_index()
-        .sort_values("target_time")
+    monthly = MonthlyGroups.from_frame(test).aggregate(
+        test,
+        {
+            "y_true_event_frac": "event",
+            "xgb_prob_event": "xgb_prob_event",
+            "xgb_cal_prob_event": "xgb_cal_prob_event",
+            "clim_prob_event": "clim_prob_event",
+            "clim_cond_prob_event": "clim_cond_prob_event",
+        },
     )
 
     # Scores
@@ -472,6 +452,7 @@ def main() -> None:
     val_eligible = val.loc[val["eligible"].astype(bool)].copy()
     test_eligible = test.loc[test["eligible"].astype(bool)].copy()
     test_eligible = add_eligible_climatology(train_eligible, test_eligible)
+    eligible_groups = MonthlyGroups.from_frame(test_eligible)
 
     eligible_monthly_existing = aggregate_monthly(
         test_eligible,
@@ -480,6 +461,7 @@ def main() -> None:
             "xgb_cal_prob_event": "xgb_cal_prob_event",
         },
         ref_col="eligible_clim_prob_event",
+        groups=eligible_groups,
     )
 
     if train_eligible["event"].nunique() < 2 or val_eligible["event"].nunique() < 2:
@@ -541,6 +523,7 @@ def main() -> None:
             "conditional_xgb_cal_prob_event": "conditional_xgb_cal_prob_event",
         },
         ref_col="eligible_clim_prob_event",
+        groups=eligible_groups,
     )
     eligible_monthly = eligible_monthly_existing.merge(
         eligible_monthly_conditional[
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""
+Zero-copy shared-memory forecast tables for experiment variants run in parallel.
+
+Each experiment driver (evaluation-inflation scenarios, temporal-robustness
+splits, memory-target variants) held its own copy of the forecast table. It
+then copied it again with df.copy() and with a boolean-mask copy per split.
+Running variants in joblib workers made this worse: the whole frame was
+pickled to every worker.
+
+SharedTable writes the table's columns once into memory-mapped files under
+/dev/shm (the system temp directory when /dev/shm is missing), one file per
+column, as spi_blocks.spi_family_shared() does for SPI cubes. The handle
+itself is just the directory and the column dtypes, so pickling it to a
+worker costs a few hundred bytes. In the worker, frame() attaches read-only
+memory maps and wraps them in a DataFrame without copying. All workers share
+the same page-cache pages.
+
+year_rows() selects a year range as a positional slice when the year column
+is sorted. Forecast tables are written one row group per target year, so
+they are. A chronological split is then a view, not a copy. With pandas
+copy-on-write, columns added to a split are private to it and the shared
+columns are never written.
+
+  with SharedTable.create(df) as table:
+      results = Parallel(n_jobs=4)(delayed(run_variant)(table, v) for v in variants)
+
+  python scripts/shared_table.py --benchmark
+"""
+from __future__ import annotations
+
+from argparse import ArgumentParser, Namespace
+from collections.abc import Sequence
+from dataclasses import dataclass
+from pathlib import Path
+import pickle
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+
+SHARED_DIR = Path("/dev/shm") if Path("/dev/shm").is_dir() else Path(tempfile.gettempdir())
+
+
+def year_rows(frame: pd.DataFrame, col: str, first: int | None = None, last: int | None = None) -> pd.DataFrame:
+    """Rows with first <= frame[col] <= last; a positional view when the column is sorted."""
+    values = frame[col].to_numpy()
+    if len(values) and bool(np.all(values[1:] >= values[:-1])):
+        start = 0 if first is None else int(np.searchsorted(values, first, side="left"))
+        stop = len(values) if last is None else int(np.searchsorted(values, last, side="right"))
+        return frame.iloc[start:stop]
+    mask = np.ones(len(values), dtype=bool)
+    if first is not None:
+        mask &= values >= first
+    if last is not None:
+        mask &= values <= last
+    return frame[mask]
+
+
+@dataclass(frozen=True)
+class SharedTable:
+    """Picklable handle to a table's columns in shared memory-mapped files."""
+
+    root: str
+    schema: tuple[tuple[str, str], ...]   # (column, numpy dtype str), in file order
+    n_rows: int
+
+    @classmethod
+    def create(cls, frame: pd.DataFrame, columns: Sequence[str] | None = None, prefix: str = "table_") -> "SharedTable":
+        """
+        Copy columns of `frame` into shared memory once.
+
+        By default every numeric, boolean and datetime column is shared; object
+        and extension-typed columns are left out, since they have no flat
+        buffer to map.
+        """
+        if len(frame) == 0:
+            raise ValueError("Cannot share an empty table.")
+        if columns is None:
+            columns = [
+                col for col in frame.columns
+                if isinstance(frame[col].dtype, np.dtype) and frame[col].dtype.kind in "biufM"
+            ]
+            skipped = [col for col in frame.columns if col not in columns]
+            if skipped:
+                print(f"[shared_table] not sharing non-numeric columns: {skipped}")
+        root = Path(tempfile.mkdtemp(prefix=prefix, dir=SHARED_DIR))
+        schema = []
+        try:
+            for i, col in enumerate(columns):
+                values = frame[col].to_numpy()
+                if values.dtype.kind not in "biufM":
+                    raise TypeError(f"Column {col!r} has dtype {values.dtype}; only numeric and datetime columns can be shared.")
+                out = np.memmap(root / f"{i}.dat", dtype=values.dtype, mode="w+", shape=values.shape)
+                out[:] = values
+                out.flush()
+                del out
+                schema.append((str(col), values.dtype.str))
+        except BaseException:
+            shutil.rmtree(root, ignore_errors=True)
+            raise
+        return cls(str(root), tuple(schema), len(frame))
+
+    @property
+    def columns(self) -> list[str]:
+        return [col for col, _ in self.schema]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(np.dtype(dtype).itemsize for _, dtype in self.schema) * self.n_rows
+
+    def array(self, col: str) -> np.ndarray:
+        """Read-only memory map of one column."""
+        for i, (name, dtype) in enumerate(self.schema):
+            if name == col:
+                return np.memmap(Path(self.root) / f"{i}.dat", dtype=np.dtype(dtype), mode="r", shape=(self.n_rows,))
+        raise KeyError(col)
+
+    def frame(self, columns: Sequence[str] | None = None) -> pd.DataFrame:
+        """DataFrame over the shared columns, without copying them."""
+        return pd.DataFrame({col: self.array(col) for col in (columns or self.columns)}, copy=False)
+
+    def unlink(self) -> None:
+        """Remove the shared files; only the process that created the table should call this."""
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def __enter__(self) -> "SharedTable":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.unlink()
+
+
+def frame_of(table: pd.DataFrame | SharedTable) -> pd.DataFrame:
+    """The frame itself, or a zero-copy view of a SharedTable."""
+    return table.frame() if isinstance(table, SharedTable) else table
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Time parallel split statistics with the frame pickled to workers vs a shared table.",
+    )
+    parser.add_argument("--n-rows", type=int, default=4_000_000)
+    parser.add_argument("--n-jobs", type=int, default=4)
+    return parser.parse_args()
+
+
+def _split_means(table: pd.DataFrame | SharedTable, last_train_year: int) -> float:
+    frame = frame_of(table)
+    train = year_rows(frame, "year", None, last_train_year)
+    test = year_rows(frame, "year", last_train_year + 1, None)
+    return float(train["spi1_lag1"].mean() - test["spi1_lag1"].mean())
+
+
+def benchmark(n_rows: int, n_jobs: int) -> None:
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({"year": np.sort(rng.integers(1991, 2026, n_rows)).astype(np.int32)})
+    for i in range(12):
+        frame[f"f{i}"] = rng.normal(size=n_rows).astype(np.float32)
+    frame["spi1_lag1"] = frame["f0"]
+    frame["time"] = pd.to_datetime(frame["year"].astype(str) + "-01-01")
+    variants = list(range(2008, 2008 + 2 * n_jobs))
+    print(f"Table: {n_rows:,} rows, {frame.memory_usage(deep=True).sum() / 2**20:,.0f} MiB; "
+          f"{len(variants)} variants on {n_jobs} workers")
+
+    Parallel(n_jobs=n_jobs)(delayed(int)(0) for _ in range(n_jobs))   # start the workers first
+    start = time.perf_counter()
+    legacy = Parallel(n_jobs=n_jobs)(delayed(_split_means)(frame, year) for year in variants)
+    legacy_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with SharedTable.create(frame) as table:
+        create_s = time.perf_counter() - start
+        shared = Parallel(n_jobs=n_jobs)(delayed(_split_means)(table, year) for year in variants)
+        handle_bytes = len(pickle.dumps(table))
+    shared_s = time.perf_counter() - start
+
+    print(f"frame pickled to workers: {legacy_s:.2f} s ({len(pickle.dumps(frame)) / 2**20:,.0f} MiB per task)")
+    print(f"shared table:             {shared_s:.2f} s (create {create_s:.2f} s; handle {handle_bytes} bytes per task)")
+    print(f"results identical: {np.allclose(legacy, shared)}")
+
+
+def main() -> None:
+    args = parse_args()
+    if args.benchmark:
+        benchmark(args.n_rows, args.n_jobs)
+    else:
+        print("Nothing to do; pass --benchmark, or import SharedTable.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+"""
+Multi-scale neighbourhood features from summed-area tables, cached as one cube.
+
+The spatial XGBoost model, the SHAP analysis, the multi-region runner and the
+gridded-met experiment each recomputed the 3×3 neighbourhood mean of SPI-1/3/6
+and precipitation with xarray rolling(min_periods=1, center=True).mean().
+This module builds one summed-area table (integral image) of the values and
+one of the finite-value counts for every month at once. Any box sum is then
+four lookups, so each radius costs O(1) per pixel regardless of its size.
+
+Features per source variable (pr, spi1, spi3, spi6) and window (3, 5, 9, 15):
+  <var>_nbr<w>_mean  NaN-aware box mean; edge boxes are truncated to the grid,
+                     matching rolling(min_periods=1, center=True)
+  <var>_nbr<w>_anom  pixel value minus the box mean
+  <var>_nbr<w>_dlat  d(box mean)/d(latitude), per degree
+  <var>_nbr<w>_dlon  d(box mean)/d(longitude), per degree
+The 3×3 names drop the window, so spi1_nbr_mean etc. keep their old meaning.
+
+The cube is written once per (pr, SPI, mask) combination and keyed by a stage
+record (stage_cache.py). Consumers call ensure_feature_cube() and add_features(),
+which gathers only the variables they need by pixel_id/month_index.
+
+Input:
+  data/processed/chirps_v3_monthly_cvalley_1991_2026.nc
+  data/processed/chirps_v3_monthly_cvalley_spi_1991_2026.nc
+
+Output:
+  data/processed/chirps_v3_monthly_cvalley_spatial_features_1991_2026.nc
+
+Usage:
+  python scripts/spatial_features.py
+  python scripts/spatial_features.py --benchmark
+"""
+from __future__ import annotations
+
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import Sequence
+import time
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from cube_store import open_cube
+from grid_registry import GridRegistry, gather, month_index, row_keys
+from stage_cache import PROJECT_ROOT, Stage
+
+
+PROCESSED = PROJECT_ROOT / "data" / "processed"
+PR_FILE = PROCESSED / "chirps_v3_monthly_cvalley_1991_2026.nc"
+SPI_FILE = PROCESSED / "chirps_v3_monthly_cvalley_spi_1991_2026.nc"
+
+SOURCES = ("spi1", "spi3", "spi6", "pr")
+RADII = (1, 2, 4, 7)  # 3×3, 5×5, 9×9, 15×15 boxes
+KINDS = ("mean", "anom", "dlat", "dlon")
+
+
+def feature_name(var: str, radius: int, kind: str = "mean") -> str:
+    window = 2 * radius + 1
+    return f"{var}_nbr_{kind}" if window == 3 else f"{var}_nbr{window}_{kind}"
+
+
+NBR_MEAN_FEATURES = [feature_name(var, 1) for var in SOURCES]
+
+
+def feature_cube_path(spi_file: Path, mask_var: str | None = None) -> Path:
+    """Feature cube next to an SPI file, e.g. ..._spi_1991_2026.nc -> ..._spatial_features_1991_2026.nc."""
+    spi_file = Path(spi_file)
+    stem = spi_file.stem.replace("_spi_", "_spatial_features_", 1)
+    if stem == spi_file.stem:
+        stem = f"{stem}_spatial_features"
+    if mask_var:
+        stem = f"{stem}_{mask_var}"
+    return spi_file.with_name(stem + spi_file.suffix)
+
+
+def summed_area_tables(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Zero-padded integral images of the finite values and of the finite count
+    over the last two axes; all leading axes (time) are handled at once.
+    """
+    finite = np.isfinite(values)
+    pad = [(0, 0)] * (values.ndim - 2) + [(1, 0), (1, 0)]
+    sums = np.pad(np.where(finite, values, 0.0).astype(np.float64), pad)
+    counts = np.pad(finite.astype(np.int32), pad)
+    for axis in (-2, -1):
+        np.cumsum(sums, axis=axis, out=sums)
+        np.cumsum(counts, axis=axis, out=counts)
+    return sums, counts
+
+
+def _box_bounds(n: int, radius: int) -> tuple[np.ndarray, np.ndarray]:
+    idx = np.arange(n)
+    return np.clip(idx - radius, 0, n), np.clip(idx + radius + 1, 0, n)
+
+
+def _box_total(table: np.ndarray, rows: tuple[np.ndarray, np.ndarray], cols: tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    (lo_r, hi_r), (lo_c, hi_c) = rows, cols
+    lo_r, hi_r = lo_r[:, None], hi_r[:, None]
+    return table[..., hi_r, hi_c] - table[..., lo_r, hi_c] - table[..., hi_r, lo_c] + table[..., lo_r, lo_c]
+
+
+def box_mean(sums: np.ndarray, counts: np.ndarray, radius: int) -> np.ndarray:
+    """Mean of the finite values in the (2r+1)² box around each pixel; NaN if none."""
+    ny, nx = sums.shape[-2] - 1, sums.shape[-1] - 1
+    rows, cols = _box_bounds(ny, radius), _box_bounds(nx, radius)
+    total = _box_total(sums, rows, cols)
+    n = _box_total(counts, rows, cols)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(n > 0, total / n, np.nan)
+
+
+def neighbourhood_features(
+    values: np.ndarray,
+    lat: np.ndarray,
+    lon: np.ndarray,
+    radii: Sequence[int] = RADII,
+    kinds: Sequence[str] = KINDS,
+    dtype=np.float32,
+) -> dict[tuple[int, str], np.ndarray]:
+    """
+    All requested (radius, kind) features of a (..., latitude, longitude) array.
+
+    The two summed-area tables are built once and shared by every radius.
+    """
+    values = np.asarray(values)
+    sums, counts = summed_area_tables(values)
+    out = {}
+    for radius in radii:
+        mean = box_mean(sums, counts, radius)
+        if "mean" in kinds:
+            out[(radius, "mean")] = mean.astype(dtype)
+        if "anom" in kinds:
+            out[(radius, "anom")] = (values - mean).astype(dtype)
+        if "dlat" in kinds:
+            out[(radius, "dlat")] = np.gradient(mean, np.asarray(lat, dtype=np.float64), axis=-2).astype(dtype)
+        if "dlon" in kinds:
+            out[(radius, "dlon")] = np.gradient(mean, np.asarray(lon, dtype=np.float64), axis=-1).astype(dtype)
+    return out
+
+
+def load_sources(pr_file: Path, spi_file: Path, grid_mask: xr.DataArray | None = None) -> xr.Dataset:
+    """pr and SPI-1/3/6 on the pr time axis as float32, masked to NaN outside grid_mask."""
+    pr = open_cube(pr_file, variables=["pr"])["pr"].astype("float32")
+    spi_ds = open_cube(spi_file, variables=[var for var in SOURCES if var != "pr"])
+    ds = xr.Dataset({var: (pr if var == "pr" else spi_ds[var].sel(time=pr.time).astype("float32")) for var in SOURCES})
+    if grid_mask is not None:
+        ds = ds.where(grid_mask)
+    return ds
+
+
+def build_feature_cube(
+    pr_file: Path,
+    spi_file: Path,
+    out_file: Path,
+    radii: Sequence[int] = RADII,
+    kinds: Sequence[str] = KINDS,
+    grid_mask: xr.DataArray | None = None,
+) -> None:
+    sources = load_sources(pr_file, spi_file, grid_mask)
+    lat, lon = sources["latitude"].values, sources["longitude"].values
+    dims = ("time", "latitude", "longitude")
+    chunks = (1, lat.size, lon.size)
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_file.with_name(out_file.name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    # One source at a time keeps peak memory to a single variable's features.
+    for i, var in enumerate(SOURCES):
+        feats = neighbourhood_features(sources[var].values, lat, lon, radii, kinds)
+        ds = xr.Dataset(
+            {feature_name(var, r, k): (dims, arr) for (r, k), arr in feats.items()},
+            coords={"time": sources["time"], "latitude": lat, "longitude": lon},
+        )
+        if i == 0:
+            ds.attrs.update({
+                "pr_file": str(pr_file),
+                "spi_file": str(spi_file),
+                "radii": list(radii),
+                "note": "NaN-aware box statistics from summed-area tables; see scripts/spatial_features.py",
+            })
+        encoding = {name: {"zlib": True, "complevel": 4, "chunksizes": chunks} for name in ds.data_vars}
+        ds.to_netcdf(tmp, mode="w" if i == 0 else "a", encoding=encoding)
+        print(f"  {var}: {len(feats)} features")
+    tmp.replace(out_file)
+    print("Wrote:", out_file)
+
+
+def ensure_feature_cube(
+    pr_file: Path,
+    spi_file: Path,
+    out_file: Path | None = None,
+    radii: Sequence[int] = RADII,
+    kinds: Sequence[str] = KINDS,
+    grid_mask: xr.DataArray | None = None,
+    mask_file: Path | None = None,
+    mask_var: str | None = None,
+    force: bool = False,
+) -> Path:
+    """
+    Build the feature cube unless a fresh one exists and return its path.
+
+    grid_mask is applied before the box statistics, so masked pixels never
+    contribute to a neighbour; mask_file and mask_var key the stage record.
+    """
+    out_file = Path(out_file) if out_file is not None else feature_cube_path(spi_file, mask_var if grid_mask is not None else None)
+    inputs = [Path(pr_file), Path(spi_file)] + ([Path(mask_file)] if mask_file is not None else [])
+    stage = Stage(
+        name=f"spatial_features_{out_file.stem}",
+        outputs=[out_file],
+        inputs=inputs,
+        params={"radii": list(radii), "kinds": list(kinds), "mask_var": mask_var if grid_mask is not None else None},
+        code=[Path(__file__)],
+    )
+    if not force and stage.fresh():
+        print(f"Using cached spatial feature cube: {out_file}")
+        return out_file
+    print(f"Building spatial feature cube (windows {[2 * r + 1 for r in radii]})...")
+    key = stage.key()
+    build_feature_cube(Path(pr_file), Path(spi_file), out_file, radii, kinds, grid_mask)
+    stage.record(key)
+    return out_file
+
+
+def add_features(
+    frame: pd.DataFrame,
+    cube_file: Path,
+    features: Sequence[str] = NBR_MEAN_FEATURES,
+    grid_mask: xr.DataArray | None = None,
+) -> pd.DataFrame:
+    """
+    frame plus the cube's features, gathered at each row's (month_index, pixel_id).
+
+    The cube shares the region's grid registry, so this is a positional gather
+    (grid_registry.gather), not a merge on float coordinates. Rows whose month
+    is not in the cube, or whose pixel lies outside grid_mask, get NaN.
+    """
+    with xr.open_dataset(cube_file) as ds:
+        pixel_id, months = row_keys(frame, GridRegistry.from_data(ds))
+        if grid_mask is not None:
+            inside = np.asarray(grid_mask.values, dtype=bool).ravel()
+            pixel_id = np.where((pixel_id >= 0) & inside[np.maximum(pixel_id, 0)], pixel_id, -1)
+        cube_months = month_index(ds["time"].values)
+        gathered = {name: gather(ds[name].values, cube_months, pixel_id, months) for name in features}
+    return frame.assign(**gathered)
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--pr-file", type=Path, default=PR_FILE)
+    parser.add_argument("--spi-file", type=Path, default=SPI_FILE)
+    parser.add_argument("--out-file", type=Path, default=None)
+    parser.add_argument(
+        "--windows",
+        nargs="+",
+        type=int,
+        default=[2 * r + 1 for r in RADII],
+        help="Odd box widths in grid cells (default: 3 5 9 15).",
+    )
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the cached cube is fresh.")
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Time summed-area box means against xarray rolling means on synthetic data.",
+    )
+    return parser.parse_args()
+
+
+def benchmark(radii: Sequence[int], n_time: int = 432, shape: tuple[int, int] = (112, 80), seed: int = 0) -> None:
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=(n_time,) + shape).astype(np.float32)
+    values[:, :6, :9] = np.nan  # masked corner
+    values[rng.uniform(size=values.shape) < 0.02] = np.nan
+    da = xr.DataArray(values, dims=("time", "latitude", "longitude"))
+
+    start = time.perf_counter()
+    rolled = {
+        r: da.rolling({"latitude": 2 * r + 1, "longitude": 2 * r + 1}, min_periods=1, center=True).mean().values
+        for r in radii
+    }
+    rolling_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sums, counts = summed_area_tables(values)
+    boxed = {r: box_mean(sums, counts, r).astype(np.float32) for r in radii}
+    table_s = time.perf_counter() - start
+
+    max_diff = max(float(np.nanmax(np.abs(boxed[r] - rolled[r]))) for r in radii)
+    nan_match = all(np.array_equal(np.isnan(boxed[r]), np.isnan(rolled[r])) for r in radii)
+    print(f"Synthetic cube {values.shape}, windows {[2 * r + 1 for r in radii]}")
+    print(f"  xarray rolling means  : {rolling_s:6.2f} s")
+    print(f"  summed-area box means : {table_s:6.2f} s  ({rolling_s / table_s:.1f}x)")
+    print(f"  max |diff| = {max_diff:.2e}, NaN pattern identical: {nan_match}")
+
+
+def main() -> None:
+    args = parse_args()
+    if any(w < 1 or w % 2 == 0 for w in args.windows):
+        raise SystemExit("--windows must be odd positive box widths")
+    radii = sorted({w // 2 for w in args.windows})
+    if args.benchmark:
+        benchmark(radii)
+    else:
+        ensure_feature_cube(args.pr_file, args.spi_file, args.out_file, radii=radii, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
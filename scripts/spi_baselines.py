@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""
+Refit SPI under several climatological baselines from stored sufficient statistics.
+
+Each alternative baseline (1981-2010, 1991-2020, a sliding recent 30 years)
+used to mean a full refit in make_spi_labels.py. This script keeps a store of
+per window x calendar month x year x pixel gamma sufficient statistics
+(finite count, zero count, positive count, sum x and sum log x of the
+accumulations ending in that month). Refitting a contiguous baseline only
+sums a year slice of the store and solves the gamma MLE, so several baselines
+come out of one run and the annual roll-forward never touches the cube.
+
+The statistics store is keyed on the content of the precipitation file, the
+windows and this code (see stage_cache.py). It is rebuilt when that key
+changes, for example when the file gains or revises months, or with
+--rebuild-stats.
+
+Input:
+  data/processed/chirps_v3_monthly_cvalley_1991_2026.nc
+
+Output (under data/processed/spi_baselines/):
+  chirps_v3_monthly_cvalley_spi_stats_1991_2026.nc
+  chirps_v3_monthly_cvalley_spi_params_<start>_<end>.nc    per baseline
+  chirps_v3_monthly_cvalley_spi_family_b<start>_<end>.nc   with --write-spi
+
+Usage:
+  python scripts/spi_baselines.py --baselines 1981-2010 1991-2020 recent30 --write-spi
+"""
+from __future__ import annotations
+
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+import re
+import time
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from make_spi_family import family_dataset
+from stage_cache import Stage
+from spi_engine import (
+    GammaParams,
+    baseline_params,
+    fit_monthly_params,
+    load_stats_store,
+    rolling_sums,
+    save_param_store,
+    save_stats_store,
+    transform_monthly,
+    yearly_gamma_stats,
+)
+
+IN_FILE = Path("data/processed/chirps_v3_monthly_cvalley_1991_2026.nc")
+OUT_DIR = Path("data/processed/spi_baselines")
+STEM = "chirps_v3_monthly_cvalley"
+DEFAULT_WINDOWS = (1, 3, 6)
+DEFAULT_BASELINES = ("1991-2020",)
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--in-file", type=Path, default=IN_FILE)
+    parser.add_argument("--out-dir", type=Path, default=OUT_DIR)
+    parser.add_argument("--stem", default=STEM, help="Output file name prefix.")
+    parser.add_argument("--windows", nargs="+", type=int, default=list(DEFAULT_WINDOWS))
+    parser.add_argument(
+        "--baselines",
+        nargs="+",
+        default=list(DEFAULT_BASELINES),
+        help="Inclusive baselines as START-END, or recentN for the last N complete years.",
+    )
+    parser.add_argument("--rebuild-stats", action="store_true")
+    parser.add_argument(
+        "--write-spi",
+        action="store_true",
+        help="Also write an SPI family cube (window, time, latitude, longitude) per baseline.",
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Time the refits from statistics against full refits from the cube.",
+    )
+    return parser.parse_args()
+
+
+def complete_years(times: pd.DatetimeIndex) -> np.ndarray:
+    counts = pd.Series(times.year).value_counts()
+    return np.sort(counts[counts == 12].index.to_numpy())
+
+
+def resolve_baseline(spec: str, times: pd.DatetimeIndex) -> tuple[int, int]:
+    """Parse 'START-END' or 'recentN' into an inclusive (start, end) year range."""
+    match = re.fullmatch(r"(\d{4})-(\d{4})", spec)
+    if match:
+        start, end = int(match.group(1)), int(match.group(2))
+    else:
+        match = re.fullmatch(r"recent(\d+)", spec)
+        if match is None:
+            raise ValueError(f"Baseline '{spec}' is neither START-END nor recentN")
+        full = complete_years(times)
+        end = int(full.max())
+        start = end - int(match.group(1)) + 1
+    if start > end:
+        raise ValueError(f"Baseline '{spec}' starts after it ends")
+    covered = int(np.sum((times.year >= start) & (times.year <= end)) // 12)
+    if covered < end - start + 1:
+        print(f"  note: baseline {start}-{end} has data for only {covered} of {end - start + 1} years")
+    return start, end
+
+
+def build_stats(pr: xr.DataArray, windows: list[int], stats_file: Path, in_file: Path) -> None:
+    time_pd = pd.DatetimeIndex(pr.time.values)
+    months = time_pd.month.to_numpy()
+    rolled = rolling_sums(pr.values, windows)
+    stats_by_window = {}
+    for window in windows:
+        years, stats_by_window[window] = yearly_gamma_stats(rolled.pop(window), months, time_pd.year.to_numpy())
+    save_stats_store(
+        stats_file,
+        stats_by_window,
+        years,
+        {"latitude": pr.latitude.values, "longitude": pr.longitude.values},
+        attrs={
+            "source_file": str(in_file),
+            "last_time": f"{time_pd.max():%Y-%m}",
+            "note": "Yearly zero-inflated gamma sufficient statistics per window x calendar month x pixel",
+        },
+    )
+    print("Saved sufficient statistics to", stats_file)
+
+
+def run(args: Namespace) -> None:
+    windows = sorted(set(args.windows))
+    with xr.open_dataset(args.in_file) as ds:
+        # Only the coordinates are read here; the cube itself is loaded just for
+        # a statistics rebuild or --write-spi.
+        pr = ds["pr"]
+        time_pd = pd.DatetimeIndex(pr.time.values)
+        stats_file = args.out_dir / f"{args.stem}_spi_stats_{time_pd.year.min()}_{time_pd.year.max()}.nc"
+        stage = Stage(
+            name=f"spi_baselines_{stats_file.stem}",
+            outputs=[stats_file],
+            inputs=[args.in_file],
+            params={"windows": windows},
+            code=[Path(__file__)],
+        )
+        # A store without a record cannot be tied to the current input, so it is rebuilt.
+        rebuild = args.rebuild_stats or not stage.fresh(adopt=False)
+        if rebuild or args.write_spi:
+            print("Loading", args.in_file)
+            pr = pr.load()
+    baselines = [resolve_baseline(spec, time_pd) for spec in args.baselines]
+
+    if rebuild:
+        key = stage.key()
+        build_stats(pr, windows, stats_file, args.in_file)
+        stage.record(key)
+    stats_by_window, years, _ = load_stats_store(stats_file)
+
+    spatial = {"latitude": pr.latitude.values, "longitude": pr.longitude.values}
+    rolled = rolling_sums(pr.values, windows) if args.write_spi else None
+    months = time_pd.month.to_numpy()
+    for start, end in baselines:
+        t0 = time.perf_counter()
+        params = {w: baseline_params(stats_by_window[w], years, start, end) for w in windows}
+        fit_s = time.perf_counter() - t0
+        attrs = {
+            "baseline_years": f"{start}-{end}",
+            "source_file": str(args.in_file),
+            "method": "zero-inflated gamma, location 0, MLE per pixel x calendar month",
+        }
+        params_file = args.out_dir / f"{args.stem}_spi_params_{start}_{end}.nc"
+        save_param_store(params_file, params, spatial, attrs=attrs)
+        print(f"Baseline {start}-{end}: refit {len(windows)} window(s) in {fit_s:.2f} s -> {params_file}")
+
+        if rolled is not None:
+            spi = np.stack([transform_monthly(rolled[w], months, params[w]) for w in windows])
+            out_file = args.out_dir / f"{args.stem}_spi_family_b{start}_{end}.nc"
+            family_dataset(pr, spi, windows, attrs).to_netcdf(
+                out_file,
+                encoding={"spi": {"zlib": True, "complevel": 4, "chunksizes": (1,) + spi.shape[1:]}},
+            )
+            print("  wrote", out_file)
+
+
+def _max_param_diff(a: GammaParams, b: GammaParams) -> float:
+    diffs = [np.abs(getattr(a, name) - getattr(b, name)) for name in ("alpha", "beta", "p_zero")]
+    return max(float(np.nanmax(d)) if np.isfinite(d).any() else 0.0 for d in diffs)
+
+
+def benchmark(windows: list[int], n_years: int = 46, shape: tuple[int, int] = (60, 80)) -> None:
+    rng = np.random.default_rng(0)
+    values = rng.gamma(1.0, 50.0, size=(12 * n_years,) + shape)
+    values[rng.uniform(size=values.shape) < 0.3] = 0.0
+    months = np.tile(np.arange(1, 13), n_years)
+    years = np.repeat(np.arange(1981, 1981 + n_years), 12)
+    baselines = [(start, start + 29) for start in range(1981, 1981 + n_years - 29)]
+
+    start = time.perf_counter()
+    rolled = rolling_sums(values, windows)
+    full = {
+        (b, w): fit_monthly_params(rolled[w], months, (years >= b[0]) & (years <= b[1]))
+        for b in baselines for w in windows
+    }
+    full_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stats = {w: yearly_gamma_stats(rolled[w], months, years) for w in windows}
+    stats_s = time.perf_counter() - start
+    start = time.perf_counter()
+    fast = {
+        (b, w): baseline_params(stats[w][1], stats[w][0], b[0], b[1])
+        for b in baselines for w in windows
+    }
+    refit_s = time.perf_counter() - start
+
+    max_diff = max(_max_param_diff(full[key], fast[key]) for key in full)
+    print(f"Synthetic cube {values.shape}, windows {windows}, {len(baselines)} sliding 30-year baselines")
+    print(f"  full refits            : {full_s:6.2f} s")
+    print(f"  statistics (one-off)   : {stats_s:6.2f} s")
+    print(f"  refits from statistics : {refit_s:6.2f} s  ({full_s / refit_s:.1f}x)")
+    print(f"  max |param diff| = {max_diff:.2e}")
+
+
+def main() -> None:
+    args = parse_args()
+    if args.benchmark:
+        benchmark(sorted(set(args.windows)))
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+"""
+Block-wise SPI: out-of-core over a memory budget, or in parallel in shared memory.
+
+The in-memory SPI paths load the whole precipitation cube, cast it to float64
+and keep float64 rolled copies for every window, so peak memory is several
+times the cube size. For continental grids (Horn of Africa, a full
+Murray-Darling basin at 0.05 deg) that is close to the node limit.
+
+write_spi_blocks() instead:
+  1. pre-creates the SPI NetCDF (and optionally the parameter store) with
+     chunking aligned to the pixel blocks,
+  2. reads one (time, lat block, lon block) slab of the clipped precipitation
+     file at a time,
+  3. computes every window with spi_engine.spi_family() and writes SPI,
+     drought labels and fitted parameters into the slab's region in place.
+
+Block sizes come from --memory-budget using a per-value cost measured for
+spi_family(), so peak RSS is bounded by the budget rather than the grid size.
+
+spi_family_shared() is the parallel in-memory path. The input cube and the
+output SPI cube live in memory-mapped files (under /dev/shm when available).
+Workers open them by path, compute contiguous pixel blocks and write results
+in place, so no block is pickled to a worker and no result array is pickled
+back and concatenated.
+
+Usage:
+  python scripts/spi_blocks.py --in-file <pr.nc> --out-file <spi.nc> --memory-budget 2G
+  python scripts/spi_blocks.py --benchmark --n-jobs 8
+"""
+from __future__ import annotations
+
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import Iterator, Sequence
+import math
+import re
+import shutil
+import tempfile
+import time
+
+import netCDF4
+import numpy as np
+import pandas as pd
+import xarray as xr
+from joblib import Parallel, delayed
+
+from spi_engine import spi_family, spi_label
+
+
+# Peak bytes per (time, pixel) value inside spi_family(): float64 input and
+# cumulative sums, count arrays, and per window the rolled, stacked, fitted
+# and float32 SPI copies. Measured with tracemalloc and rounded up.
+BASE_BYTES_PER_VALUE = 40
+WINDOW_BYTES_PER_VALUE = 16
+MAX_CHUNK_PIXELS = 128
+BLOCKS_PER_JOB = 4
+SHARED_DIR = Path("/dev/shm") if Path("/dev/shm").is_dir() else Path(tempfile.gettempdir())
+COMPRESSION = {"zlib": True, "complevel": 4}
+
+_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_memory(text: str | int) -> int:
+    """Parse a byte count such as '512M', '2G' or '1.5GB' (binary units)."""
+    if isinstance(text, int):
+        return text
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([KMGT]?)i?B?\s*", str(text), flags=re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Cannot parse memory size '{text}'; use e.g. 512M or 2G")
+    return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+
+def bytes_per_pixel(n_time: int, n_windows: int) -> int:
+    return n_time * (BASE_BYTES_PER_VALUE + WINDOW_BYTES_PER_VALUE * n_windows)
+
+
+def plan_blocks(
+    nlat: int,
+    nlon: int,
+    n_time: int,
+    n_windows: int,
+    memory_budget: int,
+) -> tuple[int, int]:
+    """
+    Largest (rows, cols) block whose SPI working set fits in memory_budget.
+
+    Whole latitude rows are preferred so each read is one contiguous band;
+    when a single row does not fit, rows are split along longitude.
+    """
+    max_pixels = max(1, memory_budget // bytes_per_pixel(n_time, n_windows))
+    if max_pixels >= nlon:
+        return min(nlat, max_pixels // nlon), nlon
+    return 1, max_pixels
+
+
+def iter_blocks(nlat: int, nlon: int, rows: int, cols: int) -> Iterator[tuple[slice, slice]]:
+    for r0 in range(0, nlat, rows):
+        for c0 in range(0, nlon, cols):
+            yield slice(r0, min(r0 + rows, nlat)), slice(c0, min(c0 + cols, nlon))
+
+
+def _copy_coord(src: netCDF4.Dataset, dst: netCDF4.Dataset, name: str, dim: str) -> None:
+    var = src.variables[name]
+    out = dst.createVariable(dim, var.dtype, (dim,))
+    out.setncatts({k: var.getncattr(k) for k in var.ncattrs() if k != "_FillValue"})
+    out[:] = var[:]
+
+
+def create_spi_file(
+    out_file: Path,
+    pr_file: Path,
+    names: dict[str, tuple[type, dict[str, object]]],
+    chunks: tuple[int, int, int],
+    coord_names: tuple[str, str, str] = ("time", "latitude", "longitude"),
+) -> None:
+    """Pre-create a (time, latitude, longitude) NetCDF with empty chunked variables."""
+    time_name, lat_name, lon_name = coord_names
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    with netCDF4.Dataset(pr_file) as src, netCDF4.Dataset(out_file, "w") as dst:
+        # Unlimited time keeps make_spi_labels.py --append working on the result.
+        dst.createDimension("time", None)
+        dst.createDimension("latitude", len(src.dimensions[lat_name]))
+        dst.createDimension("longitude", len(src.dimensions[lon_name]))
+        _copy_coord(src, dst, time_name, "time")
+        _copy_coord(src, dst, lat_name, "latitude")
+        _copy_coord(src, dst, lon_name, "longitude")
+        for name, (dtype, attrs) in names.items():
+            fill = np.nan if np.issubdtype(dtype, np.floating) else None
+            var = dst.createVariable(
+                name,
+                dtype,
+                ("time", "latitude", "longitude"),
+                chunksizes=chunks,
+                fill_value=fill,
+                **COMPRESSION,
+            )
+            var.setncatts(attrs)
+
+
+def create_param_store(
+    params_file: Path,
+    pr_file: Path,
+    windows: Sequence[int],
+    attrs: dict[str, object],
+    chunks: tuple[int, int],
+    coord_names: tuple[str, str] = ("latitude", "longitude"),
+) -> None:
+    """Pre-create a store readable by spi_engine.load_param_store()."""
+    lat_name, lon_name = coord_names
+    params_file.parent.mkdir(parents=True, exist_ok=True)
+    with netCDF4.Dataset(pr_file) as src, netCDF4.Dataset(params_file, "w") as dst:
+        dst.createDimension("window", len(windows))
+        dst.createDimension("month", 12)
+        dst.createDimension("latitude", len(src.dimensions[lat_name]))
+        dst.createDimension("longitude", len(src.dimensions[lon_name]))
+        dst.createVariable("window", np.int16, ("window",))[:] = np.asarray(windows, dtype=np.int16)
+        dst.createVariable("month", np.int8, ("month",))[:] = np.arange(1, 13, dtype=np.int8)
+        _copy_coord(src, dst, lat_name, "latitude")
+        _copy_coord(src, dst, lon_name, "longitude")
+        long_names = {
+            "alpha": "Gamma shape parameter (location fixed at 0)",
+            "beta": "Gamma scale parameter",
+            "p_zero": "Probability of zero accumulation in the baseline",
+        }
+        for name, long_name in long_names.items():
+            var = dst.createVariable(
+                name,
+                np.float32,
+                ("window", "month", "latitude", "longitude"),
+                chunksizes=(1, 12) + chunks,
+                fill_value=np.nan,
+                **COMPRESSION,
+            )
+            var.long_name = long_name
+        dst.setncatts(attrs)
+
+
+def write_spi_blocks(
+    pr_file: Path,
+    out_file: Path,
+    windows: Sequence[int],
+    memory_budget: int | str,
+    baseline_years: tuple[int, int],
+    label_windows: Sequence[int] = (1, 3),
+    params_file: Path | None = None,
+    var_attrs: dict[str, dict[str, object]] | None = None,
+    label_dtype: type = np.int8,
+    var: str = "pr",
+) -> dict[str, object]:
+    """
+    Compute SPI for `windows` block by block and write them to `out_file`.
+
+    Variables are spi<w> for every window and drought_label_spi<w> for
+    label_windows. With int8 labels missing SPI maps to 0 (make_spi_labels.py
+    convention); float labels keep NaN. Returns a summary with the block
+    shape, number of blocks and label counts.
+    """
+    windows = sorted({int(w) for w in windows})
+    memory_budget = parse_memory(memory_budget)
+    var_attrs = var_attrs or {}
+
+    with xr.open_dataset(pr_file) as ds:
+        pr = ds[var]
+        lat_name = "latitude" if "latitude" in pr.dims else "lat"
+        lon_name = "longitude" if "longitude" in pr.dims else "lon"
+        pr = pr.transpose("time", lat_name, lon_name)
+        times = pd.DatetimeIndex(pr["time"].values)
+        n_time, nlat, nlon = pr.shape
+
+        months_arr = times.month.to_numpy()
+        baseline_mask = (times.year >= baseline_years[0]) & (times.year <= baseline_years[1])
+        rows, cols = plan_blocks(nlat, nlon, n_time, len(windows), memory_budget)
+        chunks = (min(rows, MAX_CHUNK_PIXELS), min(cols, MAX_CHUNK_PIXELS))
+
+        out_vars = {
+            f"spi{w}": (np.float32, var_attrs.get(f"spi{w}", {"units": "dimensionless"}))
+            for w in windows
+        }
+        out_vars.update({
+            f"drought_label_spi{w}": (label_dtype, var_attrs.get(f"drought_label_spi{w}", {"units": "1"}))
+            for w in label_windows
+        })
+        create_spi_file(out_file, pr_file, out_vars, (n_time,) + chunks, ("time", lat_name, lon_name))
+        if params_file is not None:
+            create_param_store(
+                params_file,
+                pr_file,
+                windows,
+                {
+                    "baseline_years": f"{baseline_years[0]}-{baseline_years[1]}",
+                    "source_file": str(pr_file),
+                    "method": "zero-inflated gamma, location 0, MLE per pixel x calendar month",
+                },
+                chunks,
+                (lat_name, lon_name),
+            )
+
+        blocks = list(iter_blocks(nlat, nlon, rows, cols))
+        print(
+            f"Out-of-core SPI for grid {nlat} x {nlon} x {n_time} months: "
+            f"{len(blocks)} block(s) of up to {rows} x {cols} pixels "
+            f"(budget {memory_budget / 2**20:,.0f} MiB)"
+        )
+        counts = {w: np.zeros(3, dtype=np.int64) for w in label_windows}
+        out = netCDF4.Dataset(out_file, "a")
+        store = netCDF4.Dataset(params_file, "a") if params_file is not None else None
+        try:
+            for i, (lat_sl, lon_sl) in enumerate(blocks, start=1):
+                block = pr[:, lat_sl, lon_sl].values
+                spi, params = spi_family(block, months_arr, baseline_mask, windows)
+                del block
+                for k, window in enumerate(windows):
+                    out.variables[f"spi{window}"][:, lat_sl, lon_sl] = spi[k]
+                    if window in counts:
+                        labels = spi_label(spi[k])
+                        counts[window] += np.bincount(labels[np.isfinite(spi[k])].ravel() + 1, minlength=3)
+                        if np.issubdtype(label_dtype, np.floating):
+                            labels = np.where(np.isfinite(spi[k]), labels, np.nan).astype(label_dtype)
+                        out.variables[f"drought_label_spi{window}"][:, lat_sl, lon_sl] = labels
+                    if store is not None:
+                        for name in ("alpha", "beta", "p_zero"):
+                            store.variables[name][k, :, lat_sl, lon_sl] = getattr(params[window], name)
+                del spi, params
+                if i % max(1, len(blocks) // 10) == 0 or i == len(blocks):
+                    print(f"  block {i}/{len(blocks)} written")
+        finally:
+            out.close()
+            if store is not None:
+                store.close()
+
+    return {
+        "block_shape": (rows, cols),
+        "n_blocks": len(blocks),
+        "label_counts": {
+            w: dict(zip(("dry", "normal", "wet"), map(int, c))) for w, c in counts.items()
+        },
+    }
+
+
+def _spi_block_inplace(
+    src_path: str,
+    out_path: str,
+    n_time: int,
+    n_pixels: int,
+    src_dtype: str,
+    out_dtype: str,
+    lo: int,
+    hi: int,
+    months: np.ndarray,
+    baseline_mask: np.ndarray,
+    windows: list[int],
+) -> None:
+    src = np.memmap(src_path, dtype=src_dtype, mode="r", shape=(n_time, n_pixels))
+    out = np.memmap(out_path, dtype=out_dtype, mode="r+", shape=(len(windows), n_time, n_pixels))
+    spi, _ = spi_family(src[:, lo:hi], months, baseline_mask, windows, dtype=out.dtype)
+    out[:, :, lo:hi] = spi
+    out.flush()
+    del src, out
+
+
+def spi_family_shared(
+    values: np.ndarray,
+    months: np.ndarray,
+    baseline_mask: np.ndarray,
+    windows: Sequence[int],
+    n_jobs: int,
+    block_pixels: int | None = None,
+    dtype: np.dtype | type = np.float32,
+) -> np.ndarray:
+    """
+    spi_family() over contiguous pixel blocks in parallel via shared memory maps.
+
+    Returns SPI of shape (window, time, ...) in the order of `windows`; the
+    fitted parameters are not collected.
+    """
+    windows = [int(w) for w in windows]
+    arr = np.asarray(values)
+    n_time, spatial = arr.shape[0], arr.shape[1:]
+    n_pixels = math.prod(spatial)
+    if block_pixels is None:
+        block_pixels = max(1, math.ceil(n_pixels / (BLOCKS_PER_JOB * max(1, n_jobs))))
+    bounds = list(range(0, n_pixels, block_pixels)) + [n_pixels]
+
+    workdir = Path(tempfile.mkdtemp(prefix="spi_shared_", dir=SHARED_DIR))
+    try:
+        src_path, out_path = workdir / "pr.dat", workdir / "spi.dat"
+        src = np.memmap(src_path, dtype=arr.dtype, mode="w+", shape=(n_time, n_pixels))
+        src[:] = arr.reshape(n_time, n_pixels)
+        src.flush()
+        del src
+        out = np.memmap(out_path, dtype=dtype, mode="w+", shape=(len(windows), n_time, n_pixels))
+        Parallel(n_jobs=n_jobs)(
+            delayed(_spi_block_inplace)(
+                str(src_path), str(out_path), n_time, n_pixels, arr.dtype.str, out.dtype.str,
+                lo, hi, months, baseline_mask, windows,
+            )
+            for lo, hi in zip(bounds[:-1], bounds[1:])
+        )
+        result = np.array(out).reshape((len(windows), n_time) + spatial)
+        del out
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def _spi_family_returned(values, months, baseline_mask, windows, n_jobs):
+    """Previous parallel path: one block per job, results pickled back and concatenated."""
+    n_time = values.shape[0]
+    flat = values.reshape(n_time, -1)
+    bounds = np.linspace(0, flat.shape[1], min(n_jobs, flat.shape[1]) + 1, dtype=int)
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(spi_family)(flat[:, lo:hi], months, baseline_mask, windows)
+        for lo, hi in zip(bounds[:-1], bounds[1:])
+    )
+    return np.concatenate([spi for spi, _ in results], axis=2).reshape((len(windows),) + values.shape)
+
+
+def benchmark(n_jobs: int, windows: list[int], shape: tuple[int, int] = (200, 250), n_years: int = 36) -> None:
+    rng = np.random.default_rng(0)
+    values = rng.gamma(1.0, 50.0, size=(12 * n_years,) + shape)
+    values[rng.uniform(size=values.shape) < 0.3] = 0.0
+    months = np.tile(np.arange(1, 13), n_years)
+    years = np.repeat(np.arange(1991, 1991 + n_years), 12)
+    baseline_mask = (years >= 1991) & (years <= 2020)
+    n_pixels = math.prod(shape)
+
+    timings = {}
+    outputs = {}
+    for name, func in [
+        ("returned arrays", lambda: _spi_family_returned(values, months, baseline_mask, windows, n_jobs)),
+        ("shared memory", lambda: spi_family_shared(values, months, baseline_mask, windows, n_jobs)),
+    ]:
+        start = time.perf_counter()
+        outputs[name] = func()
+        timings[name] = time.perf_counter() - start
+    same = np.array_equal(outputs["returned arrays"], outputs["shared memory"], equal_nan=True)
+    print(f"Synthetic cube {values.shape}, windows {windows}, n_jobs={n_jobs}")
+    for name, seconds in timings.items():
+        print(f"  {name:<16}: {seconds:6.2f} s  ({n_pixels / seconds:,.0f} pixels/s)")
+    print(f"  identical output: {same}")
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--in-file", type=Path)
+    parser.add_argument("--out-file", type=Path)
+    parser.add_argument("--params-file", type=Path, default=None)
+    parser.add_argument("--windows", nargs="+", type=int, default=[1, 3, 6])
+    parser.add_argument("--memory-budget", default="2G", help="Working-set budget, e.g. 512M or 4G.")
+    parser.add_argument("--baseline-start-year", type=int, default=1991)
+    parser.add_argument("--baseline-end-year", type=int, default=2020)
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Compare shared-memory parallel SPI with the returned-array joblib path.",
+    )
+    parser.add_argument("--n-jobs", type=int, default=4)
+    args = parser.parse_args()
+    if not args.benchmark and (args.in_file is None or args.out_file is None):
+        parser.error("--in-file and --out-file are required unless --benchmark is given")
+    return args
+
+
+def main() -> None:
+    args = parse_args()
+    if args.benchmark:
+        benchmark(args.n_jobs, sorted(set(args.windows)))
+        return
+    summary = write_spi_blocks(
+        args.in_file,
+        args.out_file,
+        args.windows,
+        args.memory_budget,
+        (args.baseline_start_year, args.baseline_end_year),
+        label_windows=[w for w in (1, 3) if w in args.windows],
+        params_file=args.params_file,
+    )
+    print("Wrote:", args.out_file)
+    for window, counts in summary["label_counts"].items():
+        print(f"drought_label_spi{window} counts:", counts)
+
+
+if __name__ == "__main__":
+    main()
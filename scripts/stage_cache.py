@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""
+Content-addressed stage records for pipeline artifacts.
+
+Stages used to decide whether to rebuild with `if out_file.exists() and not
+force`, which silently reuses outputs after an upstream file, a parameter or
+the producing code changed. A Stage is keyed by the SHA-256 of:
+  - its name and parameters (canonical JSON),
+  - the content hashes of its input files,
+  - the source of its script and of every local module the script imports.
+
+After a successful build, record() stores the key and output fingerprints
+under data/processed/.stage_cache/<name>.json. fresh() is true only when the
+stored key matches the current one and the outputs are unchanged since.
+Outputs from before stage records existed are adopted once with a notice,
+so upgrading does not force a full rebuild.
+
+File hashes are memoised by (path, size, mtime) in hashes.json next to the
+stage records, so unchanged multi-GB inputs are hashed only once.
+
+Status of the canonical pipeline stages:
+  python scripts/run_pipeline.py --dry-run
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Sequence
+import ast
+import hashlib
+import json
+import os
+
+from incremental_io import sha256_file
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+SCRIPTS_DIR = PROJECT_ROOT / "scripts"
+STAMP_DIR = PROJECT_ROOT / "data" / "processed" / ".stage_cache"
+
+_HASH_MEMO: dict[str, dict[str, object]] | None = None
+
+
+def _memo_path() -> Path:
+    return STAMP_DIR / "hashes.json"
+
+
+def _load_memo() -> dict[str, dict[str, object]]:
+    global _HASH_MEMO
+    if _HASH_MEMO is None:
+        path = _memo_path()
+        _HASH_MEMO = json.loads(path.read_text()) if path.exists() else {}
+    return _HASH_MEMO
+
+
+def _save_memo() -> None:
+    if _HASH_MEMO is None:
+        return
+    path = _memo_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(_HASH_MEMO, indent=0, sort_keys=True))
+    tmp.replace(path)
+
+
+def file_hash(path: Path) -> str:
+    """SHA-256 of a file, memoised by (resolved path, size, mtime_ns)."""
+    path = Path(path)
+    stat = path.stat()
+    memo = _load_memo()
+    key = str(path.resolve())
+    entry = memo.get(key)
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return str(entry["sha256"])
+    digest = sha256_file(path)
+    memo[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+    _save_memo()
+    return digest
+
+
+def path_hash(path: Path) -> str:
+    """Content hash of a file, or of every file below a directory; 'missing' if absent."""
+    path = Path(path)
+    if path.is_dir():
+        digest = hashlib.sha256()
+        for child in sorted(p for p in path.rglob("*") if p.is_file()):
+            digest.update(str(child.relative_to(path)).encode())
+            digest.update(file_hash(child).encode())
+        return digest.hexdigest()
+    if not path.exists():
+        return "missing"
+    return file_hash(path)
+
+
+def local_modules(script: Path) -> list[Path]:
+    """The script plus every scripts/ module it imports, transitively."""
+    seen: dict[Path, None] = {}
+    todo = [Path(script).resolve()]
+    while todo:
+        current = todo.pop()
+        if current in seen or not current.exists():
+            continue
+        seen[current] = None
+        tree = ast.parse(current.read_text(), filename=str(current))
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                candidate = current.parent / f"{name.split('.')[0]}.py"
+                if candidate.exists():
+                    todo.append(candidate.resolve())
+    return sorted(seen)
+
+
+def _rel(path: Path) -> str:
+    path = Path(path).resolve()
+    try:
+        return str(path.relative_to(PROJECT_ROOT))
+    except ValueError:
+        return str(path)
+
+
+@dataclass
+class Stage:
+    """
+    One cached pipeline step.
+
+    Parameters
+    ----------
+    name    : unique stage name; also the record file name
+    outputs : files the stage writes
+    inputs  : files (or directories) whose content the outputs depend on
+    params  : JSON-serialisable settings that change the outputs
+    code    : scripts whose source (plus local imports) is part of the key
+    cmd     : argv after `python` for run_pipeline.py; None for in-script stages
+    default : run by run_pipeline.py when no targets are given
+    """
+
+    name: str
+    outputs: Sequence[Path]
+    inputs: Sequence[Path] = ()
+    params: dict[str, object] = field(default_factory=dict)
+    code: Sequence[Path] = ()
+    cmd: Sequence[str] | None = None
+    default: bool = True
+
+    @property
+    def record_path(self) -> Path:
+        return STAMP_DIR / f"{self.name}.json"
+
+    def key(self) -> str:
+        code_files = sorted({module for script in self.code for module in local_modules(Path(script))})
+        payload = {
+            "name": self.name,
+            "params": self.params,
+            "cmd": list(self.cmd) if self.cmd is not None else None,
+            "inputs": {_rel(p): path_hash(p) for p in self.inputs},
+            "code": {_rel(p): file_hash(p) for p in code_files},
+        }
+        blob = json.dumps(payload, sort_keys=True, default=str).encode()
+        return hashlib.sha256(blob).hexdigest()
+
+    def _load_record(self) -> dict[str, object] | None:
+        if not self.record_path.exists():
+            return None
+        return json.loads(self.record_path.read_text())
+
+    def _outputs_unchanged(self, record: dict[str, object]) -> bool:
+        stored = record.get("outputs", {})
+        for path in self.outputs:
+            entry = stored.get(_rel(path))
+            if entry is None or not Path(path).exists():
+                return False
+            stat = Path(path).stat()
+            if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                continue
+            if path_hash(path) != entry["sha256"]:
+                return False
+        return True
+
+    def status(self, key: str | None = None) -> str:
+        """'fresh', 'stale' (inputs/params/code or outputs changed), 'missing' or 'legacy'."""
+        if not all(Path(p).exists() for p in self.outputs):
+            return "missing"
+        record = self._load_record()
+        if record is None:
+            return "legacy"
+        key = key or self.key()
+        if record.get("key") != key or not self._outputs_unchanged(record):
+            return "stale"
+        return "fresh"
+
+    def fresh(self, adopt: bool = True) -> bool:
+        """
+        True when the outputs are up to date for the current key.
+
+        Outputs built before stage records existed ('legacy') are adopted with
+        a notice when adopt is True; rebuild them with the script's force flag.
+        """
+        key = self.key()
+        status = self.status(key)
+        if status == "legacy" and adopt:
+            print(f"[{self.name}] no stage record; adopting existing outputs "
+                  f"(rebuild with the force flag if they predate input changes)")
+            self.record(key)
+            return True
+        if status == "stale":
+            print(f"[{self.name}] inputs, parameters or code changed since the last build; rebuilding")
+        return status == "fresh"
+
+    def record(self, key: str | None = None) -> None:
+        """Store the key and output fingerprints after a successful build."""
+        outputs = {}
+        for path in self.outputs:
+            stat = Path(path).stat()
+            outputs[_rel(path)] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": path_hash(path),
+            }
+        STAMP_DIR.mkdir(parents=True, exist_ok=True)
+        payload = {"name": self.name, "key": key or self.key(), "outputs": outputs}
+        tmp = self.record_path.with_name(self.record_path.name + ".tmp")
+        tmp.write_text(json.dumps(payload, indent=2))
+        tmp.replace(self.record_path)
@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+"""
+NumPy builder for pixel-month forecast tables.
+
+The forecast builders used to shift each cube with xarray, stack the spatial
+dims, reset the MultiIndex, call to_dataframe() and then dropna(). That keeps
+several full copies of the cube plus a MultiIndex alive at once.
+
+build_lagged_columns() instead takes the (time, lat, lon) arrays, turns every
+lag/lead into a time-offset view of the same buffer, computes one valid-row
+mask, and gathers each column exactly once into a contiguous float32 array.
+Rows come out in the same order as stack(pixel=(lat, lon)).to_dataframe():
+time-major, then latitude, then longitude. write_columns() hands the arrays to
+pyarrow and writes Parquet without building a pandas DataFrame.
+
+iter_target_year_blocks() runs the same gather one target year at a time and
+write_blocks() streams those blocks through a pyarrow ParquetWriter, one row
+group per target year. Only one year of rows is alive at once, and the
+year/month/time column statistics let readers prune row groups with
+pd.read_parquet(..., filters=[("year", "<=", 2016)]).
+
+Every row also carries the integer keys pixel_id and month_index
+(grid_registry.py), so grid-derived features are joined by position.
+
+  python scripts/tabular_builder.py --benchmark                # default 420 x 104 x 70 cube
+  python scripts/tabular_builder.py --benchmark --n-time 432 --n-lat 200 --n-lon 200
+"""
+from __future__ import annotations
+
+from argparse import ArgumentParser, Namespace
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator
+import time as _time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from grid_registry import month_index
+
+
+FEATURE_LAGS = {
+    "spi1_lag1": ("spi1", 0),
+    "spi1_lag2": ("spi1", 1),
+    "spi1_lag3": ("spi1", 2),
+    "spi3_lag1": ("spi3", 0),
+    "spi6_lag1": ("spi6", 0),
+    "pr_lag1": ("pr", 0),
+    "pr_lag2": ("pr", 1),
+    "pr_lag3": ("pr", 2),
+}
+
+
+def _finite(arr: np.ndarray) -> np.ndarray:
+    if np.issubdtype(arr.dtype, np.floating):
+        return np.isfinite(arr)
+    return np.ones(arr.shape, dtype=bool)
+
+
+def build_lagged_columns(
+    times: np.ndarray,
+    lat: np.ndarray,
+    lon: np.ndarray,
+    cubes: dict[str, np.ndarray],
+    features: dict[str, tuple[str, int]],
+    targets: dict[str, tuple[str, int]],
+    exog: dict[str, np.ndarray] | None = None,
+    pixel_mask: np.ndarray | None = None,
+    time_slice: slice | None = None,
+) -> dict[str, np.ndarray]:
+    """
+    Gather lagged feature and lead target columns for every valid pixel-month.
+
+    Parameters
+    ----------
+    times      : (T,) datetime64 feature-month axis shared by all cubes
+    lat, lon   : grid coordinates of the (T, n_lat, n_lon) cubes
+    cubes      : source arrays by name, each shaped (T, n_lat, n_lon)
+    features   : column -> (cube name, lag); lag k gives cube[t - k]
+    targets    : column -> (cube name, lead); lead L gives cube[t + L]
+    exog       : optional per-month columns, each shaped (T,)
+    pixel_mask : optional (n_lat, n_lon) bool; False pixels are dropped
+    time_slice : optional feature-month index range to gather (default: all)
+
+    Returns an ordered dict: time, latitude, longitude, pixel_id, month_index,
+    features, exog, targets. pixel_id numbers the row-major (lat, lon) grid of
+    the cubes, i.e. the region's grid registry (grid_registry.py).
+    Rows with any non-finite feature, exog or target value are dropped.
+    """
+    exog = exog or {}
+    n_time = len(times)
+    n_pix = len(lat) * len(lon)
+    max_lag = max([lag for _, lag in features.values()] + [0])
+    max_lead = max([lead for _, lead in targets.values()] + [0])
+    t0, t1 = max_lag, n_time - max_lead
+    if t1 <= t0:
+        raise ValueError(f"Time axis of {n_time} months is too short for lag {max_lag} / lead {max_lead}")
+    if time_slice is not None:
+        start, stop, _ = time_slice.indices(n_time)
+        t0, t1 = max(t0, start), min(t1, stop)
+        t1 = max(t0, t1)
+
+    def view(name: str, offset: int) -> np.ndarray:
+        # Time-offset slice of the same buffer: no copy for C-contiguous cubes.
+        return cubes[name][t0 + offset:t1 + offset].reshape(t1 - t0, n_pix)
+
+    specs = [(col, name, -lag) for col, (name, lag) in features.items()]
+    specs += [(col, name, lead) for col, (name, lead) in targets.items()]
+
+    valid = np.ones((t1 - t0, n_pix), dtype=bool)
+    if pixel_mask is not None:
+        valid &= np.asarray(pixel_mask, dtype=bool).reshape(1, n_pix)
+    for values in exog.values():
+        valid &= np.isfinite(np.asarray(values)[t0:t1])[:, None]
+    for _, name, offset in specs:
+        valid &= _finite(view(name, offset))
+
+    t_idx, p_idx = np.nonzero(valid)
+    t_idx += t0
+    columns: dict[str, np.ndarray] = {
+        "time": np.asarray(times)[t_idx],
+        "latitude": np.asarray(lat)[p_idx // len(lon)],
+        "longitude": np.asarray(lon)[p_idx % len(lon)],
+        "pixel_id": p_idx.astype(np.int32),
+        "month_index": month_index(np.asarray(times)[t_idx]),
+    }
+    for col, name, offset in specs[:len(features)]:
+        columns[col] = view(name, offset)[valid].astype(np.float32, copy=False)
+    for col, values in exog.items():
+        columns[col] = np.asarray(values, dtype=np.float32)[t_idx]
+    for col, name, offset in specs[len(features):]:
+        columns[col] = view(name, offset)[valid]
+    return columns
+
+
+def month_start(times: np.ndarray) -> np.ndarray:
+    return pd.DatetimeIndex(times).to_period("M").to_timestamp().values
+
+
+def target_time_columns(feature_times: np.ndarray, lead: int) -> dict[str, np.ndarray]:
+    """Calendar columns of the target month (feature month + lead)."""
+    feature_times = np.asarray(feature_times)
+    target = feature_times.astype("datetime64[M]") + np.timedelta64(lead, "M")
+    month = (target.astype(np.int64) % 12 + 1).astype(np.int32)
+    angle = 2 * np.pi * month / 12.0
+    return {
+        "target_time": target.astype(feature_times.dtype),
+        "year": (target.astype("datetime64[Y]").astype(np.int64) + 1970).astype(np.int32),
+        "month": month,
+        "month_sin": np.sin(angle).astype(np.float32),
+        "month_cos": np.cos(angle).astype(np.float32),
+    }
+
+
+def iter_target_year_blocks(
+    times: np.ndarray,
+    lat: np.ndarray,
+    lon: np.ndarray,
+    cubes: dict[str, np.ndarray],
+    features: dict[str, tuple[str, int]],
+    targets: dict[str, tuple[str, int]],
+    lead: int,
+    exog: dict[str, np.ndarray] | None = None,
+    pixel_mask: np.ndarray | None = None,
+) -> Iterator[dict[str, np.ndarray]]:
+    """
+    Yield build_lagged_columns() output one target year at a time.
+
+    Each block also carries the target-month calendar columns from
+    target_time_columns(). Years without valid rows are skipped.
+    """
+    target_years = (
+        np.asarray(times).astype("datetime64[M]") + np.timedelta64(lead, "M")
+    ).astype("datetime64[Y]")
+    # Monthly axis is sorted, so every target year is a contiguous run.
+    _, starts = np.unique(target_years, return_index=True)
+    bounds = list(starts) + [len(times)]
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        columns = build_lagged_columns(
+            times, lat, lon, cubes, features, targets,
+            exog=exog, pixel_mask=pixel_mask, time_slice=slice(start, stop),
+        )
+        if len(columns["time"]) == 0:
+            continue
+        columns.update(target_time_columns(columns["time"], lead))
+        yield columns
+
+
+@dataclass(frozen=True)
+class StreamSummary:
+    rows: int
+    row_groups: int
+    class_counts: pd.Series
+
+
+def write_blocks(
+    path: Path,
+    blocks: Iterable[dict[str, np.ndarray]],
+    order: list[str],
+    label_col: str = "target_label",
+    sample_file: Path | None = None,
+    sample_rows: int = 10_000,
+) -> StreamSummary:
+    """
+    Stream column blocks to Parquet, one row group per block.
+
+    The file is written next to `path` and renamed into place once complete,
+    so an interrupted build never leaves a truncated dataset behind.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    writer: pq.ParquetWriter | None = None
+    samples: list[pa.Table] = []
+    n_sampled = n_rows = n_groups = 0
+    counts: dict[int, int] = {}
+    try:
+        for columns in blocks:
+            table = columns_to_table(columns, order)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema, write_statistics=True)
+            writer.write_table(table, row_group_size=table.num_rows)
+            n_rows += table.num_rows
+            n_groups += 1
+            values, value_counts = np.unique(columns[label_col], return_counts=True)
+            for value, count in zip(values.tolist(), value_counts.tolist()):
+                counts[value] = counts.get(value, 0) + count
+            if sample_file is not None and n_sampled < sample_rows:
+                samples.append(table.slice(0, sample_rows - n_sampled))
+                n_sampled += samples[-1].num_rows
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    if writer is None:
+        raise ValueError(f"No valid rows to write to {path}")
+    writer.close()
+    tmp_path.replace(path)
+
+    if sample_file is not None:
+        pa.concat_tables(samples).to_pandas().to_csv(sample_file, index=False)
+    class_series = pd.Series(counts, name="count").sort_index()
+    class_series.index.name = label_col
+    return StreamSummary(rows=n_rows, row_groups=n_groups, class_counts=class_series)
+
+
+def columns_to_table(columns: dict[str, np.ndarray], order: list[str] | None = None) -> pa.Table:
+    order = order or list(columns)
+    return pa.table({name: columns[name] for name in order})
+
+
+def write_columns(
+    path: Path,
+    table: pa.Table,
+    sample_file: Path | None = None,
+    sample_rows: int = 10_000,
+) -> None:
+    """Write a column table to Parquet (plus an optional CSV head sample)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(table, path)
+    if sample_file is not None:
+        table.slice(0, sample_rows).to_pandas().to_csv(sample_file, index=False)
+
+
+def class_counts(labels: np.ndarray, name: str = "target_label") -> pd.Series:
+    values, counts = np.unique(labels, return_counts=True)
+    return pd.Series(counts, index=pd.Index(values, name=name), name="count")
+
+
+# --------------------------------------------------------------------------
+# Benchmark against the xarray stack -> to_dataframe -> dropna path
+# --------------------------------------------------------------------------
+def _synthetic_cubes(n_time: int, n_lat: int, n_lon: int, seed: int = 0):
+    import xarray as xr
+
+    rng = np.random.default_rng(seed)
+    times = pd.date_range("1991-01-01", periods=n_time, freq="MS")
+    lat = np.linspace(40.6, 35.4, n_lat)
+    lon = np.linspace(-122.5, -119.0, n_lon)
+    shape = (n_time, n_lat, n_lon)
+    cubes = {
+        "pr": rng.gamma(2.0, 20.0, shape).astype(np.float32),
+        "spi1": rng.standard_normal(shape).astype(np.float32),
+        "spi3": rng.standard_normal(shape).astype(np.float32),
+        "spi6": rng.standard_normal(shape).astype(np.float32),
+    }
+    cubes["spi3"][:2] = np.nan
+    cubes["spi6"][:5] = np.nan
+    ocean = rng.random((n_lat, n_lon)) < 0.1
+    for arr in cubes.values():
+        arr[:, ocean] = np.nan
+    cubes["label"] = np.where(cubes["spi1"] <= -1, -1, np.where(cubes["spi1"] >= 1, 1, 0)).astype(np.int8)
+    coords = {"time": times, "latitude": lat, "longitude": lon}
+    das = {name: xr.DataArray(arr, coords=coords, dims=("time", "latitude", "longitude"))
+           for name, arr in cubes.items()}
+    return times.values, lat, lon, cubes, das
+
+
+def _legacy_forecast_frame(das) -> pd.DataFrame:
+    import xarray as xr
+
+    ds = xr.Dataset({
+        col: das[name].shift(time=lag) if lag else das[name]
+        for col, (name, lag) in FEATURE_LAGS.items()
+    })
+    ds["target_label"] = das["label"].shift(time=-1)
+    df = ds.stack(pixel=("latitude", "longitude")).reset_index("pixel").to_dataframe()
+    if "time" not in df.columns:
+        df = df.reset_index()
+    df = df.dropna(subset=["target_label"] + list(FEATURE_LAGS)).copy()
+    df["target_label"] = df["target_label"].astype(np.int8)
+    return df
+
+
+def _measure(func):
+    tracemalloc.start()
+    start = _time.perf_counter()
+    result = func()
+    elapsed = _time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run_benchmark(n_time: int, n_lat: int, n_lon: int) -> None:
+    print(f"Synthetic cube: {n_time} months x {n_lat} lat x {n_lon} lon")
+    times, lat, lon, cubes, das = _synthetic_cubes(n_time, n_lat, n_lon)
+
+    legacy, t_legacy, m_legacy = _measure(lambda: _legacy_forecast_frame(das))
+    fast, t_fast, m_fast = _measure(lambda: build_lagged_columns(
+        times, lat, lon, cubes, FEATURE_LAGS, {"target_label": ("label", 1)}
+    ))
+
+    n_rows = len(fast["time"])
+    if n_rows != len(legacy):
+        raise AssertionError(f"Row count mismatch: numpy={n_rows:,} xarray={len(legacy):,}")
+    max_diff = max(
+        float(np.max(np.abs(fast[col] - legacy[col].to_numpy(dtype=fast[col].dtype)), initial=0.0))
+        for col in list(FEATURE_LAGS) + ["latitude", "longitude"]
+    )
+    if not np.array_equal(fast["target_label"], legacy["target_label"].to_numpy()):
+        raise AssertionError("Target labels differ between builders")
+
+    print(f"Rows: {n_rows:,}   max |numpy - xarray| = {max_diff:.3g}")
+    print(f"{'builder':<28}{'wall s':>10}{'peak MiB':>12}")
+    print(f"{'xarray stack/to_dataframe':<28}{t_legacy:>10.2f}{m_legacy / 2**20:>12.1f}")
+    print(f"{'numpy lagged columns':<28}{t_fast:>10.2f}{m_fast / 2**20:>12.1f}")
+    print(f"Speed-up {t_legacy / t_fast:.1f}x, peak memory {m_legacy / max(m_fast, 1):.1f}x lower")
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--benchmark", action="store_true", help="Compare against the xarray table builder.")
+    parser.add_argument("--n-time", type=int, default=420)
+    parser.add_argument("--n-lat", type=int, default=104)
+    parser.add_argument("--n-lon", type=int, default=70)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.benchmark:
+        run_benchmark(args.n_time, args.n_lat, args.n_lon)
+    else:
+        print("Nothing to do; pass --benchmark.")
+
+
+if __name__ == "__main__":
+    main()
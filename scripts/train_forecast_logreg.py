@@ -14,7 +14,6 @@ Outputs:
 """
 from pathlib import Path
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 import joblib
 from sklearn.pipeline import Pipeline
@@ -22,21 +21,17 @@ from sklearn.impute import SimpleImputer
 from sklearn.preprocessing import StandardScaler
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import classification_report, confusion_matrix, ConfusionMatrixDisplay
+from dataset_loader import dataset_columns, load_splits
 from feature_config import get_feature_columns
 
 DATA    = Path("data/processed/dataset_forecast.parquet")
 OUT_DIR = Path("outputs"); OUT_DIR.mkdir(exist_ok=True)
 
-df = pd.read_parquet(DATA)
-df["year"] = df["year"].astype(int)
-
-train = df[df["year"] <= 2016]
-val   = df[(df["year"] >= 2017) & (df["year"] <= 2020)]
-test  = df[df["year"] >= 2021]
-
-FEATURES = get_feature_columns(df.columns)
+FEATURES = get_feature_columns(dataset_columns(DATA))
 TARGET = "target_label"
 
+train, val, test = load_splits(FEATURES, path=DATA)
+
 X_train, y_train = train[FEATURES], train[TARGET]
 X_val,   y_val   = val[FEATURES],   val[TARGET]
 X_test,  y_test  = test[FEATURES],  test[TARGET]
@@ -16,8 +16,9 @@ Spatial features added (one per SPI channel)
   spi6_nbr_mean  — same for SPI-6
   pr_nbr_mean    — same for raw precipitation at lag-1
 
-These are computed with xarray rolling (min_periods=1, centre=True) so every
-pixel has a value regardless of boundary position.
+They are read from the cached spatial feature cube (spatial_features.py),
+whose NaN-aware box means are truncated at the grid edge, so every pixel has
+a value regardless of boundary position.
 
 Time split: train ≤ 2016, val 2017–2020, test ≥ 2021  (matches all other scripts)
 
@@ -36,7 +37,6 @@ Inputs
 from pathlib import Path
 import numpy as np
 import pandas as pd
-import xarray as xr
 import matplotlib.pyplot as plt
 import xgboost as xgb
 from sklearn.isotonic import IsotonicRegression
@@ -45,6 +45,7 @@ from sklearn.metrics import (
 )
 from sklearn.utils.class_weight import compute_sample_weight
 from feature_config import get_feature_columns
+from spatial_features import NBR_MEAN_FEATURES, add_features, ensure_feature_cube
 
 BASE_DIR   = Path(__file__).resolve().parents[1]
 PROC       = BASE_DIR / "data" / "processed"
@@ -54,68 +55,18 @@ PARQUET    = PROC / "dataset_forecast.parquet"
 PR_FILE    = PROC / "chirps_v3_monthly_cvalley_1991_2026.nc"
 SPI_FILE   = PROC / "chirps_v3_monthly_cvalley_spi_1991_2026.nc"
 
-FEATURES_SPATIAL = [
-    "spi1_nbr_mean",
-    "spi3_nbr_mean",
-    "spi6_nbr_mean",
-    "pr_nbr_mean",
-]
+FEATURES_SPATIAL = list(NBR_MEAN_FEATURES)
 TARGET    = "target_label"
 LABEL_MAP = {-1: 0, 0: 1, 1: 2}
 
 # --------------------------------------------------------------------------
-# 1. Build spatial neighbourhood features from the gridded NetCDF
+# 1. Spatial neighbourhood features from the cached feature cube
 # --------------------------------------------------------------------------
-print("Building spatial-neighbourhood features ...")
-pr_ds  = xr.open_dataset(PR_FILE).load()
-spi_ds = xr.open_dataset(SPI_FILE).load()
-
-pr   = pr_ds["pr"].astype("float32")
-spi1 = spi_ds["spi1"].astype("float32")
-spi3 = spi_ds["spi3"].astype("float32")
-spi6 = spi_ds["spi6"].astype("float32")
-
-times = pr.time.values
-spi1  = spi1.sel(time=times)
-spi3  = spi3.sel(time=times)
-spi6  = spi6.sel(time=times)
-
-lat_name = "latitude" if "latitude" in pr.coords else "lat"
-lon_name = "longitude" if "longitude" in pr.coords else "lon"
-
-# 3×3 neighbourhood mean: rolling window of size 3 in both spatial dims
-def nbr_mean(da: xr.DataArray, name: str) -> xr.DataArray:
-    rolled = (
-        da.rolling({lat_name: 3, lon_name: 3}, min_periods=1, center=True)
-          .mean()
-    )
-    rolled.name = name
-    return rolled
-
-spi1_nbr = nbr_mean(spi1, "spi1_nbr_mean")
-spi3_nbr = nbr_mean(spi3, "spi3_nbr_mean")
-spi6_nbr = nbr_mean(spi6, "spi6_nbr_mean")
-pr_nbr   = nbr_mean(pr,   "pr_nbr_mean")
-
-# Stack to a flat DataFrame keyed by (time, latitude, longitude)
-nbr_ds = xr.Dataset({
-    "spi1_nbr_mean": spi1_nbr,
-    "spi3_nbr_mean": spi3_nbr,
-    "spi6_nbr_mean": spi6_nbr,
-    "pr_nbr_mean":   pr_nbr,
-}).stack(pixel=(lat_name, lon_name))
-
-nbr_df = nbr_ds.reset_index("pixel").to_dataframe()
-if "time" not in nbr_df.columns:
-    nbr_df = nbr_df.reset_index()
-
-nbr_df = nbr_df.rename(columns={lat_name: "latitude", lon_name: "longitude"})
-nbr_df["time"] = pd.to_datetime(nbr_df["time"])
-
-print(f"  Neighbourhood feature table: {nbr_df.shape}")
+print("Checking spatial-neighbourhood feature cube ...")
+NBR_CUBE = ensure_feature_cube(PR_FILE, SPI_FILE)
 
 # --------------------------------------------------------------------------
-# 2. Load the tabular forecasting dataset and merge neighbourhood features
+# 2. Load the tabular forecasting dataset and gather neighbourhood features
 # --------------------------------------------------------------------------
 print("Loading tabular dataset ...")
 df = pd.read_parquet(PARQUET)
@@ -123,19 +74,16 @@ df["time"] = pd.to_datetime(df["time"])
 df["year"] = df["year"].astype(int)
 
 # The neighbourhood features are keyed at t (lag-1 time step of the target),
-# which in build_dataset_forecast.py is the "time" column.
-df = df.merge(
-    nbr_df[["time", "latitude", "longitude"] + FEATURES_SPATIAL],
-    on=["time", "latitude", "longitude"],
-    how="left",
-)
+# which in build_dataset_forecast.py is the "time" column; month_index and
+# pixel_id index the cube directly, so no coordinate merge is needed.
+df = add_features(df, NBR_CUBE, FEATURES_SPATIAL)
 
 missing = df[FEATURES_SPATIAL].isna().sum().sum()
 if missing > 0:
     print(f"  Warning: {missing} NaN values in spatial features — filling with 0")
     df[FEATURES_SPATIAL] = df[FEATURES_SPATIAL].fillna(0.0)
 
-print(f"  Merged dataset shape: {df.shape}")
+print(f"  Dataset shape with spatial features: {df.shape}")
 FEATURES = get_feature_columns(df.columns) + FEATURES_SPATIAL
 
 # --------------------------------------------------------------------------
@@ -20,21 +20,19 @@ import matplotlib.pyplot as plt
 import xgboost as xgb
 from sklearn.metrics import classification_report, confusion_matrix, ConfusionMatrixDisplay
 from sklearn.utils.class_weight import compute_sample_weight
+from dataset_loader import dataset_columns, load_split
 from feature_config import get_feature_columns
 
 DATA    = Path("data/processed/dataset_forecast.parquet")
 OUT_DIR = Path("outputs"); OUT_DIR.mkdir(exist_ok=True)
 
-df = pd.read_parquet(DATA)
-df["year"] = df["year"].astype(int)
-
-train = df[df["year"] <= 2016]
-val   = df[(df["year"] >= 2017) & (df["year"] <= 2020)]
-test  = df[df["year"] >= 2021]
-
-FEATURES = get_feature_columns(df.columns)
+FEATURES = get_feature_columns(dataset_columns(DATA))
 TARGET = "target_label"
 
+train = load_split("train", FEATURES, path=DATA)
+val   = load_split("val", FEATURES, path=DATA)
+test  = load_split("test", FEATURES, path=DATA, columns=["time", "latitude", "longitude"])
+
 X_train, y_train = train[FEATURES], train[TARGET]
 X_val,   y_val   = val[FEATURES],   val[TARGET]
 X_test,  y_test  = test[FEATURES],  test[TARGET]
@@ -15,6 +15,10 @@ Outputs:
   results/validation/prism_validation_metrics.txt
   results/validation/prism_chirps_dry_fraction_comparison.png
 
+With the CHIRPS precipitation cube present, PRISM is also remapped onto the
+CHIRPS grid with cached conservative weights (regrid.py) for a pixel-level
+precipitation comparison.
+
 PRISM source:
   https://services.nacse.org/prism/data/get/us/4km/ppt/YYYYMM?format=nc
 """
@@ -33,11 +37,15 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import xarray as xr
-from scipy.stats import gamma, norm, pearsonr, spearmanr
+from scipy.stats import norm, pearsonr, spearmanr
 from shapely import contains_xy
 from shapely.geometry import shape
 from shapely.ops import unary_union
 
+from grid_registry import month_index
+from regrid import regrid
+from spi_engine import fit_gamma, gamma_spi
+
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 RAW_DIR = PROJECT_ROOT / "data" / "raw" / "prism" / "monthly" / "ppt"
@@ -48,6 +56,7 @@ PROCESSED.mkdir(parents=True, exist_ok=True)
 RESULTS.mkdir(parents=True, exist_ok=True)
 
 CHIRPS_SPI = PROCESSED / "chirps_v3_monthly_cvalley_spi_1991_2026.nc"
+CHIRPS_PR = PROCESSED / "chirps_v3_monthly_cvalley_1991_2026.nc"
 CV_GEOMETRY = PROJECT_ROOT / "data" / "metadata" / "dwr" / "central_valley_b118_groundwater_basins.geojson"
 XGB_SPATIAL_PROBS = PROJECT_ROOT / "outputs" / "xgb_spatial_test_probs.npz"
 
@@ -72,6 +81,12 @@ def parse_args() -> argparse.Namespace:
         help="Rebuild processed PRISM NetCDF/SPI even if cached.",
     )
     parser.add_argument("--chirps-spi", type=Path, default=CHIRPS_SPI)
+    parser.add_argument(
+        "--chirps-pr",
+        type=Path,
+        default=CHIRPS_PR,
+        help="CHIRPS precipitation cube for the pixel-level comparison (skipped if missing).",
+    )
     parser.add_argument("--geometry", type=Path, default=CV_GEOMETRY)
     parser.add_argument("--xgb-spatial-probs", type=Path, default=XGB_SPATIAL_PROBS)
     return parser.parse_args()
@@ -197,36 +212,23 @@ def compute_spi1(
         base_idx = idx[(years[idx] >= baseline_start_year) & (years[idx] <= baseline_end_year)]
         if len(base_idx) < 8:
             continue
-        month_values = flat[idx, :]
-        base_values = flat[base_idx, :]
-        month_out = np.full(month_values.shape, np.nan, dtype="float32")
-        for pixel in range(month_values.shape[1]):
+        month_values = np.clip(flat[idx, :], 0.0, None)
+        base_values = np.clip(flat[base_idx, :], 0.0, None)
+        params = fit_gamma(base_values, min_valid=8, min_nonzero=4)
+        month_out = gamma_spi(month_values, params).astype("float32")
+        # Pixels with enough baseline values but no usable gamma fit (too few
+        # positive values or zero spread) fall back to empirical plotting positions.
+        n_valid = np.isfinite(base_values).sum(axis=0)
+        for pixel in np.flatnonzero((n_valid >= 8) & ~params.valid):
             base = base_values[:, pixel]
             base = base[np.isfinite(base)]
-            if len(base) < 8:
-                continue
-            base = np.clip(base, 0.0, None)
-            positive = base[base > 0]
-            p_zero = 1.0 - (len(positive) / len(base))
             vals = month_values[:, pixel]
             finite = np.isfinite(vals)
             if not finite.any():
                 continue
-            vals_clip = np.clip(vals[finite], 0.0, None)
-            if len(positive) < 4 or float(np.nanstd(positive)) <= 0:
-                ranks = np.searchsorted(np.sort(base), vals_clip, side="right")
-                cdf = (ranks + 0.5) / (len(base) + 1.0)
-            else:
-                try:
-                    a, loc, scale = gamma.fit(positive, floc=0)
-                    cdf = p_zero + (1.0 - p_zero) * gamma.cdf(vals_clip, a, loc=loc, scale=scale)
-                except Exception:
-                    ranks = np.searchsorted(np.sort(base), vals_clip, side="right")
-                    cdf = (ranks + 0.5) / (len(base) + 1.0)
-            cdf = np.clip(cdf, 1e-6, 1.0 - 1e-6)
-            z = np.full(vals.shape, np.nan, dtype="float32")
-            z[finite] = norm.ppf(cdf).astype("float32")
-            month_out[:, pixel] = z
+            ranks = np.searchsorted(np.sort(base), vals[finite], side="right")
+            cdf = np.clip((ranks + 0.5) / (len(base) + 1.0), 1e-6, 1.0 - 1e-6)
+            month_out[finite, pixel] = norm.ppf(cdf).astype("float32")
         out[idx, :, :] = month_out.reshape(len(idx), n_lat, n_lon)
         print(f"  PRISM SPI-1 month {month:02d}/12 done")
 
@@ -275,6 +277,44 @@ def load_chirps_monthly(chirps_spi_path: Path, geom) -> pd.DataFrame:
     return dry
 
 
+def pixel_agreement(prism_ppt: xr.DataArray, chirps_pr_path: Path, geom) -> pd.DataFrame:
+    """
+    Monthly CHIRPS vs PRISM precipitation agreement on the CHIRPS grid.
+
+    PRISM 4 km is remapped conservatively onto the 0.05° CHIRPS grid with
+    cached weights (regrid.py); basin-edge cells are averaged over the part of
+    the cell PRISM covers.
+    """
+    with xr.open_dataset(chirps_pr_path) as ds:
+        chirps = ds["pr"].astype("float32").load()
+    chirps_months = month_index(chirps["time"].values)
+    prism_months = month_index(prism_ppt["time"].values)
+    common = np.intersect1d(chirps_months, prism_months)
+    chirps = chirps.isel(time=np.flatnonzero(np.isin(chirps_months, common)))
+    prism = prism_ppt.isel(time=np.flatnonzero(np.isin(prism_months, common)))
+    prism = regrid(prism, chirps["latitude"], chirps["longitude"], method="conservative")
+
+    mask = geometry_mask(chirps["latitude"].values, chirps["longitude"].values, geom).values.ravel()
+    a = chirps.values.reshape(len(common), -1)[:, mask]
+    b = prism.values.reshape(len(common), -1)[:, mask]
+    valid = np.isfinite(a) & np.isfinite(b)
+    n = valid.sum(axis=1)
+    a0, b0 = np.where(valid, a, 0.0), np.where(valid, b, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_a, mean_b = a0.sum(axis=1) / n, b0.sum(axis=1) / n
+        da = np.where(valid, a - mean_a[:, None], 0.0)
+        db = np.where(valid, b - mean_b[:, None], 0.0)
+        corr = (da * db).sum(axis=1) / np.sqrt((da**2).sum(axis=1) * (db**2).sum(axis=1))
+    return pd.DataFrame(
+        {
+            "month_dt": pd.to_datetime(chirps["time"].values).to_period("M").to_timestamp(),
+            "pixel_precip_corr": corr,
+            "pixel_precip_bias": mean_a - mean_b,
+            "pixel_n": n,
+        }
+    )
+
+
 def pair_stats(a: pd.Series, b: pd.Series) -> dict[str, float]:
     valid = a.notna() & b.notna()
     av = a[valid].astype(float)
@@ -356,6 +396,14 @@ def write_metrics(
         ).mean()
         rows.append(f"  Test agreement dry_frac >= {threshold:.2f}: {agree:.3f}")
 
+    if "pixel_precip_corr" in comparison.columns:
+        rows.extend([
+            "",
+            "CHIRPS vs PRISM precipitation on the CHIRPS grid (PRISM remapped conservatively):",
+            f"  Median monthly spatial Pearson r : {comparison['pixel_precip_corr'].median():.3f}",
+            f"  Mean basin bias CHIRPS-PRISM (mm): {comparison['pixel_precip_bias'].mean():.2f}",
+        ])
+
     if not model_eval.empty:
         rows.extend(["", "XGBoost-Spatial forecast evaluated against PRISM SPI-1 dry fraction:"])
         for key, value in model_eval.iloc[0].items():
@@ -450,6 +498,10 @@ def main() -> None:
         .merge(chirps, on="month_dt", how="inner")
         .sort_values("month_dt")
     )
+    if args.chirps_pr.exists():
+        print("Comparing CHIRPS and PRISM pixel by pixel on the CHIRPS grid")
+        pixels = pixel_agreement(prism_ds["ppt"], args.chirps_pr, geom)
+        comparison = comparison.merge(pixels, on="month_dt", how="left")
     comparison["year"] = comparison["month_dt"].dt.year.astype(int)
     comparison["month"] = comparison["month_dt"].dt.month.astype(int)
     comparison_path = RESULTS / "prism_chirps_monthly_comparison.csv"
@@ -45,8 +45,8 @@ import pandas as pd
 import xarray as xr
 import xgboost as xgb
 import matplotlib.pyplot as plt
-from scipy.stats import gamma as gamma_dist, norm
 from feature_config import get_feature_columns
+from spi_engine import spi_by_calendar_month
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 
@@ -205,41 +205,6 @@ def standardize_era5_tp(ds: xr.Dataset) -> xr.DataArray:
     return tp
 
 
-def precip_to_spi(series: np.ndarray, baseline_mask: np.ndarray) -> np.ndarray:
-    """Gamma-fit SPI (same method as make_spi_labels.py)."""
-    base = series[baseline_mask]
-    base = base[~np.isnan(base)]
-
-    spi = np.full(len(series), np.nan, dtype=np.float64)
-
-    if len(base) < 10:
-        return spi
-
-    p_zero = np.mean(base == 0)
-    nonzero = base[base > 0]
-
-    if len(nonzero) < 5:
-        return spi
-
-    fit_alpha, _, fit_beta = gamma_dist.fit(nonzero, floc=0)
-
-    for i, val in enumerate(series):
-        if np.isnan(val):
-            continue
-
-        if val == 0:
-            cdf_val = p_zero
-        else:
-            cdf_val = p_zero + (1.0 - p_zero) * gamma_dist.cdf(
-                val, fit_alpha, scale=fit_beta
-            )
-
-        cdf_val = np.clip(cdf_val, 1e-6, 1 - 1e-6)
-        spi[i] = norm.ppf(cdf_val)
-
-    return spi
-
-
 def brier_score(y_true_bin: np.ndarray, prob: np.ndarray) -> float:
     return float(np.mean((prob - y_true_bin) ** 2))
 
@@ -288,24 +253,8 @@ baseline_mask = (times.year >= BASELINE_START) & (times.year <= BASELINE_END)
 tp_vals = tp.values.astype(np.float64)  # (time, lat, lon)
 
 # ── compute ERA5-Land SPI-1 ───────────────────────────────────────────────────
-print("Computing ERA5-Land SPI-1 (this may take a few minutes)...")
-spi1_era5 = np.full(tp_vals.shape, np.nan, dtype=np.float32)
-
-for m in range(1, 13):
-    month_idx = np.where(months == m)[0]
-    base_idx  = np.where(baseline_mask & (months == m))[0]
-
-    month_baseline_mask = np.zeros(len(month_idx), dtype=bool)
-    month_baseline_positions = np.where(np.isin(month_idx, base_idx))[0]
-    month_baseline_mask[month_baseline_positions] = True
-
-    for j in range(nlat):
-        for k in range(nlon):
-            series_m = tp_vals[month_idx, j, k]
-            spi_m = precip_to_spi(series_m, month_baseline_mask)
-            spi1_era5[month_idx, j, k] = spi_m.astype(np.float32)
-
-    print(f"  ERA5 SPI-1 month {m:02d}/12 done")
+print("Computing ERA5-Land SPI-1 (vectorized gamma fit, same method as make_spi_labels.py)...")
+spi1_era5 = spi_by_calendar_month(tp_vals, months.to_numpy(), baseline_mask)
 
 # drought labels
 label_era5 = np.where(
@@ -22,11 +22,11 @@ from argparse import ArgumentParser
 from pathlib import Path
 import numpy as np
 import pandas as pd
-import xarray as xr
 import xgboost as xgb
 import shap
 import matplotlib.pyplot as plt
 from feature_config import get_feature_columns
+from spatial_features import NBR_MEAN_FEATURES, add_features, ensure_feature_cube
 
 DATA        = Path("data/processed/dataset_forecast.parquet")
 PR_FILE     = Path("data/processed/chirps_v3_monthly_cvalley_1991_2026.nc")
@@ -41,12 +41,7 @@ TARGET = "target_label"
 
 label_map = {-1: 0, 0: 1, 1: 2}
 DRY_IDX   = label_map[-1]   # 0
-FEATURES_SPATIAL = [
-    "spi1_nbr_mean",
-    "spi3_nbr_mean",
-    "spi6_nbr_mean",
-    "pr_nbr_mean",
-]
+FEATURES_SPATIAL = list(NBR_MEAN_FEATURES)
 
 
 def parse_args() -> ArgumentParser:
@@ -75,41 +70,8 @@ def load_dataset() -> pd.DataFrame:
 
 
 def add_spatial_features(df: pd.DataFrame) -> pd.DataFrame:
-    print("Building spatial-neighbourhood features...")
-    pr_ds = xr.open_dataset(PR_FILE).load()
-    spi_ds = xr.open_dataset(SPI_FILE).load()
-
-    pr = pr_ds["pr"].astype("float32")
-    spi1 = spi_ds["spi1"].astype("float32").sel(time=pr.time.values)
-    spi3 = spi_ds["spi3"].astype("float32").sel(time=pr.time.values)
-    spi6 = spi_ds["spi6"].astype("float32").sel(time=pr.time.values)
-
-    lat_name = "latitude" if "latitude" in pr.coords else "lat"
-    lon_name = "longitude" if "longitude" in pr.coords else "lon"
-
-    def nbr_mean(da: xr.DataArray, name: str) -> xr.DataArray:
-        out = da.rolling({lat_name: 3, lon_name: 3}, min_periods=1, center=True).mean()
-        out.name = name
-        return out
-
-    nbr_ds = xr.Dataset({
-        "spi1_nbr_mean": nbr_mean(spi1, "spi1_nbr_mean"),
-        "spi3_nbr_mean": nbr_mean(spi3, "spi3_nbr_mean"),
-        "spi6_nbr_mean": nbr_mean(spi6, "spi6_nbr_mean"),
-        "pr_nbr_mean": nbr_mean(pr, "pr_nbr_mean"),
-    }).stack(pixel=(lat_name, lon_name))
-
-    nbr_df = nbr_ds.reset_index("pixel").to_dataframe()
-    if "time" not in nbr_df.columns:
-        nbr_df = nbr_df.reset_index()
-    nbr_df = nbr_df.rename(columns={lat_name: "latitude", lon_name: "longitude"})
-    nbr_df["time"] = pd.to_datetime(nbr_df["time"])
-
-    out = df.merge(
-        nbr_df[["time", "latitude", "longitude"] + FEATURES_SPATIAL],
-        on=["time", "latitude", "longitude"],
-        how="left",
-    )
+    print("Gathering spatial-neighbourhood features...")
+    out = add_features(df, ensure_feature_cube(PR_FILE, SPI_FILE), FEATURES_SPATIAL)
     missing = int(out[FEATURES_SPATIAL].isna().sum().sum())
     if missing:
         print(f"  Warning: {missing:,} missing spatial feature values; filling with 0.")